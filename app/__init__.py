@@ -1,23 +1,42 @@
 from flask import Flask, g, jsonify
 from flask_cors import CORS
-from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, scoped_session
 from app.config import config
 import logging
 from app.db_utils import get_db_stats, db_connection_logger
-from app.extensions import db, socketio
+from app.utils.database import engine_options, pool_monitor
+from app.extensions import db, socketio, scheduler, cache
 from app.socket_events import socketio
+from app.services.liveness_service import liveness_tracker
+from app.services.rollup_service import schedule_rollup_refresh
+from app.services.sensor_metrics_service import schedule_sensor_metrics_flush
+from app.services.retention_service import schedule_retention
+from app.services.partition_service import schedule_partition_maintenance
+from app.services.controller_deletion_service import exclude_deleted_controllers, schedule_controller_purge
+from app.services.replica_service import replica_router, RoutingSession
+from app.services.response_cache import init_response_cache
 
 def create_app(config_name):
     app = Flask(__name__)
     app.config.from_object(config[config_name])
 
-    # Create a single engine based on the config
-    engine = create_engine(app.config['SQLALCHEMY_DATABASE_URI'], **app.config['POOL_OPTIONS'])
-    app.db_factory = scoped_session(sessionmaker(bind=engine))
+    # A single engine (and pool) per process, created by Flask-SQLAlchemy and shared with db_factory
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config, app.config['SQLALCHEMY_DATABASE_URI'])
+    db.init_app(app)
+    with app.app_context():
+        engine = db.engine
+    pool_monitor.register('primary', engine)
+    # Sessions read from the replica during dashboard GET requests, if one is configured
+    session_factory = sessionmaker(bind=engine, class_=RoutingSession)
+    # Soft-deleted controllers are invisible to the app while they are purged
+    exclude_deleted_controllers(session_factory)
+    app.db_factory = scoped_session(session_factory)
 
     # Filtrar y limpiar CORS_ORIGINS
-    db.init_app(app)
+    liveness_tracker.init_app(app)
+    replica_router.init_app(app, engine)
+    cache.init_app(app)
+    init_response_cache(app)
 
     
     # Define allowed origins
@@ -64,6 +83,20 @@ def create_app(config_name):
             engineio_logger=True
         )
 
+    # Background jobs
+    if app.config.get('SCHEDULER_ENABLED') and not scheduler.running:
+        if app.config.get('ROLLUP_REFRESH_SECONDS'):
+            schedule_rollup_refresh(app, scheduler)
+        if app.config.get('SENSOR_METRICS_FLUSH_SECONDS'):
+            schedule_sensor_metrics_flush(app, scheduler)
+        if app.config.get('RETENTION_INTERVAL_SECONDS'):
+            schedule_retention(app, scheduler)
+        if app.config.get('CONTROLLER_PURGE_SECONDS'):
+            schedule_controller_purge(app, scheduler)
+        if app.config.get('SIGNALS_PARTITIONED') and app.config.get('PARTITION_MAINTENANCE_SECONDS'):
+            schedule_partition_maintenance(app, scheduler)
+        scheduler.start()
+
     @app.teardown_appcontext
     def shutdown_session(exception=None):
         app.db_factory.remove()
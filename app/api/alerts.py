@@ -2,10 +2,13 @@ from flask import Blueprint, request, jsonify, current_app
 from ..models import Aviso, AvisoLog, Controlador, Signal
 from ..extensions import db, socketio
 from ..services.alert_service import AlertService
+from ..services.response_cache import invalidate_controller
+from ..services.replica_service import replica_router
+from ..utils.pagination import encode_cursor, decode_cursor, page_size
 import logging
 from datetime import datetime, timedelta, timezone
-from sqlalchemy import desc, and_, or_
-from sqlalchemy.orm import joinedload
+from sqlalchemy import select, desc, and_, or_, true, tuple_
+from sqlalchemy.orm import joinedload, aliased
 from typing import Optional
 
 alerts_bp = Blueprint('alerts', __name__)
@@ -100,6 +103,8 @@ def handle_alerts(controlador_id):
             
             session.add(new_alert)
             session.commit()
+            invalidate_controller(controlador_id, controlador.empresa_id, alerts=True)
+            replica_router.mark_written(controlador_id, controlador.empresa_id)
 
             socketio.emit('alert_created', {
                 'controlador_id': controlador_id,
@@ -140,6 +145,8 @@ def handle_alert(alert_id):
             alert.updated_at = datetime.utcnow()
             
             session.commit()
+            invalidate_controller(alert.controlador_id, alert.controlador.empresa_id, alerts=True)
+            replica_router.mark_written(alert.controlador_id, alert.controlador.empresa_id)
 
             socketio.emit('alert_updated', {
                 'controlador_id': alert.controlador_id,
@@ -149,8 +156,11 @@ def handle_alert(alert_id):
             return jsonify(alert.to_dict())
 
         elif request.method == 'DELETE':
+            empresa_id = alert.controlador.empresa_id
             session.delete(alert)
             session.commit()
+            invalidate_controller(alert.controlador_id, empresa_id, alerts=True)
+            replica_router.mark_written(alert.controlador_id, empresa_id)
 
             socketio.emit('alert_deleted', {
                 'controlador_id': alert.controlador_id,
@@ -184,9 +194,12 @@ def delete_alert(alert_id):
             return jsonify({'error': 'Alert not found'}), 404
 
         controlador_id = alert.controlador_id  # Store this for the event emission
+        empresa_id = alert.controlador.empresa_id
         
         session.delete(alert)
         session.commit()
+        invalidate_controller(controlador_id, empresa_id, alerts=True)
+        replica_router.mark_written(controlador_id, empresa_id)
         
         # Emit alert deleted event
         socketio.emit('alert_deleted', {
@@ -273,42 +286,62 @@ def get_active_alerts(controlador_id):
 
 @alerts_bp.route('/controlador/<controlador_id>/alert-logs', methods=['GET'])
 def get_alert_logs(controlador_id):
+    """
+    Alert logs of a controller in the last `days`, newest first, `limit` per page.
+    Pass the returned next_cursor as `cursor` for the next page (keyset on
+    (triggered_at, id), so deep pages cost the same as the first one).
+    """
     session = current_app.db_factory()
     try:
         # Get optional query parameters
-        limit = request.args.get('limit', 100, type=int)
-        days = request.args.get('days', 7, type=int)
-        
+        try:
+            limit = page_size(request.args.get('limit', type=int))
+            days = request.args.get('days', 7, type=int)
+            after = decode_cursor(request.args.get('cursor'), str)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
         # Calculate the date range
         end_date = datetime.now(timezone.utc)
         start_date = end_date - timedelta(days=days)
 
-        # Get logs with alert details
-        logs = session.query(AvisoLog).\
-            join(Aviso).\
-            filter(
-                Aviso.controlador_id == controlador_id,
-                AvisoLog.triggered_at.between(start_date, end_date)
-            ).\
-            order_by(desc(AvisoLog.triggered_at)).\
-            limit(limit).\
+        # Top limit + 1 logs of each of the controller's alerts (one index range
+        # each on (aviso_id, triggered_at, id)), merged and cut to the page
+        filters = [AvisoLog.aviso_id == Aviso.id, AvisoLog.triggered_at.between(start_date, end_date)]
+        if after is not None:
+            filters.append(tuple_(AvisoLog.triggered_at, AvisoLog.id) < tuple_(*after))
+        recent = select(AvisoLog).\
+            where(*filters).\
+            order_by(AvisoLog.triggered_at.desc(), AvisoLog.id.desc()).\
+            limit(limit + 1).\
+            lateral('recent_logs')
+        recent_log = aliased(AvisoLog, recent)
+
+        rows = session.query(recent_log, Aviso.name, Aviso.description).\
+            select_from(Aviso).\
+            join(recent, true()).\
+            filter(Aviso.controlador_id == controlador_id).\
+            order_by(recent.c.triggered_at.desc(), recent.c.id.desc()).\
+            limit(limit + 1).\
             all()
 
-        # Convert logs to dictionary format
+        # Convert logs to dictionary format, including alert name and description
         processed_logs = []
-        for log in logs:
+        for log, name, description in rows[:limit]:
             log_dict = log.to_dict()
-            
-            # Include alert name and description
-            if log.aviso:
-                log_dict['name'] = log.aviso.name
-                log_dict['description'] = log.aviso.description
-
+            log_dict['name'] = name
+            log_dict['description'] = description
             processed_logs.append(log_dict)
 
+        next_cursor = None
+        if len(rows) > limit:
+            last_log = rows[limit - 1][0]
+            next_cursor = encode_cursor(last_log.triggered_at, last_log.id)
+
         return jsonify({
             'logs': processed_logs,
             'count': len(processed_logs),
+            'next_cursor': next_cursor,
             'start_date': start_date.isoformat(),
             'end_date': end_date.isoformat()
         })
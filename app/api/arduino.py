@@ -3,6 +3,9 @@ from ..models import Controlador, Signal, Aviso, AvisoLog
 from ..extensions import db, socketio
 from ..utils.sensor_utils import add_sensor_data
 from ..services.alert_service import AlertService
+from ..services.liveness_service import liveness_tracker
+from ..services.sensor_metrics_service import sensor_metrics_accumulator
+from ..services.response_cache import invalidate_controller
 from flask_mail import Mail, Message
 import logging
 import traceback
@@ -86,6 +89,8 @@ def receive_data():
         session.add(sensor_data)
         session.commit()
         logger.info(f"Added new sensor data with ID: {sensor_data.id}")
+        liveness_tracker.touch(controlador_id, sensor_data.tstamp)
+        invalidate_controller(controlador_id, controlador.empresa_id, signal_id=sensor_data.id)
 
         # Get previous signal for comparison
         previous_signal = session.query(Signal).\
@@ -93,6 +98,7 @@ def receive_data():
             order_by(Signal.tstamp.desc()).\
             offset(1).\
             first()
+        sensor_metrics_accumulator.add(controlador, sensor_data, previous_signal)
 
         # Process alerts
         alert_service = AlertService(session)
@@ -103,6 +109,8 @@ def receive_data():
             previous_signal
         )
         logger.info(f"Alert processing complete. New alerts: {len(new_alerts)}, Resolved: {len(resolved_alerts)}")
+        if new_alerts or resolved_alerts:
+            invalidate_controller(controlador_id, controlador.empresa_id, alerts=True)
 
         # Process email notifications
         notification_email = current_app.config.get('NOTIFICATION_EMAIL')
@@ -1,17 +1,38 @@
-from flask import Blueprint, current_app, request, make_response, jsonify
+from flask import Blueprint, current_app, request, make_response, jsonify, Response, stream_with_context
 from flask_restx import Api, Resource, fields
-from ..models import Empresa, Controlador, Signal, Aviso, AvisoLog, SensorMetrics
+from ..models import Empresa, Controlador, Signal, Aviso, SensorMetrics, RetentionPolicy
 from sqlalchemy.sql import func, case, and_, text
-from sqlalchemy import cast, String
+from sqlalchemy import select, cast, String
 from sqlalchemy.exc import SQLAlchemyError
-from datetime import datetime, timedelta
+from werkzeug.exceptions import HTTPException
+from datetime import datetime, timedelta, timezone
 import pytz
 from flask_cors import CORS, cross_origin
 import uuid
 from sqlalchemy.exc import IntegrityError
 import logging
 import json
+import numpy as np
 from ..services.service_analytics import CycleAnalyticsService
+from ..services.sensor_analytics import (
+    sensor_agreement_matrix, sensor_phi_matrix, change_point_indices, duty_cycle_buckets,
+    connection_intervals, split_intervals_by_day, SECONDS_PER_DAY
+)
+from ..services.liveness_service import liveness_tracker
+from ..services.sensor_metrics_service import lifetime_metrics
+from ..services.retention_service import effective_policy, compacted_until
+from ..services.replica_service import replica_router, route_reads_to_replica
+from ..services.controller_deletion_service import start_controller_purge, PROGRESS_EVENT
+from ..services.rollup_service import rollup_sensor_on_seconds, rollup_active_seconds_by_hour
+from ..services.timescale_service import sensor_sample_stats
+from ..services.export_service import signals_csv, signals_parquet, parquet_available, EXPORT_FORMATS
+from ..services.response_cache import cached_response, invalidate_controller, invalidate_empresa
+from ..services.signal_queries import (
+    latest_signals_by_controller, recent_signal_rows, signal_page, sensor_state_arrays,
+    reading_epochs, SENSOR_COLUMNS, CONNECTION_TIMEOUT_SECONDS
+)
+from ..utils.serialization import output_json, compress_response
+from ..utils.pagination import encode_cursor, decode_cursor, page_size, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
 
 dashboard = Blueprint('dashboard', __name__)
 CORS(dashboard)
@@ -30,16 +51,48 @@ def after_request(response):
         response.headers.add('Access-Control-Allow-Credentials', 'true')
     return response
 
+dashboard.after_request(compress_response)
+dashboard.before_request(route_reads_to_replica)
+
 
 logger = logging.getLogger(__name__)
 def handle_database_error(e):
     logger.error(f"Database error: {str(e)}")
     return jsonify({"error": "Database connection error. Please try again later."}), 503
 
+# Points per sensor returned by SensorActivity
+DEFAULT_ACTIVITY_POINTS = 1000
+MAX_ACTIVITY_POINTS = 10000
+
+def parse_date_range(default_span):
+    """
+    Read the start_date / end_date query args (ISO 8601) as UTC datetimes.
+    Naive values are taken as UTC; missing ones default to the `default_span`
+    ending now. Raises ValueError on malformed or inverted ranges.
+    """
+    def to_utc(value):
+        dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        return pytz.UTC.localize(dt) if dt.tzinfo is None else dt.astimezone(pytz.UTC)
+
+    end_date = to_utc(request.args['end_date']) if 'end_date' in request.args else datetime.now(pytz.UTC)
+    start_date = to_utc(request.args['start_date']) if 'start_date' in request.args else end_date - default_span
+    if end_date <= start_date:
+        raise ValueError("end_date must be after start_date")
+    return start_date, end_date
+
+def controller_rows(session, *filters):
+    """Controllers matching filters as plain dicts with the controlador_model scalar fields"""
+    rows = session.execute(
+        select(Controlador.id, Controlador.name, Controlador.empresa_id, Controlador.config).where(*filters)
+    ).all()
+    return [dict(row._mapping) for row in rows]
+
 api = Api(dashboard, version='1.0', title='Dashboard API',
     description='API for IoT Dashboard',
     doc='/doc/'
 )
+# Resources returning plain dicts/lists are serialized with orjson when available
+api.representation('application/json')(output_json)
 
 # Define namespaces
 ns_dashboard = api.namespace('dashboard', description='Dashboard operations')
@@ -78,8 +131,9 @@ changes_model = api.model('Changes', {
 })
 
 activity_model = api.model('Activity', {
-    'timestamp': fields.DateTime(description='Timestamp of activity'),
-    'value': fields.Boolean(description='Sensor value')
+    'timestamp': fields.DateTime(description='Timestamp of activity (bucket start in buckets mode)'),
+    'value': fields.Boolean(description='Sensor value (majority value in buckets mode)'),
+    'duty_cycle': fields.Float(description='Share of connected time the sensor was on (buckets mode only)')
 })
 
 sensor_activity_model = api.model('SensorActivity', {
@@ -119,6 +173,11 @@ config_model = api.model('Config', {
     'config': fields.Raw(description='Controller configuration')
 })
 
+signal_page_model = api.model('SignalPage', {
+    'signals': fields.List(fields.Nested(signal_model)),
+    'next_cursor': fields.String(description='Pass as cursor to get the next page; null on the last page')
+})
+
 
 @ns_dashboard.route("/")
 class DashboardTest(Resource):
@@ -133,22 +192,19 @@ class DashboardTest(Resource):
 @ns_dashboard.route('/empresa/<string:empresa_id>/dashboard')
 class DashboardData(Resource):
     @ns_dashboard.doc('get_dashboard_data')
-    @ns_dashboard.marshal_list_with(controlador_model)
+    @ns_dashboard.response(200, 'Success', [controlador_model])
+    @cached_response('empresa')
     def get(self, empresa_id):
         """Fetch dashboard data for a company"""
         try:
             with current_app.db_factory() as session:
-                controladores = session.query(Controlador).filter_by(empresa_id=empresa_id).all()
-                
-                controladores_list = []
+                # Built from row tuples in the shape of controlador_model, no marshalling pass
+                controladores = controller_rows(session, Controlador.empresa_id == empresa_id)
+                recent_signals = recent_signal_rows(session, [c['id'] for c in controladores], limit=10)
                 for controlador in controladores:
-                    signals = session.query(Signal).filter_by(controlador_id=controlador.id).order_by(Signal.tstamp.desc()).limit(10).all()
-                    
-                    controlador_dict = controlador.to_dict()
-                    controlador_dict['señales'] = [signal.to_dict() for signal in signals]
-                    controladores_list.append(controlador_dict)
+                    controlador['señales'] = recent_signals[controlador['id']]
 
-                return controladores_list
+                return controladores
         except SQLAlchemyError as e:
             return handle_database_error(e)
         except Exception as e:
@@ -194,16 +250,16 @@ class SensorConnectionData(Resource):
             logger.error(f"Unexpected error: {str(e)}")
             return jsonify({"error": "An unexpected error occurred. Please try again later."}), 500
 
-@ns_dashboard.route('/empresa/<string:id>/connected_stats')
+@ns_dashboard.route('/empresa/<string:empresa_id>/connected_stats')
 class ConnectedStats(Resource):
     @ns_dashboard.doc('get_connected_stats')
-    def get(self, id):
+    def get(self, empresa_id):
         """Get connected and disconnected controller counts for a company"""
         try:
             with current_app.db_factory() as session:
-                controladores = session.query(Controlador).filter_by(empresa_id=id).all()
-                connected_count = sum(1 for controlador in controladores if is_controlador_connected(controlador, session))
-                disconnected_count = len(controladores) - connected_count
+                controlador_ids = [row.id for row in session.query(Controlador.id).filter_by(empresa_id=empresa_id)]
+                connected_count = liveness_tracker.count_connected(session, controlador_ids)
+                disconnected_count = len(controlador_ids) - connected_count
 
                 return {
                     "connected": connected_count,
@@ -218,21 +274,48 @@ class ConnectedStats(Resource):
 @ns_controlador.route('/<string:controlador_id>/detail')
 class ControllerDetail(Resource):
     @ns_controlador.doc('get_controller_detail')
-    @ns_controlador.marshal_with(controlador_model)
+    @ns_controlador.response(200, 'Success', controlador_model)
+    @cached_response('controlador')
     def get(self, controlador_id):
         """Fetch details for a specific controller"""
         try:
             with current_app.db_factory() as session:
-                controlador = session.query(Controlador).filter_by(id=controlador_id).first()
-                if not controlador:
+                controladores = controller_rows(session, Controlador.id == controlador_id)
+                if not controladores:
                     api.abort(404, "Controller not found")
 
-                signals = session.query(Signal).filter_by(controlador_id=controlador_id).order_by(Signal.tstamp.desc()).limit(10).all()
-                
-                controlador_data = controlador.to_dict()
-                controlador_data['señales'] = [signal.to_dict() for signal in signals]
-            
+                controlador_data = controladores[0]
+                controlador_data['señales'] = recent_signal_rows(session, [controlador_id], limit=10)[controlador_id]
+
                 return controlador_data
+        except HTTPException:
+            raise
+        except SQLAlchemyError as e:
+            return handle_database_error(e)
+        except Exception as e:
+            logger.error(f"Unexpected error: {str(e)}")
+            return jsonify({"error": "An unexpected error occurred. Please try again later."}), 500
+
+@ns_controlador.route('/<string:controlador_id>/signals')
+class ControllerSignals(Resource):
+    @ns_controlador.doc('get_controller_signals')
+    @ns_controlador.param('limit', f'Signals per page (default {DEFAULT_PAGE_SIZE}, at most {MAX_PAGE_SIZE})')
+    @ns_controlador.param('cursor', 'next_cursor of the previous page')
+    @ns_controlador.response(200, 'Success', signal_page_model)
+    @cached_response('controlador')
+    def get(self, controlador_id):
+        """Page through the signals of a controller, newest first"""
+        try:
+            limit = page_size(request.args.get('limit', type=int))
+            before = decode_cursor(request.args.get('cursor'), int)
+            with current_app.db_factory() as session:
+                signals, next_key = signal_page(session, controlador_id, limit, before)
+            return {
+                'signals': signals,
+                'next_cursor': encode_cursor(*next_key) if next_key else None
+            }
+        except ValueError as e:
+            api.abort(400, str(e))
         except SQLAlchemyError as e:
             return handle_database_error(e)
         except Exception as e:
@@ -242,6 +325,7 @@ class ControllerDetail(Resource):
 @ns_controlador.route('/<string:controlador_id>/changes')
 class ControllerChanges(Resource):
     @ns_controlador.doc('get_controller_changes')
+    @cached_response('controlador')
     @ns_controlador.marshal_list_with(changes_model)
     def get(self, controlador_id):
         """Fetch changes for a specific controller"""
@@ -258,29 +342,57 @@ class ControllerChanges(Resource):
 @ns_controlador.route('/<string:controlador_id>/sensor_activity')
 class SensorActivity(Resource):
     @ns_controlador.doc('get_sensor_activity')
-    @ns_controlador.marshal_with(sensor_activity_model)
+    @ns_controlador.param('mode', "'changes' (first/last reading plus every transition, default) or 'buckets' (duty cycle per time bucket)")
+    @ns_controlador.param('max_points', f'Upper bound on points per sensor (default {DEFAULT_ACTIVITY_POINTS}); changes mode falls back to buckets above it')
+    @ns_controlador.param('resolution', 'Bucket size in seconds for buckets mode; raised if it would exceed max_points')
+    @ns_controlador.param('start_date', 'Window start (ISO 8601, UTC if naive); defaults to end_date - 24h')
+    @ns_controlador.param('end_date', 'Window end (ISO 8601, UTC if naive); defaults to now')
+    @ns_controlador.response(200, 'Success', sensor_activity_model)
+    @cached_response('controlador', sliding_window=True)
     def get(self, controlador_id):
-        """Fetch sensor activity for a specific controller"""
+        """Fetch sensor activity for a specific controller, downsampled to at most max_points per sensor"""
         try:
+            mode = request.args.get('mode', 'changes')
+            if mode not in ('changes', 'buckets'):
+                raise ValueError("mode must be 'changes' or 'buckets'")
+            max_points = request.args.get('max_points', DEFAULT_ACTIVITY_POINTS, type=int)
+            if not 2 <= max_points <= MAX_ACTIVITY_POINTS:
+                raise ValueError(f"max_points must be between 2 and {MAX_ACTIVITY_POINTS}")
+            resolution = request.args.get('resolution', type=int)
+            start_time, end_time = parse_date_range(timedelta(hours=24))
+
             with current_app.db_factory() as session:
-                end_time = datetime.now()
-                start_time = end_time - timedelta(hours=24)
-                
-                signals = session.query(Signal).filter(
-                    Signal.id == controlador_id,
-                    Signal.tstamp.between(start_time, end_time)
-                ).order_by(Signal.tstamp).all()
-                
-                activity_data = {sensor: [] for sensor in ['value_sensor1', 'value_sensor2', 'value_sensor3', 'value_sensor4', 'value_sensor5', 'value_sensor6']}
-                
-                for signal in signals:
-                    for sensor in activity_data:
-                        activity_data[sensor].append({
-                            'timestamp': signal.tstamp,
-                            'value': getattr(signal, sensor)
-                        })
-            
-                return activity_data
+                epochs, states = sensor_state_arrays(session, controlador_id, start_time, end_time)
+
+            if mode == 'changes':
+                changes = {sensor: change_point_indices(states[:, k]) for k, sensor in enumerate(SENSOR_COLUMNS)}
+                if all(len(indices) <= max_points for indices in changes.values()):
+                    return {
+                        sensor: [
+                            {'timestamp': datetime.fromtimestamp(epochs[i], timezone.utc), 'value': bool(states[i, k]), 'duty_cycle': None}
+                            for i in changes[sensor]
+                        ]
+                        for k, sensor in enumerate(SENSOR_COLUMNS)
+                    }
+
+            start_epoch, end_epoch = start_time.timestamp(), end_time.timestamp()
+            bucket_seconds = max(resolution or 1, int(np.ceil((end_epoch - start_epoch) / (max_points - 1))))
+            # Align buckets to multiples of their size so repeated polls return the same boundaries
+            bucket_origin = (start_epoch // bucket_seconds) * bucket_seconds
+            bucket_starts, connected, on = duty_cycle_buckets(
+                epochs, states, bucket_origin, end_epoch, bucket_seconds, CONNECTION_TIMEOUT_SECONDS
+            )
+            duty = on / connected[:, None] if len(connected) else on
+            timestamps = [datetime.fromtimestamp(epoch, timezone.utc) for epoch in bucket_starts]
+            return {
+                sensor: [
+                    {'timestamp': timestamp, 'value': bool(duty[b, k] >= 0.5), 'duty_cycle': round(float(duty[b, k]), 4)}
+                    for b, timestamp in enumerate(timestamps)
+                ]
+                for k, sensor in enumerate(SENSOR_COLUMNS)
+            }
+        except ValueError as e:
+            api.abort(400, str(e))
         except SQLAlchemyError as e:
             return handle_database_error(e)
         except Exception as e:
@@ -290,71 +402,121 @@ class SensorActivity(Resource):
 @ns_controlador.route('/<string:controlador_id>/sensor_uptime')
 class SensorUptime(Resource):
     @ns_controlador.doc('get_sensor_uptime')
+    @ns_controlador.param('start_date', 'Window start (ISO 8601, UTC if naive); defaults to end_date - 24h')
+    @ns_controlador.param('end_date', 'Window end (ISO 8601, UTC if naive); defaults to now')
+    @cached_response('controlador', sliding_window=True)
     @ns_controlador.marshal_with(uptime_model)
     def get(self, controlador_id):
-        """Fetch sensor uptime for a specific controller"""
+        """Fetch sensor uptime for a specific controller, weighted by time between readings"""
         try:
+            start_time, end_time = parse_date_range(timedelta(hours=24))
             with current_app.db_factory() as session:
-                end_time = datetime.now()
-                start_time = end_time - timedelta(hours=24)
-                
-                uptime_data = {}
-                for sensor in ['value_sensor1', 'value_sensor2', 'value_sensor3', 'value_sensor4', 'value_sensor5', 'value_sensor6']:
-                    total_time = session.query(Signal).filter(
-                        Signal.id == controlador_id,
-                        Signal.tstamp.between(start_time, end_time)
-                    ).count()
-                    
-                    uptime = session.query(Signal).filter(
-                        Signal.id == controlador_id,
-                        Signal.tstamp.between(start_time, end_time),
-                        getattr(Signal, sensor) == True
-                    ).count()
-                    
-                    uptime_data[sensor] = (uptime / total_time) * 100 if total_time > 0 else 0
-            
-                return uptime_data
+                connected_seconds, on_seconds = rollup_sensor_on_seconds(session, controlador_id, start_time, end_time)
+                return {
+                    sensor: (on_seconds[sensor] / connected_seconds) * 100 if connected_seconds > 0 else 0
+                    for sensor in SENSOR_COLUMNS
+                }
+        except ValueError as e:
+            api.abort(400, str(e))
+        except SQLAlchemyError as e:
+            # marshal_with would turn a returned error body into null fields
+            logger.error(f"Database error: {str(e)}")
+            api.abort(503, "Database connection error. Please try again later.")
+        except Exception as e:
+            logger.error(f"Unexpected error: {str(e)}")
+            api.abort(500, "An unexpected error occurred. Please try again later.")
+
+@ns_controlador.route('/<string:controlador_id>/lifetime_metrics')
+class LifetimeMetrics(Resource):
+    @ns_controlador.doc('get_lifetime_metrics')
+    def get(self, controlador_id):
+        """Lifetime connected and per-sensor active minutes (NA/NC rules), kept up to date at ingest"""
+        try:
+            with current_app.db_factory() as session:
+                if not session.query(Controlador.id).filter_by(id=controlador_id).first():
+                    api.abort(404, "Controller not found")
+                return lifetime_metrics(session, controlador_id)
+        except HTTPException:
+            raise
         except SQLAlchemyError as e:
             return handle_database_error(e)
         except Exception as e:
             logger.error(f"Unexpected error: {str(e)}")
-            return jsonify({"error": "An unexpected error occurred. Please try again later."}), 500
+            return {"error": "An unexpected error occurred. Please try again later."}, 500
+
+@ns_controlador.route('/<string:controlador_id>/sensor_stats')
+class SensorStats(Resource):
+    @ns_controlador.doc('get_sensor_stats')
+    @ns_controlador.param('resolution', "'hour' (default) or 'day' UTC buckets")
+    @ns_controlador.param('start_date', 'Window start (ISO 8601, UTC if naive); defaults to end_date - 7 days')
+    @ns_controlador.param('end_date', 'Window end (ISO 8601, UTC if naive); defaults to now')
+    @cached_response('controlador', sliding_window=True)
+    def get(self, controlador_id):
+        """Reading count and share of readings each sensor was on, per hour or day (continuous aggregates in Timescale mode)"""
+        try:
+            start_time, end_time = parse_date_range(timedelta(days=7))
+            resolution = request.args.get('resolution', 'hour')
+            with current_app.db_factory() as session:
+                return {
+                    "resolution": resolution,
+                    "buckets": sensor_sample_stats(session, controlador_id, start_time, end_time, resolution)
+                }
+        except ValueError as e:
+            api.abort(400, str(e))
+        except SQLAlchemyError as e:
+            return handle_database_error(e)
+        except Exception as e:
+            logger.error(f"Unexpected error: {str(e)}")
+            return {"error": "An unexpected error occurred. Please try again later."}, 500
 
 @ns_controlador.route('/<string:controlador_id>/sensor_correlation')
 class SensorCorrelation(Resource):
     @ns_controlador.doc('get_sensor_correlation')
+    @ns_controlador.param('metric', "'agreement' (share of readings where both sensors match, default) or 'phi' (Pearson coefficient of the two boolean series)")
+    @ns_controlador.param('start_date', 'Window start (ISO 8601, UTC if naive); defaults to end_date - 24h. Must not precede compacted signals (400)')
+    @ns_controlador.param('end_date', 'Window end (ISO 8601, UTC if naive); defaults to now')
+    @cached_response('controlador', sliding_window=True)
     @ns_controlador.marshal_with(correlation_model)
     def get(self, controlador_id):
         """Fetch sensor correlation for a specific controller"""
         try:
+            metric = request.args.get('metric', 'agreement')
+            if metric not in ('agreement', 'phi'):
+                raise ValueError("metric must be 'agreement' or 'phi'")
+            start_time, end_time = parse_date_range(timedelta(hours=24))
             with current_app.db_factory() as session:
-                end_time = datetime.now()
-                start_time = end_time - timedelta(hours=24)
-                
-                signals = session.query(Signal).filter(
-                    Signal.id == controlador_id,
-                    Signal.tstamp.between(start_time, end_time)
-                ).all()
-                
-                sensors = ['value_sensor1', 'value_sensor2', 'value_sensor3', 'value_sensor4', 'value_sensor5', 'value_sensor6']
-                correlation_matrix = {s1: {s2: 0 for s2 in sensors} for s1 in sensors}
-                
-                for s1 in sensors:
-                    for s2 in sensors:
-                        if s1 != s2:
-                            correlation = sum(1 for signal in signals if getattr(signal, s1) == getattr(signal, s2))
-                            correlation_matrix[s1][s2] = correlation / len(signals) if signals else 0
-            
-                return correlation_matrix
+                # Both metrics weigh readings equally, which compaction has thinned out
+                compacted = compacted_until(session, controlador_id)
+                if compacted is not None and start_time < compacted:
+                    raise ValueError(f"Signals before {compacted.isoformat()} are compacted; start_date must not be earlier")
+                _, states = sensor_state_arrays(session, controlador_id, start_time, end_time)
+
+            if metric == 'agreement':
+                matrix = sensor_agreement_matrix(states)
+            else:
+                matrix = sensor_phi_matrix(states)
+            # Self-correlation is left at 0, as the frontend has always received it
+            np.fill_diagonal(matrix, 0)
+
+            return {
+                s1: {s2: float(matrix[i, j]) for j, s2 in enumerate(SENSOR_COLUMNS)}
+                for i, s1 in enumerate(SENSOR_COLUMNS)
+            }
+        except ValueError as e:
+            api.abort(400, str(e))
         except SQLAlchemyError as e:
-            return handle_database_error(e)
+            # marshal_with would turn a returned error body into null fields
+            logger.error(f"Database error: {str(e)}")
+            api.abort(503, "Database connection error. Please try again later.")
         except Exception as e:
             logger.error(f"Unexpected error: {str(e)}")
-            return jsonify({"error": "An unexpected error occurred. Please try again later."}), 500
+            api.abort(500, "An unexpected error occurred. Please try again later.")
+
 
 @ns_controlador.route('/<string:controlador_id>/alerts')
 class ControllerAlerts(Resource):
     @ns_controlador.doc('get_alerts')
+    @cached_response('controlador')
     @ns_controlador.marshal_list_with(alert_model)
     def get(self, controlador_id):
         """Fetch alerts for a specific controller"""
@@ -372,6 +534,7 @@ class ControllerAlerts(Resource):
 @ns_controlador.route('/<string:controlador_id>/config')
 class ControllerConfig(Resource):
     @ns_controlador.doc('get_controller_config')
+    @cached_response('controlador')
     @ns_controlador.marshal_with(config_model)
     @cross_origin(origin='http://localhost:5173', methods=['GET', 'POST', 'OPTIONS'])
     def get(self, controlador_id):
@@ -382,11 +545,15 @@ class ControllerConfig(Resource):
                 if not controlador:
                     api.abort(404, "Controller not found")
                 return {'config': controlador.config}
+        except HTTPException:
+            raise
         except SQLAlchemyError as e:
-            return handle_database_error(e)
+            # marshal_with would turn a returned error body into null fields
+            logger.error(f"Database error: {str(e)}")
+            api.abort(503, "Database connection error. Please try again later.")
         except Exception as e:
             logger.error(f"Unexpected error: {str(e)}")
-            return jsonify({"error": "An unexpected error occurred. Please try again later."}), 500
+            api.abort(500, "An unexpected error occurred. Please try again later.")
 
     @ns_controlador.doc('update_controller_config')
     @ns_controlador.expect(config_model)
@@ -408,8 +575,12 @@ class ControllerConfig(Resource):
 
                 controlador.config = new_config
                 session.commit()
+                invalidate_controller(controlador_id, controlador.empresa_id, config=True)
+                replica_router.mark_written(controlador_id, controlador.empresa_id)
 
                 return {'message': 'Configuration updated successfully'}
+        except HTTPException:
+            raise
         except SQLAlchemyError as e:
             return handle_database_error(e)
         except Exception as e:
@@ -432,19 +603,21 @@ class ControllerConfig(Resource):
 @ns_dashboard.route('/empresa/<string:empresa_id>/components')
 class CompanyComponents(Resource):
     @ns_dashboard.doc('get_company_components')
+    @cached_response('empresa')
     def get(self, empresa_id):
         """Fetch all components (controllers) for a company"""
         try:
             with current_app.db_factory() as session:
                 empresa = session.query(Empresa).filter_by(id=empresa_id).first()
                 if not empresa:
-                    return {"error": "Company not found"}, 404
+                    api.abort(404, "Company not found")
 
                 controladores = session.query(Controlador).filter_by(empresa_id=empresa_id).all()
+                last_signals = latest_signals_by_controller(session, [c.id for c in controladores])
                 
                 components = []
                 for controlador in controladores:
-                    last_signal = session.query(Signal).filter_by(controlador_id=controlador.id).order_by(Signal.tstamp.desc()).first()
+                    last_signal = last_signals.get(controlador.id)
                     components.append({
                         "id": controlador.id,
                         "name": controlador.name,
@@ -456,6 +629,8 @@ class CompanyComponents(Resource):
                     "company_name": empresa.name,
                     "components": components
                 }
+        except HTTPException:
+            raise
         except SQLAlchemyError as e:
             return handle_database_error(e)
         except Exception as e:
@@ -502,153 +677,65 @@ def controlador_changes(session, controlador_id, limit=3):
 @ns_controlador.route('/<string:controlador_id>/uptime-downtime')
 class ControllerUptimeDowntime(Resource):
     @ns_controlador.doc('get_controller_uptime_downtime')
+    @ns_controlador.param('start_date', 'Window start (ISO 8601, UTC if naive); defaults to end_date - 7 days')
+    @ns_controlador.param('end_date', 'Window end (ISO 8601, UTC if naive); defaults to now')
+    @cached_response('controlador', sliding_window=True)
     def get(self, controlador_id):
         """Fetch uptime/downtime data for a specific controller"""
         try:
+            start_date, end_date = parse_date_range(timedelta(days=7))
             with current_app.db_factory() as session:
                 controlador = session.query(Controlador).filter_by(id=controlador_id).first()
                 if not controlador:
-                    return {"error": "Controller not found"}, 404
-
-                utc = pytz.UTC
-                end_date = datetime.now(utc)
-                start_date = end_date - timedelta(days=7)  # Get data for the last week
-                if 'start_date' in request.args:
-                    start_date = datetime.fromisoformat(request.args['start_date']).replace(tzinfo=utc)
-                if 'end_date' in request.args:
-                    end_date = datetime.fromisoformat(request.args['end_date']).replace(tzinfo=utc)
-
-                signals = session.query(Signal).filter(
-                    Signal.controlador_id == controlador_id,
-                    Signal.tstamp.between(start_date, end_date)
-                ).order_by(Signal.tstamp).all()
-
-                daily_activity = {}
-                current_date = start_date.date()
-                while current_date <= end_date.date():
-                    daily_activity[current_date.isoformat()] = []
-                    current_date += timedelta(days=1)
+                    api.abort(404, "Controller not found")
 
-                if not signals:
-                    # If no signals, mark entire period as off
-                    self.add_interval(daily_activity, start_date, end_date, 'off')
-                    return {
-                        "controller_name": controlador.name,
-                        "daily_activity": daily_activity
-                    }
+                epochs = reading_epochs(session, controlador_id, start_date, end_date)
+                controller_name = controlador.name
 
-                # Initialize with first interval if needed
-                if signals[0].tstamp > start_date:
-                    self.add_interval(daily_activity, start_date, signals[0].tstamp, 'off')
-
-                # Process signals
-                current_state = 'off'
-                last_signal_time = signals[0].tstamp
-
-                for i in range(len(signals)):
-                    signal = signals[i]
-                    signal_time = signal.tstamp.replace(tzinfo=utc)
-                    
-                    # Determine if this is a state change that requires a new interval
-                    time_gap = (signal_time - last_signal_time).total_seconds()
-                    
-                    if time_gap > 300:  # 5-minute gap indicates disconnection
-                        if current_state == 'on':
-                            # Add the active period and the gap
-                            self.add_interval(daily_activity, last_signal_time, 
-                                           last_signal_time + timedelta(seconds=300), 'on')
-                            self.add_interval(daily_activity, 
-                                           last_signal_time + timedelta(seconds=300),
-                                           signal_time, 'off')
-                        else:
-                            # Just add the gap as off time
-                            self.add_interval(daily_activity, last_signal_time, signal_time, 'off')
-                        
-                        # Start new on period
-                        current_state = 'on'
-                    elif i == 0 or time_gap > 0:  # Only add non-duplicate timestamps
-                        if current_state == 'off':
-                            current_state = 'on'
-                            # Start new on period
-                            self.add_interval(daily_activity, signal_time, 
-                                           signal_time + timedelta(seconds=300), 'on')
-
-                    last_signal_time = signal_time
-
-                # Handle final interval
-                final_time = min(end_date, last_signal_time + timedelta(seconds=300))
-                if current_state == 'on':
-                    self.add_interval(daily_activity, last_signal_time, final_time, 'on')
-                if final_time < end_date:
-                    self.add_interval(daily_activity, final_time, end_date, 'off')
-
-                # Merge consecutive intervals with same state
-                for date in daily_activity:
-                    merged = []
-                    for activity in daily_activity[date]:
-                        if (not merged or 
-                            merged[-1]['state'] != activity['state'] or 
-                            self._time_diff(merged[-1]['end_time'], activity['start_time']) > 1):
-                            merged.append(activity)
-                        else:
-                            merged[-1]['end_time'] = activity['end_time']
-                    daily_activity[date] = merged
+            # On/off islands and day splitting work on epoch seconds; strings are only built below
+            starts, ends, is_on = connection_intervals(
+                epochs, start_date.timestamp(), end_date.timestamp(), CONNECTION_TIMEOUT_SECONDS
+            )
+            days, piece_starts, piece_ends, piece_on = split_intervals_by_day(starts, ends, is_on)
 
-                return {
-                    "controller_name": controlador.name,
-                    "daily_activity": daily_activity
-                }
+            daily_activity = {}
+            current_date = start_date.date()
+            while current_date <= end_date.date():
+                daily_activity[current_date.isoformat()] = []
+                current_date += timedelta(days=1)
+
+            for day, piece_start, piece_end, on in zip(days, piece_starts, piece_ends, piece_on):
+                day_start = day * SECONDS_PER_DAY
+                daily_activity[datetime.fromtimestamp(day_start, timezone.utc).date().isoformat()].append({
+                    'start_time': self._format_time(piece_start),
+                    'end_time': '23:59:59' if piece_end == day_start + SECONDS_PER_DAY else self._format_time(piece_end),
+                    'state': 'on' if on else 'off'
+                })
 
+            return {
+                "controller_name": controller_name,
+                "daily_activity": daily_activity
+            }
+
+        except HTTPException:
+            raise
+        except ValueError as e:
+            api.abort(400, str(e))
         except SQLAlchemyError as e:
             return handle_database_error(e)
         except Exception as e:
             current_app.logger.error(f"Unexpected error: {str(e)}")
             return {"error": "An unexpected error occurred. Please try again later."}, 500
 
-    def add_interval(self, daily_activity, start_time, end_time, state):
-        """Add an interval to the daily activity, handling cross-day intervals"""
-        start_date = start_time.date().isoformat()
-        end_date = end_time.date().isoformat()
-
-        if start_date == end_date:
-            daily_activity[start_date].append({
-                'start_time': start_time.time().isoformat(),
-                'end_time': end_time.time().isoformat(),
-                'state': state
-            })
-        else:
-            # Split interval across days
-            daily_activity[start_date].append({
-                'start_time': start_time.time().isoformat(),
-                'end_time': '23:59:59',
-                'state': state
-            })
-            
-            current_date = start_time.date() + timedelta(days=1)
-            while current_date < end_time.date():
-                daily_activity[current_date.isoformat()].append({
-                    'start_time': '00:00:00',
-                    'end_time': '23:59:59',
-                    'state': state
-                })
-                current_date += timedelta(days=1)
-            
-            daily_activity[end_date].append({
-                'start_time': '00:00:00',
-                'end_time': end_time.time().isoformat(),
-                'state': state
-            })
-
-    def _time_diff(self, time1_str, time2_str):
-        """Calculate difference between two time strings in seconds"""
-        t1 = datetime.strptime(time1_str, '%H:%M:%S.%f' if '.' in time1_str else '%H:%M:%S')
-        t2 = datetime.strptime(time2_str, '%H:%M:%S.%f' if '.' in time2_str else '%H:%M:%S')
-        return abs((t2 - t1).total_seconds())
+    @staticmethod
+    def _format_time(epoch):
+        return datetime.fromtimestamp(epoch, timezone.utc).time().isoformat()
 
 
 @ns_controlador.route('/<string:controlador_id>/analytics')
 class ControllerAnalytics(Resource):
     @ns_controlador.doc('get_controller_analytics')  # Changed from @dashboard.doc to @ns_controlador.doc
+    @cached_response('controlador', sliding_window=True)
     def get(self, controlador_id):
         try:
             days = request.args.get('days', 7, type=int)
@@ -656,33 +743,77 @@ class ControllerAnalytics(Resource):
                 analytics_service = CycleAnalyticsService(session)
                 analytics = analytics_service.get_cycle_analytics(controlador_id, days)
                 if not analytics:
-                    return {"error": "No data available"}, 404
+                    api.abort(404, "No data available")
                 return analytics
+        except HTTPException:
+            raise
         except Exception as e:
             return {"error": str(e)}, 500
             
+@ns_dashboard.route('/empresa/<string:empresa_id>/analytics')
+class EmpresaAnalytics(Resource):
+    @ns_dashboard.doc('get_company_analytics')
+    @ns_dashboard.param('days', 'Window length in days, ending now (default 7)')
+    @cached_response('empresa', sliding_window=True)
+    def get(self, empresa_id):
+        """Cycle and uptime metrics for every controller of a company, from one scan of its signals"""
+        try:
+            days = request.args.get('days', 7, type=int)
+            if days < 1:
+                api.abort(400, "days must be at least 1")
+            with current_app.db_factory() as session:
+                if not session.query(Empresa.id).filter_by(id=empresa_id).first():
+                    api.abort(404, "Company not found")
+
+                controladores = session.query(Controlador.id, Controlador.name).\
+                    filter_by(empresa_id=empresa_id).order_by(Controlador.id).all()
+                workers = current_app.config.get('ANALYTICS_WORKERS') or 0
+                if len(controladores) < current_app.config.get('ANALYTICS_POOL_MIN_CONTROLLERS', 0):
+                    workers = 0
+                metrics = CycleAnalyticsService(session).get_empresa_analytics(empresa_id, days, workers)
+
+                return {
+                    "days": days,
+                    "controllers": [
+                        {
+                            "id": controlador.id,
+                            "name": controlador.name,
+                            **metrics.get(controlador.id, {
+                                "cycles": None,
+                                "uptime_percentage": 0,
+                                "sensor_uptime": {sensor: 0 for sensor in SENSOR_COLUMNS},
+                                "last_reading": None
+                            })
+                        }
+                        for controlador in controladores
+                    ]
+                }
+        except HTTPException:
+            raise
+        except SQLAlchemyError as e:
+            return handle_database_error(e)
+        except Exception as e:
+            logger.error(f"Unexpected error: {str(e)}")
+            return {"error": "An unexpected error occurred. Please try again later."}, 500
+
 @ns_controlador.route('/<string:controlador_id>/operational-hours')
 class ControllerOperationalHours(Resource):
     @ns_controlador.doc('get_controller_operational_hours')
+    @ns_controlador.param('start_date', 'Window start (ISO 8601, UTC if naive); defaults to end_date - 7 days')
+    @ns_controlador.param('end_date', 'Window end (ISO 8601, UTC if naive); defaults to now')
+    @cached_response('controlador', sliding_window=True)
     def get(self, controlador_id):
-        """Fetch operational hours data for a specific controller"""
+        """Fetch operational hours data (active minutes per UTC hour) for a specific controller"""
         try:
+            start_date, end_date = parse_date_range(timedelta(days=7))
             with current_app.db_factory() as session:
                 controlador = session.query(Controlador).filter_by(id=controlador_id).first()
                 if not controlador:
-                    return {"error": "Controller not found"}, 404
-
-                end_date = datetime.now()
-                start_date = end_date - timedelta(days=7)  # Get data for the last week
-                if 'start_date' in request.args:
-                    start_date = datetime.fromisoformat(request.args['start_date'])
-                if 'end_date' in request.args:
-                    end_date = datetime.fromisoformat(request.args['end_date'])
+                    api.abort(404, "Controller not found")
 
-                signals = session.query(Signal).filter(
-                    Signal.controlador_id == controlador_id,
-                    Signal.tstamp.between(start_date, end_date)
-                ).order_by(Signal.tstamp).all()
+                active_seconds = rollup_active_seconds_by_hour(
+                    session, controlador_id, controlador.config, start_date, end_date
+                )
 
                 heatmap_data = {}
                 current_date = start_date.date()
@@ -690,19 +821,10 @@ class ControllerOperationalHours(Resource):
                     heatmap_data[current_date.isoformat()] = [0] * 24
                     current_date += timedelta(days=1)
 
-                for signal in signals:
-                    signal_date = signal.tstamp.date()
-                    signal_hour = signal.tstamp.hour
-
-                    # Check if any sensor is active based on the configuration
-                    is_active = any(
-                        (config['tipo'] == 'NA' and getattr(signal, sensor_key)) or
-                        (config['tipo'] == 'NC' and not getattr(signal, sensor_key))
-                        for sensor_key, config in controlador.config.items()
-                    )
-
-                    if is_active:
-                        heatmap_data[signal_date.isoformat()][signal_hour] += 5  # Increment by 5 minutes
+                for hour, seconds in active_seconds.items():
+                    day = heatmap_data.get(hour.date().isoformat())
+                    if day is not None:
+                        day[hour.hour] = round(seconds / 60)
 
                 return {
                     "controller_name": controlador.name,
@@ -710,6 +832,10 @@ class ControllerOperationalHours(Resource):
                     "sensor_config": controlador.config
                 }
 
+        except HTTPException:
+            raise
+        except ValueError as e:
+            api.abort(400, str(e))
         except SQLAlchemyError as e:
             return handle_database_error(e)
         except Exception as e:
@@ -742,6 +868,8 @@ class AddControlador(Resource):
                 )
                 session.add(new_controlador)
                 session.commit()
+                invalidate_empresa(new_controlador.empresa_id)
+                replica_router.mark_written(new_controlador.id, new_controlador.empresa_id)
                 return new_controlador.to_dict(), 201
         except IntegrityError:
             return {'message': 'Controller ID already exists'}, 400
@@ -762,93 +890,280 @@ def handle_database_error(e):
 @ns_controlador.route('/<string:controlador_id>/timeline')
 class ControllerTimeline(Resource):
     @ns_controlador.doc('get_controller_timeline')
+    @ns_controlador.param('stream', 'true to stream the JSON body incrementally (bounded memory for long ranges)')
+    @ns_controlador.param('start_date', 'Window start (ISO 8601, UTC if naive); defaults to end_date - 7 days')
+    @ns_controlador.param('end_date', 'Window end (ISO 8601, UTC if naive); defaults to now')
+    @cached_response('controlador', sliding_window=True)
     def get(self, controlador_id):
         """Fetch activity data for a specific controller"""
         try:
+            start_date, end_date = parse_date_range(timedelta(days=7))
             with current_app.db_factory() as session:
                 controlador = session.query(Controlador).filter_by(id=controlador_id).first()
                 if not controlador:
-                    return {"error": "Controller not found"}, 404
-
-                end_date = datetime.now()
-                start_date = end_date - timedelta(days=7)  # Get data for the last week
-                if 'start_date' in request.args:
-                    start_date = datetime.fromisoformat(request.args['start_date'])
-                if 'end_date' in request.args:
-                    end_date = datetime.fromisoformat(request.args['end_date'])
-
-                signals = session.query(Signal).filter(
-                    Signal.controlador_id == controlador_id,
-                    Signal.tstamp.between(start_date, end_date)
-                ).order_by(Signal.tstamp).all()
-
-                daily_activity = {}
-                heatmap_data = {}
-                current_date = start_date.date()
-                while current_date <= end_date.date():
-                    daily_activity[current_date.isoformat()] = []
-                    heatmap_data[current_date.isoformat()] = [0] * 24
-                    current_date += timedelta(days=1)
+                    api.abort(404, "Controller not found")
+                controller_name = controlador.name
 
-                last_signal_time = None
-                for signal in signals:
-                    signal_date = signal.tstamp.date()
-                    signal_hour = signal.tstamp.hour
-
-                    if last_signal_time and (signal.tstamp - last_signal_time).total_seconds() > 300:
-                        # Add a downtime period
-                        daily_activity[signal_date.isoformat()].append({
-                            "start": last_signal_time.isoformat(),
-                            "end": signal.tstamp.isoformat(),
-                            "status": "downtime"
-                        })
-                    else:
-                        # Increment the active minutes for this hour
-                        heatmap_data[signal_date.isoformat()][signal_hour] += 5
-
-                    # Add an uptime period
-                    daily_activity[signal_date.isoformat()].append({
-                        "start": signal.tstamp.isoformat(),
-                        "end": (signal.tstamp + timedelta(minutes=5)).isoformat(),
-                        "status": "uptime"
-                    })
+                if request.args.get('stream', 'false').lower() == 'true':
+                    return Response(
+                        stream_with_context(self._stream(controlador_id, controller_name, start_date, end_date)),
+                        mimetype='application/json'
+                    )
 
-                    last_signal_time = signal.tstamp
+                daily_activity = {date: [] for date in self._dates(start_date, end_date)}
+                heatmap_data = {date: [0] * 24 for date in daily_activity}
+                tstamps = self._signal_tstamps(session, controlador_id, start_date, end_date).all()
+                for date, entry in self._timeline_entries(tstamps, heatmap_data):
+                    daily_activity[date].append(entry)
 
                 return {
-                    "controller_name": controlador.name,
+                    "controller_name": controller_name,
                     "daily_activity": daily_activity,
                     "heatmap_data": heatmap_data
                 }
 
+        except HTTPException:
+            raise
+        except ValueError as e:
+            api.abort(400, str(e))
         except SQLAlchemyError as e:
             return handle_database_error(e)
         except Exception as e:
             current_app.logger.error(f"Unexpected error: {str(e)}")
             return {"error": "An unexpected error occurred. Please try again later."}, 500
-        
 
+    @staticmethod
+    def _dates(start_date, end_date):
+        current_date = start_date.date()
+        while current_date <= end_date.date():
+            yield current_date.isoformat()
+            current_date += timedelta(days=1)
+
+    @staticmethod
+    def _signal_tstamps(session, controlador_id, start_date, end_date):
+        return session.query(Signal.tstamp).filter(
+            Signal.controlador_id == controlador_id,
+            Signal.tstamp.between(start_date, end_date)
+        ).order_by(Signal.tstamp)
+
+    @staticmethod
+    def _timeline_entries(tstamps, heatmap_data):
+        """
+        Yield (date, entry) per uptime/downtime period in time order, adding 5
+        active minutes to heatmap_data for each reading that follows its
+        predecessor within 5 minutes.
+        """
+        last_signal_time = None
+        for (tstamp,) in tstamps:
+            tstamp = tstamp.astimezone(timezone.utc)
+            signal_date = tstamp.date().isoformat()
+
+            if last_signal_time and (tstamp - last_signal_time).total_seconds() > CONNECTION_TIMEOUT_SECONDS:
+                yield signal_date, {
+                    "start": last_signal_time.isoformat(),
+                    "end": tstamp.isoformat(),
+                    "status": "downtime"
+                }
+            elif signal_date in heatmap_data:
+                heatmap_data[signal_date][tstamp.hour] += 5
+
+            yield signal_date, {
+                "start": tstamp.isoformat(),
+                "end": (tstamp + timedelta(minutes=5)).isoformat(),
+                "status": "uptime"
+            }
+            last_signal_time = tstamp
+
+    def _stream(self, controlador_id, controller_name, start_date, end_date, chunk_size=1000):
+        """
+        Write the same document as the buffered response, one chunk at a time.
+        Signals are read through a server-side cursor (yield_per), so memory only
+        holds the current chunk plus the small per-hour heatmap.
+        """
+        dates = list(self._dates(start_date, end_date))
+        heatmap_data = {date: [0] * 24 for date in dates}
+        pending_dates = iter(dates)
+        current_date = None
+        first_in_date = True
+        buffer = [f'{{"controller_name": {json.dumps(controller_name)}, "daily_activity": {{']
+
+        def open_date(date):
+            return ('' if date == dates[0] else '], ') + f'{json.dumps(date)}: ['
+
+        with current_app.db_factory() as session:
+            tstamps = self._signal_tstamps(session, controlador_id, start_date, end_date).yield_per(chunk_size)
+            try:
+                for date, entry in self._timeline_entries(tstamps, heatmap_data):
+                    while current_date != date:
+                        current_date = next(pending_dates)
+                        buffer.append(open_date(current_date))
+                        first_in_date = True
+                    buffer.append(('' if first_in_date else ', ') + json.dumps(entry))
+                    first_in_date = False
+                    if len(buffer) >= chunk_size:
+                        yield ''.join(buffer)
+                        buffer = []
+            except Exception as e:
+                # Headers are already sent; log and end the stream (the client sees truncated JSON)
+                logger.error(f"Error streaming timeline for {controlador_id}: {str(e)}")
+                return
+
+        for date in pending_dates:
+            buffer.append(open_date(date))
+        if dates:
+            buffer.append(']')
+        buffer.append(f'}}, "heatmap_data": {json.dumps(heatmap_data)}}}')
+        yield ''.join(buffer)
+
+
+
+def export_response(name, *filters):
+    """
+    Streamed signal export for the current request (format, start_date,
+    end_date args), filtered by `filters`. Rows are read in COPY batches (see
+    export_service.copy_batches) in their own session, so memory stays bounded
+    for any range.
+    """
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        api.abort(400, f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    if export_format == 'parquet' and not parquet_available():
+        api.abort(501, "Parquet export is not available (pyarrow is not installed)")
+    start_date, end_date = parse_date_range(timedelta(days=1))
+    writer = signals_csv if export_format == 'csv' else signals_parquet
+
+    def generate():
+        with current_app.db_factory() as session:
+            try:
+                yield from writer(session, start_date, end_date, *filters)
+            except Exception as e:
+                # Headers are already sent; log and end the stream (the client sees a truncated file)
+                logger.error(f"Error exporting signals for {name}: {str(e)}")
+
+    filename = f"signals_{name}_{start_date:%Y%m%dT%H%M%SZ}_{end_date:%Y%m%dT%H%M%SZ}.{export_format}"
+    return Response(
+        stream_with_context(generate()),
+        mimetype=EXPORT_FORMATS[export_format],
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+
+@ns_controlador.route('/<string:controlador_id>/export')
+class ControllerExport(Resource):
+    @ns_controlador.doc('export_controller_signals')
+    @ns_controlador.param('format', "'csv' (default) or 'parquet'")
+    @ns_controlador.param('start_date', 'Window start (ISO 8601, UTC if naive); defaults to end_date - 24h')
+    @ns_controlador.param('end_date', 'Window end (ISO 8601, UTC if naive); defaults to now')
+    def get(self, controlador_id):
+        """Stream the raw signals of a controller in a time range as CSV or Parquet"""
+        try:
+            with current_app.db_factory() as session:
+                if not session.query(Controlador.id).filter_by(id=controlador_id).first():
+                    api.abort(404, "Controller not found")
+            return export_response(controlador_id, Signal.controlador_id == controlador_id)
+        except HTTPException:
+            raise
+        except ValueError as e:
+            api.abort(400, str(e))
+        except SQLAlchemyError as e:
+            return handle_database_error(e)
+        except Exception as e:
+            logger.error(f"Unexpected error: {str(e)}")
+            return jsonify({"error": "An unexpected error occurred. Please try again later."}), 500
 
 
-def is_controlador_connected(controlador, session):
-    try:
-        controlador_id = str(controlador.id)  # Ensure it's a string
-        
-        # Use a text-based query to avoid type casting issues
-        query = text("SELECT tstamp FROM signals WHERE controlador_id = :id ORDER BY tstamp DESC LIMIT 1")
-        result = session.execute(query, {"id": controlador_id}).first()
-        
-        if result:
-            last_sample_time = result[0]
-            return last_sample_time > datetime.now(pytz.timezone('Europe/Paris')) - timedelta(minutes=5)
-        return False
-    except SQLAlchemyError as e:
-        current_app.logger.error(f"Database error in is_controlador_connected: {str(e)}")
-        session.rollback()  # Roll back the transaction on error
-        return False
-    except Exception as e:
-        current_app.logger.error(f"Error in is_controlador_connected: {str(e)}")
-        return False
+retention_policy_model = api.model('RetentionPolicy', {
+    'raw_days': fields.Integer(description='Days raw readings are kept before compaction to change events (null: server default, 0: forever)'),
+    'event_months': fields.Integer(description='Further months change events are kept before deletion (null: server default, 0: forever)')
+})
+
+def retention_payload(empresa_id, policy):
+    raw_days, event_months = effective_policy(policy, current_app.config)
+    return {
+        'empresa_id': empresa_id,
+        'raw_days': policy.raw_days if policy else None,
+        'event_months': policy.event_months if policy else None,
+        'effective': {'raw_days': raw_days, 'event_months': event_months},
+        'compacted_until': policy.compacted_until if policy else None,
+        'last_run': {
+            'at': policy.last_run_at,
+            'seconds': policy.last_run_seconds,
+            'rows_reclaimed': policy.last_rows_reclaimed
+        } if policy and policy.last_run_at else None
+    }
+
+@ns_dashboard.route('/empresa/<string:empresa_id>/retention')
+class EmpresaRetention(Resource):
+    @ns_dashboard.doc('get_company_retention')
+    def get(self, empresa_id):
+        """Signal retention policy of a company and its last run"""
+        try:
+            with current_app.db_factory() as session:
+                if not session.query(Empresa.id).filter_by(id=empresa_id).first():
+                    api.abort(404, "Company not found")
+                return retention_payload(empresa_id, session.get(RetentionPolicy, empresa_id))
+        except HTTPException:
+            raise
+        except SQLAlchemyError as e:
+            return handle_database_error(e)
+        except Exception as e:
+            logger.error(f"Unexpected error: {str(e)}")
+            return {"error": "An unexpected error occurred. Please try again later."}, 500
+
+    @ns_dashboard.doc('update_company_retention')
+    @ns_dashboard.expect(retention_policy_model)
+    def put(self, empresa_id):
+        """Set the signal retention policy of a company"""
+        try:
+            data = request.get_json(silent=True) or {}
+            for key in ('raw_days', 'event_months'):
+                value = data.get(key)
+                if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < 0):
+                    api.abort(400, f"{key} must be a non-negative integer or null")
+            with current_app.db_factory() as session:
+                if not session.query(Empresa.id).filter_by(id=empresa_id).first():
+                    api.abort(404, "Company not found")
+                policy = session.get(RetentionPolicy, empresa_id)
+                if policy is None:
+                    policy = RetentionPolicy(empresa_id=empresa_id)
+                    session.add(policy)
+                policy.raw_days = data.get('raw_days')
+                policy.event_months = data.get('event_months')
+                session.commit()
+                replica_router.mark_written(empresa_id=empresa_id)
+                return retention_payload(empresa_id, policy)
+        except HTTPException:
+            raise
+        except SQLAlchemyError as e:
+            return handle_database_error(e)
+        except Exception as e:
+            logger.error(f"Unexpected error: {str(e)}")
+            return {"error": "An unexpected error occurred. Please try again later."}, 500
+
+@ns_dashboard.route('/empresa/<string:empresa_id>/export')
+class EmpresaExport(Resource):
+    @ns_dashboard.doc('export_company_signals')
+    @ns_dashboard.param('format', "'csv' (default) or 'parquet'")
+    @ns_dashboard.param('start_date', 'Window start (ISO 8601, UTC if naive); defaults to end_date - 24h')
+    @ns_dashboard.param('end_date', 'Window end (ISO 8601, UTC if naive); defaults to now')
+    def get(self, empresa_id):
+        """Stream the raw signals of every controller of a company in a time range as CSV or Parquet"""
+        try:
+            with current_app.db_factory() as session:
+                if not session.query(Empresa.id).filter_by(id=empresa_id).first():
+                    api.abort(404, "Company not found")
+            # COPY bypasses the ORM, so soft-deleted controllers are excluded here
+            controladores = select(Controlador.id).where(Controlador.empresa_id == empresa_id, Controlador.deleted_at.is_(None))
+            return export_response(empresa_id, Signal.controlador_id.in_(controladores))
+        except HTTPException:
+            raise
+        except ValueError as e:
+            api.abort(400, str(e))
+        except SQLAlchemyError as e:
+            return handle_database_error(e)
+        except Exception as e:
+            logger.error(f"Unexpected error: {str(e)}")
+            return jsonify({"error": "An unexpected error occurred. Please try again later."}), 500
 
 def fetch_sensor_connection_data(controlador_id, sensor_id, start_datetime, end_datetime):
     utc = pytz.UTC
@@ -860,55 +1175,29 @@ def fetch_sensor_connection_data(controlador_id, sensor_id, start_datetime, end_
 class ControladorResource(Resource):
     @ns_dashboard.doc('delete_controlador')
     def delete(self, controlador_id):
-        """Delete a controller and all its related data"""
+        """
+        Delete a controller and all its related data. The controller is hidden at
+        once and purged in the background; progress is broadcast as
+        controller_deletion_progress Socket.IO events.
+        """
         session = current_app.db_factory()
         try:
-            logger.info(f"Starting deletion process for controller {controlador_id}")
-            
-            # Get all alert IDs for this controller first
-            alert_ids = [alert.id for alert in session.query(Aviso).filter_by(controlador_id=controlador_id).all()]
-            
-            if alert_ids:
-                # Delete alert logs first (child records)
-                alert_logs_deleted = session.query(AvisoLog).filter(AvisoLog.aviso_id.in_(alert_ids)).delete(synchronize_session='fetch')
-                logger.info(f"Deleted {alert_logs_deleted} alert logs")
-
-            # Delete alerts
-            alerts_deleted = session.query(Aviso).filter_by(controlador_id=controlador_id).delete(synchronize_session='fetch')
-            logger.info(f"Deleted {alerts_deleted} alerts")
-
-            # Get all signal IDs that aren't referenced in aviso_logs
-            safe_signal_ids = session.query(Signal.id).outerjoin(
-                AvisoLog, Signal.id == AvisoLog.signal_id
-            ).filter(
-                Signal.controlador_id == controlador_id,
-                AvisoLog.id.is_(None)
-            ).all()
-            
-            safe_signal_ids = [id[0] for id in safe_signal_ids]
-
-            # Delete signals that aren't referenced
-            if safe_signal_ids:
-                signals_deleted = session.query(Signal).filter(Signal.id.in_(safe_signal_ids)).delete(synchronize_session='fetch')
-                logger.info(f"Deleted {signals_deleted} unreferenced signals")
-
-            # Delete the controller
             controlador = session.query(Controlador).get(controlador_id)
             if not controlador:
                 return {'message': 'Controller not found'}, 404
 
-            session.delete(controlador)
+            controlador.deleted_at = datetime.now(timezone.utc)
             session.commit()
-            logger.info(f"Successfully deleted controller {controlador_id}")
+            invalidate_controller(controlador_id, controlador.empresa_id, config=True, alerts=True)
+            replica_router.mark_written(controlador_id, controlador.empresa_id)
+            start_controller_purge(current_app._get_current_object(), controlador_id)
+            logger.info(f"Controller {controlador_id} marked as deleted, purge started")
 
             return {
-                'message': 'Controller and related data deleted successfully',
-                'details': {
-                    'alerts_deleted': alerts_deleted,
-                    'alert_logs_deleted': alert_logs_deleted if alert_ids else 0,
-                    'signals_deleted': signals_deleted if safe_signal_ids else 0
-                }
-            }, 200
+                'message': 'Controller deletion started',
+                'controlador_id': controlador_id,
+                'progress_event': PROGRESS_EVENT
+            }, 202
 
         except Exception as e:
             logger.error(f"Error deleting controller {controlador_id}: {str(e)}")
@@ -4,6 +4,17 @@ from dotenv import load_dotenv
 
 load_dotenv()  # Load environment variables from .env file
 
+# Timescale mode: signals is created as a hypertable (see README). Read at import
+# time because it changes the table definitions in models.py.
+TIMESCALEDB = os.getenv('TIMESCALEDB', 'False').lower() == 'true'
+# The timescaledb dialect (sqlalchemy-timescaledb) runs create_hypertable after CREATE TABLE
+DATABASE_DRIVER = 'timescaledb+psycopg2' if TIMESCALEDB else 'postgresql+psycopg2'
+# Partitioned mode: on plain PostgreSQL, signals is range-partitioned by month on
+# tstamp (see README). Also changes the table definitions, so also read here.
+SIGNALS_PARTITIONED = os.getenv('SIGNALS_PARTITIONED', 'False').lower() == 'true'
+if TIMESCALEDB and SIGNALS_PARTITIONED:
+    raise RuntimeError("TIMESCALEDB and SIGNALS_PARTITIONED are mutually exclusive")
+
 class BaseConfig:
     SECRET_KEY = os.getenv('SECRET_KEY','dev-key')
     JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY','dev-jwt-key')
@@ -28,6 +39,67 @@ class BaseConfig:
     NOTIFICATION_EMAIL = os.getenv('NOTIFICATION_EMAIL')
     MAIL_SUPPRESS_SEND = False  # Default to allowing email sending
     SOCKET_PATH = '/socket.io'
+    # api.abort(404, ...) messages are about missing records, not unknown routes
+    ERROR_404_HELP = False
+    # Shared state between workers (liveness map); in-process only when unset, which needs WEB_CONCURRENCY = 1
+    REDIS_URL = os.getenv('REDIS_URL')
+    # Dashboard response cache (Flask-Caching). Redis when REDIS_URL is set so all
+    # workers share entries and invalidations; SimpleCache is per process.
+    CACHE_TYPE = 'RedisCache' if REDIS_URL else 'SimpleCache'
+    CACHE_REDIS_URL = REDIS_URL
+    CACHE_KEY_PREFIX = 'iot:'
+    CACHE_THRESHOLD = 10000
+    # Upper bound on staleness for windows that slide with time, 0 to disable caching
+    # (forced to 0 when WEB_CONCURRENCY > 1 without REDIS_URL, see response_cache)
+    DASHBOARD_CACHE_TIMEOUT = int(os.getenv('DASHBOARD_CACHE_TIMEOUT', 60))
+    # ETags / 304 on cached dashboard views (also off in that case)
+    DASHBOARD_ETAGS = os.getenv('DASHBOARD_ETAGS', 'True').lower() == 'true'
+    # Background jobs (APScheduler) run in-process; disable on extra workers
+    SCHEDULER_ENABLED = os.getenv('SCHEDULER_ENABLED', 'True').lower() == 'true'
+    # Interval of the hourly rollup refresh job, 0 to disable
+    ROLLUP_REFRESH_SECONDS = int(os.getenv('ROLLUP_REFRESH_SECONDS', 300))
+    # Flush interval of the lifetime sensor metrics accumulated at ingest, 0 to disable;
+    # every controller is also recounted from signals this often (catch-up)
+    SENSOR_METRICS_FLUSH_SECONDS = int(os.getenv('SENSOR_METRICS_FLUSH_SECONDS', 60))
+    SENSOR_METRICS_CATCH_UP_SECONDS = int(os.getenv('SENSOR_METRICS_CATCH_UP_SECONDS', 3600))
+    # Signal retention defaults for companies without their own policy (0 keeps forever),
+    # how often the retention job runs (0 disables it) and rows deleted per transaction
+    RETENTION_RAW_DAYS = int(os.getenv('RETENTION_RAW_DAYS', 0))
+    RETENTION_EVENT_MONTHS = int(os.getenv('RETENTION_EVENT_MONTHS', 0))
+    RETENTION_INTERVAL_SECONDS = int(os.getenv('RETENTION_INTERVAL_SECONDS', 3600))
+    RETENTION_BATCH_ROWS = int(os.getenv('RETENTION_BATCH_ROWS', 10000))
+    # Partitioned mode: detach expired monthly partitions (for archiving) instead of dropping them
+    RETENTION_DETACH_PARTITIONS = os.getenv('RETENTION_DETACH_PARTITIONS', 'False').lower() == 'true'
+    # Deleted controllers are purged in transactions of at most this many rows; purges cut
+    # short by a restart are resumed this often
+    CONTROLLER_DELETE_BATCH_ROWS = int(os.getenv('CONTROLLER_DELETE_BATCH_ROWS', 5000))
+    CONTROLLER_PURGE_SECONDS = int(os.getenv('CONTROLLER_PURGE_SECONDS', 600))
+    # Connections. Set DATABASE_PGBOUNCER when the database URL is a transaction-mode PgBouncer,
+    # and DATABASE_NULL_POOL to leave pooling to it. Otherwise, with DATABASE_MAX_CONNECTIONS set,
+    # each of the WEB_CONCURRENCY worker processes pools its share of that many connections (at least 3).
+    DATABASE_PGBOUNCER = os.getenv('DATABASE_PGBOUNCER', 'False').lower() == 'true'
+    DATABASE_NULL_POOL = os.getenv('DATABASE_NULL_POOL', 'False').lower() == 'true'
+    DATABASE_MAX_CONNECTIONS = int(os.getenv('DATABASE_MAX_CONNECTIONS', 0))
+    WEB_CONCURRENCY = int(os.getenv('WEB_CONCURRENCY', 1))
+    # Optional streaming replica for the dashboard's GET requests. Reads fall back to the
+    # primary while its lag (checked this often) is over the threshold.
+    DATABASE_READ_URL = os.getenv('DATABASE_READ_URL')
+    READ_REPLICA_MAX_LAG_SECONDS = float(os.getenv('READ_REPLICA_MAX_LAG_SECONDS', 10))
+    READ_REPLICA_LAG_CHECK_SECONDS = float(os.getenv('READ_REPLICA_LAG_CHECK_SECONDS', 5))
+    # gzip JSON responses at least this large when the client accepts it, 0 to disable
+    GZIP_MIN_BYTES = int(os.getenv('GZIP_MIN_BYTES', 1024))
+    GZIP_LEVEL = 6
+    # Company-wide analytics: worker processes used for fleets of at least
+    # ANALYTICS_POOL_MIN_CONTROLLERS controllers, 0 to compute in the request
+    ANALYTICS_WORKERS = int(os.getenv('ANALYTICS_WORKERS', 0))
+    ANALYTICS_POOL_MIN_CONTROLLERS = int(os.getenv('ANALYTICS_POOL_MIN_CONTROLLERS', 200))
+    TIMESCALEDB = TIMESCALEDB
+    # Timescale mode: compress signal chunks older than this
+    TIMESCALE_COMPRESS_AFTER_DAYS = int(os.getenv('TIMESCALE_COMPRESS_AFTER_DAYS', 7))
+    SIGNALS_PARTITIONED = SIGNALS_PARTITIONED
+    # Partitioned mode: monthly partitions are created this many months ahead, checked this often
+    PARTITION_MONTHS_AHEAD = int(os.getenv('PARTITION_MONTHS_AHEAD', 3))
+    PARTITION_MAINTENANCE_SECONDS = int(os.getenv('PARTITION_MAINTENANCE_SECONDS', 21600))
 
 class DevelopmentSessionConfig(BaseConfig):
     DEBUG = True
@@ -51,7 +123,7 @@ class DevelopmentSessionConfig(BaseConfig):
     application_name = "IoT-Backend-Prod_transaction"
 
     SOCKET = True
-    SQLALCHEMY_DATABASE_URI = f"postgresql+psycopg2://{username}:{password}@{host}:{port}/{database_name}?application_name={application_name}"
+    SQLALCHEMY_DATABASE_URI = f"{DATABASE_DRIVER}://{username}:{password}@{host}:{port}/{database_name}?application_name={application_name}"
     MAIL_DEBUG = True
 
 class DevelopmentTransactionConfig(BaseConfig):
@@ -76,7 +148,7 @@ class DevelopmentTransactionConfig(BaseConfig):
     application_name = "IoT-Backend-Prod_transaction"
 
     SOCKET = False
-    SQLALCHEMY_DATABASE_URI = f"postgresql+psycopg2://{username}:{password}@{host}:{port}/{database_name}?application_name={application_name}"
+    SQLALCHEMY_DATABASE_URI = f"{DATABASE_DRIVER}://{username}:{password}@{host}:{port}/{database_name}?application_name={application_name}"
     MAIL_DEBUG = True
 
 class ProductionSessionConfig(BaseConfig):
@@ -102,7 +174,7 @@ class ProductionSessionConfig(BaseConfig):
         os.getenv('FRONTEND_URL')
     ]
     SOCKET = True
-    SQLALCHEMY_DATABASE_URI = f"postgresql+psycopg2://{username}:{password}@{host}:{port}/{database_name}?sslmode=require&application_name={application_name}"
+    SQLALCHEMY_DATABASE_URI = f"{DATABASE_DRIVER}://{username}:{password}@{host}:{port}/{database_name}?sslmode=require&application_name={application_name}"
     
     MAIL_DEBUG = False
     MAIL_SUPPRESS_SEND = False
@@ -131,7 +203,7 @@ class ProductionTransactionConfig(BaseConfig):
     application_name = "IoT-Backend-Prod_transaction"
 
     SOCKET = False
-    SQLALCHEMY_DATABASE_URI = f"postgresql+psycopg2://{username}:{password}@{host}:{port}/{database_name}?sslmode=require&application_name={application_name}"
+    SQLALCHEMY_DATABASE_URI = f"{DATABASE_DRIVER}://{username}:{password}@{host}:{port}/{database_name}?sslmode=require&application_name={application_name}"
     
     MAIL_DEBUG = False
     MAIL_SUPPRESS_SEND = False
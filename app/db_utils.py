@@ -6,6 +6,8 @@ from contextlib import contextmanager
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy import text
 from .models import DatabaseConnectionLog, db
+from .services.replica_service import replica_router
+from .utils.database import pool_monitor
 
 # Set up logging
 logging.basicConfig(filename='database_connections.log', level=logging.INFO,
@@ -60,21 +62,28 @@ def db_connection_logger(is_transaction=False):
             logging.info(f"{'Transaction' if is_transaction else 'Session'} closed - PID: {os.getpid()}")
 
 def get_db_stats():
+    """
+    Live statistics of this process's connection pools (no database access), the
+    read replica's state and the database's connection counts from pg_stat_activity
+    """
+    # Taken first, so the pg_stat_activity query's own checkout is not counted
+    stats = {'pools': pool_monitor.stats(), 'read_replica': replica_router.status()}
     try:
-        with db_connection_logger() as session:
-            result = session.execute(text("""
+        with current_app.db_factory() as session:
+            activity = session.execute(text("""
                 SELECT count(*) as active_connections,
                        count(*) filter (where state = 'idle') as idle_connections,
                        count(*) filter (where state = 'active') as busy_connections
                 FROM pg_stat_activity
                 WHERE datname = current_database()
-            """))
-            stats = result.fetchone()
-            return jsonify({
-                'active_connections': stats.active_connections,
-                'idle_connections': stats.idle_connections,
-                'busy_connections': stats.busy_connections
-            })
+            """)).one()
+        stats.update({
+            'active_connections': activity.active_connections,
+            'idle_connections': activity.idle_connections,
+            'busy_connections': activity.busy_connections
+        })
+        return jsonify(stats)
     except Exception as e:
         current_app.logger.error(f"Error getting DB stats: {str(e)}")
-        return jsonify({'error': 'Failed to get database stats'}), 500
\ No newline at end of file
+        # Pool statistics are still reported, they are most useful when connections run out
+        return jsonify({**stats, 'error': 'Failed to get database stats'}), 500
@@ -1,5 +1,7 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_socketio import SocketIO
+from flask_caching import Cache
+from apscheduler.schedulers.background import BackgroundScheduler
 
 
 db = SQLAlchemy()
@@ -17,3 +19,5 @@ socketio = SocketIO(
     path='/socket.io'
 )
 
+cache = Cache()
+scheduler = BackgroundScheduler(timezone='UTC')
@@ -0,0 +1,35 @@
+# Apply signal retention now
+#
+# Usage:
+#   python -m app.maintenance_scripts.apply_retention <database_url> [empresa_id ...]
+#
+# Runs the same compaction and deletion as the scheduled retention job, for every
+# company or the ones given, using each company's policy and the RETENTION_*
+# defaults from the environment, and prints what was reclaimed.
+import sys
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.config import BaseConfig
+from app.models import db
+from app.services.retention_service import apply_all_retention
+
+
+def run(db_url, empresa_ids=None):
+    engine = create_engine(db_url)
+    db.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    defaults = {name: getattr(BaseConfig, name) for name in dir(BaseConfig) if name.startswith('RETENTION_')}
+    try:
+        reports = apply_all_retention(session, defaults, empresa_ids=empresa_ids or None)
+        for report in reports:
+            print(f"{report['empresa_id']}: {report['compacted_rows']} rows compacted, "
+                  f"{report['deleted_rows']} deleted in {report['seconds']:.1f}s")
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: python -m app.maintenance_scripts.apply_retention <database_url> [empresa_id ...]")
+        sys.exit(1)
+    run(sys.argv[1], sys.argv[2:])
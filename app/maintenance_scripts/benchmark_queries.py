@@ -0,0 +1,342 @@
+# Query benchmarks against a synthetic dataset
+#
+# Usage:
+#   python -m app.maintenance_scripts.benchmark_queries <database_url> [benchmark ...]
+#
+# Seeds a dedicated 'bench' company (skipped if it already exists) and times the
+# old per-controller query patterns against their replacements. Run it against a
+# scratch database: seeding 1M signals takes a while and the rows are kept.
+import sys
+import time
+import json
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+from app.models import db, Controlador, Signal
+from app.services.sensor_analytics import sensor_agreement_matrix, sensor_phi_matrix
+from app.services.service_analytics import CycleAnalyticsService, controller_metrics
+from app.services.rollup_service import rollup_sensor_on_seconds, rollup_active_seconds_by_hour
+from app.services.signal_queries import (
+    latest_signals_by_controller, recent_signals_by_controller, recent_signal_rows, sensor_on_seconds,
+    sensor_state_arrays, active_seconds_by_hour, SENSOR_COLUMNS
+)
+from app.services.export_service import signals_csv, signals_parquet, parquet_available
+from app.utils.serialization import dumps
+
+BENCH_EMPRESA_ID = 'bench'
+# One controller with a long, dense history for the per-controller analytics benchmarks
+HEAVY_CONTROLADOR_ID = 'bheavy'
+HEAVY_DAYS = 90
+HEAVY_STEP_SECONDS = 30
+BENCH_CONFIG = {
+    f"value_sensor{i}": {"name": f"Sensor {i}", "email": False, "tipo": "NA" if i % 2 else "NC"}
+    for i in range(1, 7)
+}
+
+
+def seed(engine, controllers=10_000, signals=1_000_000, step_seconds=60):
+    """Create the benchmark company with `controllers` controllers sharing `signals` readings"""
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        exists = conn.execute(text("SELECT 1 FROM empresas WHERE id = :id"), {"id": BENCH_EMPRESA_ID}).first()
+        if exists:
+            print("Benchmark data already present, skipping seed")
+            return
+
+        started = time.perf_counter()
+        conn.execute(text("INSERT INTO empresas (id, name) VALUES (:id, 'Benchmark')"), {"id": BENCH_EMPRESA_ID})
+        conn.execute(text("""
+            INSERT INTO controladores (id, name, empresa_id, config)
+            SELECT 'b' || g, 'Bench ' || g, :empresa_id, CAST(:config AS JSONB)
+            FROM generate_series(1, :controllers) AS g
+        """), {"empresa_id": BENCH_EMPRESA_ID, "config": json.dumps(BENCH_CONFIG), "controllers": controllers})
+        # Readings are spread round-robin so every controller gets signals // controllers of them
+        conn.execute(text("""
+            INSERT INTO signals (controlador_id, tstamp, value_sensor1, value_sensor2, value_sensor3,
+                                 value_sensor4, value_sensor5, value_sensor6)
+            SELECT 'b' || (1 + g % :controllers),
+                   now() - make_interval(secs => (g / :controllers) * :step),
+                   random() < 0.5, random() < 0.5, random() < 0.5,
+                   random() < 0.5, random() < 0.5, random() < 0.5
+            FROM generate_series(0, :signals - 1) AS g
+        """), {"controllers": controllers, "signals": signals, "step": step_seconds})
+        print(f"Seeded {controllers} controllers / {signals} signals in {time.perf_counter() - started:.1f}s")
+
+        started = time.perf_counter()
+        conn.execute(text("""
+            INSERT INTO controladores (id, name, empresa_id, config)
+            VALUES (:id, 'Bench heavy', :empresa_id, CAST(:config AS JSONB))
+        """), {"id": HEAVY_CONTROLADOR_ID, "empresa_id": BENCH_EMPRESA_ID, "config": json.dumps(BENCH_CONFIG)})
+        # Sensors switch in runs of a few minutes, like a machine going through fill cycles
+        conn.execute(text("""
+            INSERT INTO signals (controlador_id, tstamp, value_sensor1, value_sensor2, value_sensor3,
+                                 value_sensor4, value_sensor5, value_sensor6)
+            SELECT :id,
+                   now() - make_interval(secs => g * :step),
+                   (g / 20) % 2 = 0, (g / 7) % 3 = 0, (g / 50) % 2 = 0,
+                   (g / 13) % 2 = 0, (g / 31) % 4 = 0, random() < 0.1
+            FROM generate_series(0, :rows - 1) AS g
+        """), {"id": HEAVY_CONTROLADOR_ID, "step": HEAVY_STEP_SECONDS,
+               "rows": HEAVY_DAYS * 86400 // HEAVY_STEP_SECONDS})
+        print(f"Seeded {HEAVY_DAYS} days for {HEAVY_CONTROLADOR_ID} in {time.perf_counter() - started:.1f}s")
+    with engine.connect() as conn:
+        conn.execution_options(isolation_level='AUTOCOMMIT').execute(text("VACUUM ANALYZE signals"))
+
+
+def timed(label, fn, repeat=3):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"  {label:<45} {best * 1000:10.1f} ms")
+    return best
+
+
+def bench_latest_signals(session):
+    """Latest signal per controller: N+1 queries vs DISTINCT ON vs LATERAL LIMIT"""
+    controlador_ids = [row.id for row in session.query(Controlador.id).filter_by(empresa_id=BENCH_EMPRESA_ID)]
+
+    def per_controller():
+        for controlador_id in controlador_ids:
+            session.query(Signal).filter_by(controlador_id=controlador_id).order_by(Signal.tstamp.desc()).first()
+
+    def distinct_on():
+        session.query(Signal).\
+            filter(Signal.controlador_id.in_(controlador_ids)).\
+            distinct(Signal.controlador_id).\
+            order_by(Signal.controlador_id, Signal.tstamp.desc()).\
+            all()
+
+    timed('one query per controller (before)', per_controller, repeat=1)
+    timed('DISTINCT ON (controlador_id)', distinct_on)
+    timed('LATERAL last 1 per controller', lambda: latest_signals_by_controller(session, controlador_ids))
+    timed('LATERAL last 10 per controller', lambda: recent_signals_by_controller(session, controlador_ids, 10))
+
+
+def bench_sensor_uptime(session):
+    """SensorUptime over 7 days of the heavy controller: 12 COUNT(*) queries vs one time-weighted scan"""
+    end = datetime.now(timezone.utc)
+    start = end - timedelta(days=7)
+
+    def per_sensor_counts():
+        for sensor in SENSOR_COLUMNS:
+            session.query(Signal).filter(
+                Signal.controlador_id == HEAVY_CONTROLADOR_ID,
+                Signal.tstamp.between(start, end)
+            ).count()
+            session.query(Signal).filter(
+                Signal.controlador_id == HEAVY_CONTROLADOR_ID,
+                Signal.tstamp.between(start, end),
+                getattr(Signal, sensor) == True
+            ).count()
+
+    timed('12 COUNT(*) queries (before)', per_sensor_counts)
+    timed('single FILTER aggregate over LEAD gaps', lambda: sensor_on_seconds(session, HEAVY_CONTROLADOR_ID, start, end))
+
+
+def bench_sensor_correlation(session):
+    """SensorCorrelation over 28 days of the heavy controller: ORM rows + 30 Python passes vs NumPy"""
+    end = datetime.now(timezone.utc)
+    start = end - timedelta(days=28)
+
+    def python_passes():
+        signals = session.query(Signal).filter(
+            Signal.controlador_id == HEAVY_CONTROLADOR_ID,
+            Signal.tstamp.between(start, end)
+        ).all()
+        for s1 in SENSOR_COLUMNS:
+            for s2 in SENSOR_COLUMNS:
+                if s1 != s2:
+                    sum(1 for signal in signals if getattr(signal, s1) == getattr(signal, s2)) / len(signals)
+        session.expunge_all()
+
+    def vectorized():
+        _, states = sensor_state_arrays(session, HEAVY_CONTROLADOR_ID, start, end)
+        sensor_agreement_matrix(states)
+        sensor_phi_matrix(states)
+
+    timed('ORM objects + generator passes (before)', python_passes, repeat=1)
+    timed('packed mask fetch + NumPy (both metrics)', vectorized)
+
+
+def bench_operational_hours(session):
+    """Operational-hours heatmap over 30 days of the heavy controller: ORM rows + Python vs one grouped query"""
+    end = datetime.now(timezone.utc)
+    start = end - timedelta(days=30)
+
+    def python_loop():
+        signals = session.query(Signal).filter(
+            Signal.controlador_id == HEAVY_CONTROLADOR_ID,
+            Signal.tstamp.between(start, end)
+        ).order_by(Signal.tstamp).all()
+        heatmap = {}
+        for signal in signals:
+            is_active = any(
+                (config['tipo'] == 'NA' and getattr(signal, sensor_key)) or
+                (config['tipo'] == 'NC' and not getattr(signal, sensor_key))
+                for sensor_key, config in BENCH_CONFIG.items()
+            )
+            if is_active:
+                key = (signal.tstamp.date(), signal.tstamp.hour)
+                heatmap[key] = heatmap.get(key, 0) + 5
+        session.expunge_all()
+
+    timed('ORM objects + per-row config rule (before)', python_loop, repeat=1)
+    timed('date_trunc grouped aggregate', lambda: active_seconds_by_hour(session, HEAVY_CONTROLADOR_ID, BENCH_CONFIG, start, end))
+
+
+def bench_cycle_analytics(session):
+    """Cycle analytics over 90 days of the heavy controller: ORM rows + pairwise Python loop vs NumPy edges"""
+    end = datetime.now(timezone.utc)
+    start = end - timedelta(days=HEAVY_DAYS)
+
+    def python_loop():
+        signals = session.query(Signal).filter(
+            Signal.controlador_id == HEAVY_CONTROLADOR_ID,
+            Signal.tstamp.between(start, end)
+        ).order_by(Signal.tstamp).all()
+        cycles = []
+        cycle_start = None
+        for i in range(len(signals) - 1):
+            current, next_signal = signals[i], signals[i + 1]
+            if not current.value_sensor1 and next_signal.value_sensor1:
+                if cycle_start:
+                    cycles.append((cycle_start, next_signal.tstamp))
+                cycle_start = next_signal.tstamp
+            elif current.value_sensor1 and not next_signal.value_sensor1:
+                cycle_start = next_signal.tstamp
+        durations = [(cycle_end - cycle_start).total_seconds() / 60 for cycle_start, cycle_end in cycles]
+        average = sum(durations) / len(durations)
+        sum(1 for duration in durations if abs(duration - average) <= average * 0.1)
+        session.expunge_all()
+
+    timed('ORM objects + pairwise loop (before)', python_loop, repeat=1)
+    timed('two-column fetch + diff/flatnonzero', lambda: CycleAnalyticsService(session).get_cycle_analytics(HEAVY_CONTROLADOR_ID, HEAVY_DAYS))
+
+
+def bench_rollups(session):
+    """30-day uptime and operational hours of the heavy controller: raw scans vs hourly rollups (run rebuild_rollups first)"""
+    end = datetime.now(timezone.utc)
+    start = end - timedelta(days=30)
+
+    timed('uptime from raw signals', lambda: sensor_on_seconds(session, HEAVY_CONTROLADOR_ID, start, end))
+    timed('uptime from rollups + partial hours', lambda: rollup_sensor_on_seconds(session, HEAVY_CONTROLADOR_ID, start, end))
+    timed('operational hours from raw signals', lambda: active_seconds_by_hour(session, HEAVY_CONTROLADOR_ID, BENCH_CONFIG, start, end))
+    timed('operational hours from rollups + partial hours',
+          lambda: rollup_active_seconds_by_hour(session, HEAVY_CONTROLADOR_ID, BENCH_CONFIG, start, end))
+
+
+def bench_dashboard_serialization(session):
+    """Company dashboard payload (10 signals per controller): ORM + to_dict + marshal + json vs row tuples + dumps"""
+    from flask_restx import marshal
+    from app.api.dashboard import controlador_model, controller_rows
+
+    def marshalled():
+        controladores = session.query(Controlador).filter_by(empresa_id=BENCH_EMPRESA_ID).all()
+        recent = recent_signals_by_controller(session, [c.id for c in controladores], limit=10)
+        payload = []
+        for controlador in controladores:
+            controlador_dict = controlador.to_dict()
+            controlador_dict['señales'] = [signal.to_dict() for signal in recent[controlador.id]]
+            payload.append(controlador_dict)
+        json.dumps(marshal(payload, controlador_model))
+        session.expunge_all()
+
+    def rows():
+        controladores = controller_rows(session, Controlador.empresa_id == BENCH_EMPRESA_ID)
+        recent = recent_signal_rows(session, [c['id'] for c in controladores], limit=10)
+        for controlador in controladores:
+            controlador['señales'] = recent[controlador['id']]
+        dumps(controladores)
+
+    timed('ORM + to_dict + marshal_list_with + json (before)', marshalled, repeat=1)
+    timed('row tuples + dumps', rows)
+
+
+def bench_export(session):
+    """Export 90 days of the heavy controller: one COPY TO STDOUT vs batched CSV / Parquet export (rows per second)"""
+    end = datetime.now(timezone.utc)
+    start = end - timedelta(days=HEAVY_DAYS)
+    rows = session.query(Signal).filter(
+        Signal.controlador_id == HEAVY_CONTROLADOR_ID, Signal.tstamp >= start, Signal.tstamp < end
+    ).count()
+
+    class NullSink:
+        def write(self, data):
+            return len(data)
+
+    def copy_to_stdout():
+        cursor = session.connection().connection.cursor()
+        cursor.copy_expert(
+            f"COPY (SELECT id, controlador_id, tstamp, {', '.join(SENSOR_COLUMNS)} FROM signals "
+            f"WHERE controlador_id = '{HEAVY_CONTROLADOR_ID}' AND tstamp >= '{start.isoformat()}' "
+            f"AND tstamp < '{end.isoformat()}' ORDER BY tstamp, id) TO STDOUT WITH CSV HEADER",
+            NullSink()
+        )
+
+    def drain(chunks):
+        for _ in chunks:
+            pass
+
+    exporters = [('COPY ... TO STDOUT (reference)', copy_to_stdout),
+                 ('keyset COPY batches -> CSV chunks',
+                  lambda: drain(signals_csv(session, start, end, Signal.controlador_id == HEAVY_CONTROLADOR_ID)))]
+    if parquet_available():
+        exporters.append(('keyset COPY batches -> Parquet row groups',
+                          lambda: drain(signals_parquet(session, start, end, Signal.controlador_id == HEAVY_CONTROLADOR_ID))))
+    for label, exporter in exporters:
+        best = timed(label, exporter)
+        print(f"  {'':<45} {rows / best:10.0f} rows/s")
+
+
+def bench_fleet_analytics(session, workers=4):
+    """Cycle and uptime metrics for every controller of the company over 7 days: per-controller queries vs one ordered scan"""
+    end = datetime.now(timezone.utc)
+    start = end - timedelta(days=7)
+    controlador_ids = [row.id for row in session.query(Controlador.id).filter_by(empresa_id=BENCH_EMPRESA_ID)]
+
+    def per_controller():
+        for controlador_id in controlador_ids:
+            epochs, states = sensor_state_arrays(session, controlador_id, start, end)
+            controller_metrics(epochs, states, start.timestamp(), end.timestamp(), end.date())
+
+    service = CycleAnalyticsService(session)
+    timed('one query per controller (before)', per_controller, repeat=1)
+    timed('one scan ordered by controller', lambda: service.get_empresa_analytics(BENCH_EMPRESA_ID, 7))
+    timed(f'one scan + {workers} worker processes', lambda: service.get_empresa_analytics(BENCH_EMPRESA_ID, 7, workers))
+
+
+BENCHMARKS = {
+    'latest_signals': bench_latest_signals,
+    'sensor_uptime': bench_sensor_uptime,
+    'sensor_correlation': bench_sensor_correlation,
+    'operational_hours': bench_operational_hours,
+    'cycle_analytics': bench_cycle_analytics,
+    'rollups': bench_rollups,
+    'dashboard_serialization': bench_dashboard_serialization,
+    'export': bench_export,
+    'fleet_analytics': bench_fleet_analytics,
+}
+
+
+def run(db_url, names=None):
+    engine = create_engine(db_url)
+    seed(engine)
+    session = sessionmaker(bind=engine)()
+    try:
+        for name in names or BENCHMARKS:
+            benchmark = BENCHMARKS[name]
+            print(f"{name}: {benchmark.__doc__}")
+            benchmark(session)
+            session.rollback()
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: python -m app.maintenance_scripts.benchmark_queries <database_url> [benchmark ...]")
+        sys.exit(1)
+    run(sys.argv[1], sys.argv[2:] or None)
@@ -0,0 +1,23 @@
+# Query plan regression check
+#
+# Usage:
+#   python -m app.maintenance_scripts.check_query_plans <database_url> [query ...]
+#
+# Runs tests/test_query_plans.py against database_url, which seeds a dedicated
+# synthetic fleet (companies 'plan1'..., skipped if present) and checks the plans
+# of the hot queries of ingest, the dashboard, alerts and retention. Queries are
+# selected by name (e.g. signal_page); the script exits with status 1 if one fails.
+# Run it against a scratch database on a local PostgreSQL after changing a query
+# or an index: the rows are kept for the next run.
+import os
+import sys
+import unittest
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: python -m app.maintenance_scripts.check_query_plans <database_url> [query ...]")
+        sys.exit(1)
+    # The test module reads the URL when it is imported
+    os.environ['TEST_DATABASE_URL'] = sys.argv[1]
+    patterns = [arg for name in sys.argv[2:] for arg in ('-k', f'test_{name}')]
+    unittest.main(module='tests.test_query_plans', argv=[sys.argv[0], '-v', *patterns])
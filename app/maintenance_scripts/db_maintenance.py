@@ -4,7 +4,7 @@ from sqlalchemy import text
 def kill_idle_connections(idle_time_minutes=30):
     try:
         with current_app.app_context():
-            engine = current_app.extensions['sqlalchemy'].db.engine
+            engine = current_app.extensions['sqlalchemy'].engine
             with engine.connect() as connection:
                 connection.execute(text(f"""
                     SELECT pg_terminate_backend(pid)
@@ -0,0 +1,109 @@
+# Convert signals to a partitioned table and check partition pruning
+#
+# Usage:
+#   SIGNALS_PARTITIONED=true python -m app.maintenance_scripts.partition_signals <database_url>
+#
+# If signals is still a plain table, it is recreated range-partitioned by month
+# with a partition per month from its first reading to PARTITION_MONTHS_AHEAD
+# months ahead, and every row is copied over, in one transaction (writes to
+# signals wait until it commits). The foreign key from aviso_logs.signal_id is
+# dropped, as partitioned mode has none.
+#
+# Then the plans of representative time-window queries are printed with the
+# partitions they read; it exits with status 1 if one reads a month outside its range.
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from dateutil.relativedelta import relativedelta
+from sqlalchemy import create_engine, select, text, func
+from sqlalchemy.orm import Session
+from app.config import SIGNALS_PARTITIONED, BaseConfig
+from app.models import Signal, Controlador
+from app.services.partition_service import (
+    create_partitions, signal_partitions, scanned_partitions, month_floor, DEFAULT_PARTITION
+)
+from app.services.signal_queries import reading_durations, CONNECTION_TIMEOUT_SECONDS
+from app.services.export_service import export_select
+
+COPIED_COLUMNS = ', '.join(column.name for column in Signal.__table__.columns)
+
+
+def convert(session):
+    """Recreate signals partitioned and copy its rows, unless it already is partitioned"""
+    kind = session.execute(text("SELECT relkind FROM pg_class WHERE oid = 'signals'::regclass")).scalar()
+    if kind == 'p':
+        print("signals is already partitioned")
+        return
+
+    started = time.perf_counter()
+    session.execute(text("ALTER TABLE aviso_logs DROP CONSTRAINT IF EXISTS aviso_logs_signal_id_fkey"))
+    # Index and sequence names are schema-wide, so the old ones are moved out of the way
+    session.execute(text("ALTER TABLE signals RENAME TO signals_unpartitioned"))
+    for index in ('signals_pkey', 'ix_signals_controlador_id_tstamp', 'ix_signals_controlador_id_tstamp_id',
+                  'ix_signals_tstamp'):
+        session.execute(text(f"ALTER INDEX IF EXISTS {index} RENAME TO {index}_unpartitioned"))
+    session.execute(text("ALTER SEQUENCE IF EXISTS signals_id_seq RENAME TO signals_id_seq_unpartitioned"))
+
+    Signal.__table__.create(session.connection())
+    first = session.execute(text("SELECT min(tstamp) FROM signals_unpartitioned")).scalar()
+    now = datetime.now(timezone.utc)
+    create_partitions(session, first or now, now + relativedelta(months=BaseConfig.PARTITION_MONTHS_AHEAD))
+
+    copied = session.execute(text(
+        f"INSERT INTO signals ({COPIED_COLUMNS}) SELECT {COPIED_COLUMNS} FROM signals_unpartitioned"
+    )).rowcount
+    session.execute(text("SELECT setval(pg_get_serial_sequence('signals', 'id'), max(id)) FROM signals"))
+    session.execute(text("DROP TABLE signals_unpartitioned"))
+    session.commit()
+    print(f"Copied {copied} signals into {len(signal_partitions(session))} monthly partitions "
+          f"in {time.perf_counter() - started:.1f}s")
+
+
+def check_pruning(session) -> bool:
+    """Print the partitions each sample query reads; False if one reads a month outside its range"""
+    now = datetime.now(timezone.utc)
+    this_month = month_floor(now)
+    last_month = month_floor(this_month - timedelta(days=1))
+    controlador_id = session.execute(select(Controlador.id).limit(1)).scalar()
+    max_gap = timedelta(seconds=CONNECTION_TIMEOUT_SECONDS)
+
+    # (label, statement, [start, end) of the signals it reads)
+    queries = [
+        ("controller window, last 24h", select(reading_durations(controlador_id, now - timedelta(days=1), now)),
+         now - timedelta(days=1) - max_gap, now),
+        ("fleet window, last 7 days", select(reading_durations(None, now - timedelta(days=7), now)),
+         now - timedelta(days=7) - max_gap, now),
+        ("export, last month", export_select(last_month, this_month), last_month, this_month),
+        ("controller readings this month", select(func.max(Signal.tstamp)).where(
+            Signal.controlador_id == controlador_id, Signal.tstamp >= this_month), this_month, None),
+    ]
+
+    partitions = signal_partitions(session)
+    pruned = True
+    for label, statement, start, end in queries:
+        expected = {
+            name for name, partition_start, partition_end in partitions
+            if partition_end > start and (end is None or partition_start < end)
+        } | {DEFAULT_PARTITION}
+        scanned = scanned_partitions(session, statement)
+        ok = set(scanned) <= expected
+        pruned = pruned and ok
+        print(f"{'ok  ' if ok else 'FAIL'} {label}: {', '.join(scanned)}")
+    return pruned
+
+
+def run(db_url) -> bool:
+    if not SIGNALS_PARTITIONED:
+        print("Set SIGNALS_PARTITIONED=true so the models define signals as partitioned")
+        return False
+    engine = create_engine(db_url)
+    with Session(engine) as session:
+        convert(session)
+        return check_pruning(session)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: SIGNALS_PARTITIONED=true python -m app.maintenance_scripts.partition_signals <database_url>")
+        sys.exit(1)
+    sys.exit(0 if run(sys.argv[1]) else 1)
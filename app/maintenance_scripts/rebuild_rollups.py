@@ -0,0 +1,50 @@
+# Rebuild the hourly signal rollups
+#
+# Usage:
+#   python -m app.maintenance_scripts.rebuild_rollups <database_url> [days]
+#
+# Recomputes signal_rollups_hourly for the last `days` days (default 30) up to
+# the last closed hour, one day per transaction. The scheduled refresh job keeps
+# extending the covered range from there. Hours whose signals have already been
+# compacted by the retention job are skipped: their rollups are the only full record.
+import sys
+import time
+from datetime import timedelta
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import sessionmaker
+from app.models import db, RetentionPolicy
+from app.services.rollup_service import refresh_hourly_rollups, closed_until
+
+CHUNK = timedelta(days=1)
+
+
+def rebuild(db_url, days=30):
+    engine = create_engine(db_url)
+    db.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    end_hour = closed_until()
+    chunk_start = end_hour - timedelta(days=days)
+    try:
+        compacted_until = session.query(func.max(RetentionPolicy.compacted_until)).scalar()
+        if compacted_until is not None and compacted_until > chunk_start:
+            print(f"Signals before {compacted_until.isoformat()} are compacted, starting there")
+            chunk_start = compacted_until
+        while chunk_start < end_hour:
+            chunk_end = min(chunk_start + CHUNK, end_hour)
+            started = time.perf_counter()
+            written = refresh_hourly_rollups(session, chunk_start, chunk_end)
+            session.commit()
+            if written is None:
+                print("Another rollup refresh is running, try again later")
+                return
+            print(f"{chunk_start.isoformat()} - {chunk_end.isoformat()}: {written} rows in {time.perf_counter() - started:.1f}s")
+            chunk_start = chunk_end
+    finally:
+        session.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: python -m app.maintenance_scripts.rebuild_rollups <database_url> [days]")
+        sys.exit(1)
+    rebuild(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 30)
@@ -1,9 +1,8 @@
-from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.dialects.postgresql import JSONB, TIMESTAMP
 from sqlalchemy.sql import func
 import uuid
-
-db = SQLAlchemy()
+from .config import TIMESCALEDB, SIGNALS_PARTITIONED
+from .extensions import db
 
 def generate_uuid():
     return str(uuid.uuid4())
@@ -21,12 +20,19 @@ class Empresa(BaseModel):
 
 class Controlador(BaseModel):
     __tablename__ = 'controladores'
+    __table_args__ = (
+        # Serves every per-company controller lookup (listings, analytics, retention)
+        db.Index('ix_controladores_empresa_id', 'empresa_id'),
+    )
     id = db.Column(db.String(15), primary_key=True)  # Phone number as ID
     name = db.Column(db.String(255), nullable=False)
     empresa_id = db.Column(db.String(36), db.ForeignKey('empresas.id'), nullable=False)
     empresa = db.relationship('Empresa', back_populates='controladores')
     señales = db.relationship('Signal', back_populates='controlador', cascade='all, delete-orphan')
     config = db.Column(JSONB)
+    # Soft delete: set when deletion is requested, which hides the controller from the app's
+    # queries; it is then purged with its data in the background (services/controller_deletion_service.py)
+    deleted_at = db.Column(TIMESTAMP(timezone=True), nullable=True)
 
     def to_dict(self):
         return {
@@ -39,9 +45,21 @@ class Controlador(BaseModel):
 
 class Signal(BaseModel):
     __tablename__ = 'signals'
+    __table_args__ = (
+        # Serves latest-signal lookups and per-controller time ranges; id makes it match the
+        # (tstamp, id) keyset order of signal pages and exports, so they need no sort
+        db.Index('ix_signals_controlador_id_tstamp_id', 'controlador_id', 'tstamp', 'id'),
+        # Serves the all-controller time-range scans of the hourly rollup refresh
+        db.Index('ix_signals_tstamp', 'tstamp'),
+        # Timescale mode: created as a hypertable (only runs on the timescaledb dialect)
+        {'timescaledb_hypertable': {'time_column_name': 'tstamp', 'chunk_time_interval': '7 days'}} if TIMESCALEDB else
+        # Partitioned mode: monthly partitions are created by services/partition_service.py
+        {'postgresql_partition_by': 'RANGE (tstamp)'} if SIGNALS_PARTITIONED else {},
+    )
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     controlador_id = db.Column(db.String(15), db.ForeignKey('controladores.id'), nullable=False)
-    tstamp = db.Column(TIMESTAMP(timezone=True), server_default=func.now())
+    # Hypertable and partitioned table unique constraints must include the partitioning column
+    tstamp = db.Column(TIMESTAMP(timezone=True), server_default=func.now(), primary_key=TIMESCALEDB or SIGNALS_PARTITIONED)
     controlador = db.relationship('Controlador', back_populates='señales')
     value_sensor1 = db.Column(db.Boolean)
     value_sensor2 = db.Column(db.Boolean)
@@ -63,6 +81,37 @@ class Signal(BaseModel):
             'value_sensor6': self.value_sensor6
         }
 
+class SignalRollupHourly(BaseModel):
+    """
+    Per-controller, per-UTC-hour aggregates of signals, maintained by
+    services/rollup_service.py for closed hours. Seconds are time-weighted the
+    same way as signal_queries.reading_durations.
+    """
+    __tablename__ = 'signal_rollups_hourly'
+    __table_args__ = (
+        # Coverage bounds (min/max hour) are read on every rollup-backed request
+        db.Index('ix_signal_rollups_hourly_hour', 'hour'),
+    )
+    controlador_id = db.Column(db.String(15), db.ForeignKey('controladores.id', ondelete='CASCADE'), primary_key=True)
+    hour = db.Column(TIMESTAMP(timezone=True), primary_key=True)
+    reading_count = db.Column(db.Integer, nullable=False, default=0)
+    connected_seconds = db.Column(db.Float, nullable=False, default=0)
+    on_seconds_sensor1 = db.Column(db.Float, nullable=False, default=0)
+    on_seconds_sensor2 = db.Column(db.Float, nullable=False, default=0)
+    on_seconds_sensor3 = db.Column(db.Float, nullable=False, default=0)
+    on_seconds_sensor4 = db.Column(db.Float, nullable=False, default=0)
+    on_seconds_sensor5 = db.Column(db.Float, nullable=False, default=0)
+    on_seconds_sensor6 = db.Column(db.Float, nullable=False, default=0)
+    transitions_sensor1 = db.Column(db.Integer, nullable=False, default=0)
+    transitions_sensor2 = db.Column(db.Integer, nullable=False, default=0)
+    transitions_sensor3 = db.Column(db.Integer, nullable=False, default=0)
+    transitions_sensor4 = db.Column(db.Integer, nullable=False, default=0)
+    transitions_sensor5 = db.Column(db.Integer, nullable=False, default=0)
+    transitions_sensor6 = db.Column(db.Integer, nullable=False, default=0)
+    # Connected seconds per combination of sensor states ({"<6-bit mask>": seconds}),
+    # so config-dependent rules (NA/NC "any active") can be evaluated from rollups
+    state_seconds = db.Column(JSONB, nullable=False, default=dict)
+
 class User(BaseModel):
     __tablename__ = 'users'
     id = db.Column(db.String(36), primary_key=True, default=generate_uuid)
@@ -76,6 +125,10 @@ class User(BaseModel):
 
 class Aviso(BaseModel):
     __tablename__ = 'avisos'
+    __table_args__ = (
+        # Serves the active alerts of a controller, checked on every reading, and its alert listings
+        db.Index('ix_avisos_controlador_id_is_active', 'controlador_id', 'is_active'),
+    )
     id = db.Column(db.String(36), primary_key=True, default=generate_uuid)
     controlador_id = db.Column(db.String(15), db.ForeignKey('controladores.id'), nullable=False)
     name = db.Column(db.String(255), nullable=False)
@@ -101,19 +154,29 @@ class Aviso(BaseModel):
 
 class AvisoLog(BaseModel):
     __tablename__ = 'aviso_logs'
+    __table_args__ = (
+        # Serves the keyset-paginated alert log listing, newest first per alert
+        db.Index('ix_aviso_logs_aviso_id_triggered_at_id', 'aviso_id', 'triggered_at', 'id'),
+        # Latest unresolved log of an alert, looked up on every reading; resolved logs are most
+        # of the table and never read through it, so they are left out
+        db.Index('ix_aviso_logs_unresolved', 'aviso_id', 'triggered_at', postgresql_where=db.text('resolved = false')),
+        # Serves the referenced-signal checks of retention
+        db.Index('ix_aviso_logs_signal_id', 'signal_id', postgresql_where=db.text('signal_id IS NOT NULL')),
+    )
     id = db.Column(db.String(36), primary_key=True, default=generate_uuid)
     aviso_id = db.Column(db.String(36), db.ForeignKey('avisos.id'), nullable=False)
     triggered_at = db.Column(TIMESTAMP(timezone=True), server_default=func.now())
     sensor_name = db.Column(db.String(255), nullable=False)
     old_value = db.Column(db.Boolean)
     new_value = db.Column(db.Boolean)
-    signal_id = db.Column(db.Integer, db.ForeignKey('signals.id'))
+    # signals.id alone is not unique on a hypertable or partitioned table, so those modes drop this foreign key
+    signal_id = db.Column(db.Integer, *([] if TIMESCALEDB or SIGNALS_PARTITIONED else [db.ForeignKey('signals.id')]))
     resolved = db.Column(db.Boolean, default=False)
     resolved_at = db.Column(TIMESTAMP(timezone=True), nullable=True)
     
     # Add relationships
     aviso = db.relationship('Aviso')
-    signal = db.relationship('Signal')
+    signal = db.relationship('Signal', primaryjoin='foreign(AvisoLog.signal_id) == Signal.id', viewonly=True)
 
     def to_dict(self):
         """Convert the AvisoLog instance to a dictionary"""
@@ -130,17 +193,46 @@ class AvisoLog(BaseModel):
         }
     
 class SensorMetrics(BaseModel):
+    """
+    Lifetime totals per controller, maintained by services/sensor_metrics_service.py:
+    connected minutes and, per sensor, minutes active under the NA/NC rules of
+    utils/sensor_utils.is_sensor_connected. Every gap between consecutive readings
+    up to `watermark` has been counted, capped at CONNECTION_TIMEOUT_SECONDS.
+    """
     __tablename__ = 'sensor_metrics'
+    __table_args__ = (
+        db.UniqueConstraint('controlador_id', name='uq_sensor_metrics_controlador_id'),
+    )
     id = db.Column(db.String(36), primary_key=True, default=generate_uuid)
     controlador_id = db.Column(db.String(15), db.ForeignKey('controladores.id'), nullable=False)
-    connected_time_minutes = db.Column(db.Integer, default=0)
-    time_value_sensor1 = db.Column(db.Integer, default=0)
-    time_value_sensor2 = db.Column(db.Integer, default=0)
-    time_value_sensor3 = db.Column(db.Integer, default=0)
-    time_value_sensor4 = db.Column(db.Integer, default=0)
-    time_value_sensor5 = db.Column(db.Integer, default=0)
-    time_value_sensor6 = db.Column(db.Integer, default=0)
-
+    connected_time_minutes = db.Column(db.Float, nullable=False, default=0)
+    time_value_sensor1 = db.Column(db.Float, nullable=False, default=0)
+    time_value_sensor2 = db.Column(db.Float, nullable=False, default=0)
+    time_value_sensor3 = db.Column(db.Float, nullable=False, default=0)
+    time_value_sensor4 = db.Column(db.Float, nullable=False, default=0)
+    time_value_sensor5 = db.Column(db.Float, nullable=False, default=0)
+    time_value_sensor6 = db.Column(db.Float, nullable=False, default=0)
+    # Timestamp of the last reading counted
+    watermark = db.Column(TIMESTAMP(timezone=True))
+
+
+
+class RetentionPolicy(BaseModel):
+    """
+    Signal retention of a company, applied by services/retention_service.py.
+    Readings older than raw_days are compacted to change events, connection
+    boundaries and two readings per CONNECTION_TIMEOUT_SECONDS, which are kept
+    event_months longer; hourly rollups are kept forever. NULL uses the RETENTION_* config defaults, 0 keeps data forever.
+    """
+    __tablename__ = 'retention_policies'
+    empresa_id = db.Column(db.String(36), db.ForeignKey('empresas.id', ondelete='CASCADE'), primary_key=True)
+    raw_days = db.Column(db.Integer)
+    event_months = db.Column(db.Integer)
+    # Signals before this have been compacted
+    compacted_until = db.Column(TIMESTAMP(timezone=True))
+    last_run_at = db.Column(TIMESTAMP(timezone=True))
+    last_run_seconds = db.Column(db.Float)
+    last_rows_reclaimed = db.Column(db.BigInteger)
 
 
 class DatabaseConnectionLog(BaseModel):
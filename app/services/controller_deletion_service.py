@@ -0,0 +1,204 @@
+from typing import Callable, Dict, List, Optional
+from datetime import datetime, timezone
+import logging
+from sqlalchemy import select, delete, event, func, tuple_
+from sqlalchemy.orm import Session, with_loader_criteria
+from ..extensions import socketio
+from ..models import Controlador, Signal, Aviso, AvisoLog, SignalRollupHourly, SensorMetrics
+from .sensor_metrics_service import sensor_metrics_accumulator
+
+logger = logging.getLogger(__name__)
+
+# Advisory lock, with the controller id's hash as second key, so only one worker
+# purges a given controller at a time
+PURGE_LOCK_KEY = 7_350_005
+PROGRESS_EVENT = 'controller_deletion_progress'
+
+
+def exclude_deleted_controllers(session_factory) -> None:
+    """
+    Hide soft-deleted controllers from every ORM query of sessions made by
+    session_factory, subqueries and Session.get included. Queries executed with
+    execution_options(include_deleted=True) still see them.
+    """
+    @event.listens_for(session_factory, 'do_orm_execute')
+    def _exclude_deleted(state):
+        if state.is_select and not state.is_column_load and not state.is_relationship_load \
+                and not state.execution_options.get('include_deleted', False):
+            state.statement = state.statement.options(
+                with_loader_criteria(Controlador, Controlador.deleted_at.is_(None), include_aliases=True)
+            )
+
+
+def _delete_by_key_ranges(session: Session, entity, filters: List, keys: List, batch_rows: int,
+                          on_batch: Callable[[int], None]) -> int:
+    """
+    Delete the rows of entity matching filters in batches of batch_rows, one
+    committed transaction each. Every batch is a range of the index on keys,
+    continuing after the previous batch's last key, so no batch rescans the
+    entries (dead until vacuumed) of the rows already deleted. The range is also
+    bounded on its leading key alone, which Timescale mode can match against the
+    min/max metadata of compressed batches to decompress only those it overlaps.
+    """
+    deleted, last = 0, None
+    while True:
+        after = [tuple_(*keys) > tuple_(*last)] if last is not None else []
+        batch = session.execute(
+            select(*keys).where(*filters, *after).order_by(*keys).limit(batch_rows)
+        ).all()
+        if not batch:
+            return deleted
+        count = session.execute(
+            delete(entity).
+            where(*filters, keys[0] >= batch[0][0], keys[0] <= batch[-1][0],
+                  tuple_(*keys) >= tuple_(*batch[0]), tuple_(*keys) <= tuple_(*batch[-1])).
+            execution_options(synchronize_session=False)
+        ).rowcount
+        session.commit()
+        deleted += count
+        on_batch(count)
+        if len(batch) < batch_rows:
+            return deleted
+        last = batch[-1]
+
+
+def emit_deletion_progress(report: Dict) -> None:
+    """Broadcast a purge's progress; failures are logged, they must not stop the purge"""
+    try:
+        socketio.emit(PROGRESS_EVENT, report)
+    except Exception as e:
+        logger.error(f"Error emitting {PROGRESS_EVENT} event: {str(e)}")
+
+
+def purge_controlador(session: Session, controlador_id: str, batch_rows: int,
+                      progress: Callable[[Dict], None] = emit_deletion_progress) -> Optional[Dict]:
+    """
+    Delete a soft-deleted controller and everything recorded for it, in
+    transactions of at most batch_rows rows: alert logs, signals and hourly
+    rollups in batches, then alerts, metrics and the controller itself. progress
+    gets the running report after every batch and once done.
+
+    Returns the final report, or None if the controller is not soft-deleted or
+    another worker is purging it.
+    """
+    # Held by a transaction left open on a dedicated connection, as the purge commits many times
+    with session.get_bind().connect() as lock_connection:
+        lock = func.pg_try_advisory_xact_lock(PURGE_LOCK_KEY, func.hashtext(controlador_id))
+        if not lock_connection.execute(select(lock)).scalar():
+            logger.info(f"Controller {controlador_id} is already being purged elsewhere")
+            return None
+        try:
+            controlador = session.get(Controlador, controlador_id, execution_options={'include_deleted': True})
+            if controlador is None or controlador.deleted_at is None:
+                return None
+            report = {
+                'controlador_id': controlador_id,
+                'empresa_id': controlador.empresa_id,
+                'stage': 'alert_logs',
+                'signals_total': session.execute(
+                    select(func.count()).select_from(Signal).where(Signal.controlador_id == controlador_id)
+                ).scalar(),
+                'deleted': {'alert_logs': 0, 'signals': 0, 'rollups': 0, 'alerts': 0},
+                'done': False
+            }
+            session.commit()
+            sensor_metrics_accumulator.discard(controlador_id)
+
+            def counted(stage):
+                def on_batch(count):
+                    report['stage'] = stage
+                    report['deleted'][stage] += count
+                    progress(report)
+                return on_batch
+
+            alert_ids = session.execute(select(Aviso.id).where(Aviso.controlador_id == controlador_id)).scalars().all()
+            for alert_id in alert_ids:
+                _delete_by_key_ranges(session, AvisoLog, [AvisoLog.aviso_id == alert_id],
+                                      [AvisoLog.triggered_at, AvisoLog.id], batch_rows, counted('alert_logs'))
+            _delete_by_key_ranges(session, Signal, [Signal.controlador_id == controlador_id],
+                                  [Signal.tstamp, Signal.id], batch_rows, counted('signals'))
+            _delete_by_key_ranges(session, SignalRollupHourly, [SignalRollupHourly.controlador_id == controlador_id],
+                                  [SignalRollupHourly.hour], batch_rows, counted('rollups'))
+
+            # What is left is small: the alerts, the metrics row, the controller and any
+            # straggler the ranges could not reach (NULL timestamps)
+            report['stage'] = 'alerts'
+            if alert_ids:
+                report['deleted']['alert_logs'] += session.execute(
+                    delete(AvisoLog).where(AvisoLog.aviso_id.in_(alert_ids)).execution_options(synchronize_session=False)
+                ).rowcount
+            report['deleted']['signals'] += session.execute(
+                delete(Signal).where(Signal.controlador_id == controlador_id).
+                execution_options(synchronize_session=False)
+            ).rowcount
+            report['deleted']['alerts'] = session.execute(
+                delete(Aviso).where(Aviso.controlador_id == controlador_id).execution_options(synchronize_session=False)
+            ).rowcount
+            session.execute(delete(SensorMetrics).where(SensorMetrics.controlador_id == controlador_id).
+                            execution_options(synchronize_session=False))
+            session.execute(delete(Controlador).where(Controlador.id == controlador_id).
+                            execution_options(synchronize_session=False))
+            session.commit()
+            session.expunge(controlador)
+
+            report['stage'] = 'done'
+            report['done'] = True
+            progress(report)
+            logger.info(f"Controller {controlador_id} purged: {report['deleted']}")
+            return report
+        finally:
+            lock_connection.rollback()
+
+
+def purge_deleted_controllers(session: Session, batch_rows: int,
+                              progress: Callable[[Dict], None] = emit_deletion_progress) -> List[Dict]:
+    """purge_controlador for every soft-deleted controller (purges interrupted by a restart included)"""
+    controlador_ids = session.execute(
+        select(Controlador.id).where(Controlador.deleted_at.isnot(None)).order_by(Controlador.deleted_at).
+        execution_options(include_deleted=True)
+    ).scalars().all()
+    session.commit()
+    reports = []
+    for controlador_id in controlador_ids:
+        report = purge_controlador(session, controlador_id, batch_rows, progress)
+        if report is not None:
+            reports.append(report)
+    return reports
+
+
+def _purge_job(app, controlador_id: Optional[str] = None):
+    def job():
+        with app.app_context():
+            session = app.db_factory()
+            try:
+                if controlador_id is None:
+                    purge_deleted_controllers(session, app.config['CONTROLLER_DELETE_BATCH_ROWS'])
+                else:
+                    purge_controlador(session, controlador_id, app.config['CONTROLLER_DELETE_BATCH_ROWS'])
+            except Exception as e:
+                logger.error(f"Error purging deleted controllers: {str(e)}")
+                session.rollback()
+            finally:
+                app.db_factory.remove()
+    return job
+
+
+def start_controller_purge(app, controlador_id: str) -> None:
+    """Purge a soft-deleted controller in a background task of this worker"""
+    socketio.start_background_task(_purge_job(app, controlador_id))
+
+
+def schedule_controller_purge(app, scheduler) -> None:
+    """
+    Run purge_deleted_controllers every CONTROLLER_PURGE_SECONDS on the app's
+    scheduler, and once right away, so purges cut short by a restart resume.
+    """
+    scheduler.add_job(
+        _purge_job(app), 'interval',
+        seconds=app.config['CONTROLLER_PURGE_SECONDS'],
+        next_run_time=datetime.now(timezone.utc),
+        id='purge_deleted_controllers',
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True
+    )
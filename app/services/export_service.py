@@ -0,0 +1,168 @@
+from typing import Iterator, Tuple
+from datetime import datetime
+import csv
+import io
+import logging
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+from ..models import Signal
+from .signal_queries import SENSOR_COLUMNS
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - Parquet export is optional
+    pa = pa_csv = pq = None
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = {'csv': 'text/csv', 'parquet': 'application/vnd.apache.parquet'}
+EXPORT_COLUMNS = ['id', 'controlador_id', 'tstamp', *SENSOR_COLUMNS]
+# Rows per COPY batch (one CSV chunk / Parquet row group); bounds memory per export
+EXPORT_BATCH_ROWS = 50_000
+
+
+def export_select(start: datetime, end: datetime, *filters):
+    """
+    Signals in [start, end) matching filters, in EXPORT_COLUMNS order and time
+    order, timestamps formatted as ISO 8601 UTC by PostgreSQL
+    """
+    return select(
+        Signal.id,
+        Signal.controlador_id,
+        func.to_char(func.timezone('UTC', Signal.tstamp), 'YYYY-MM-DD"T"HH24:MI:SS.US"Z"').label('tstamp'),
+        *[getattr(Signal, sensor) for sensor in SENSOR_COLUMNS]
+    ).where(
+        Signal.tstamp >= start,
+        Signal.tstamp < end,
+        *filters
+    ).order_by(Signal.tstamp, Signal.id)
+
+
+def _copy(cursor, statement, dialect) -> bytes:
+    """Rows of statement as headerless CSV (booleans as t/f), through COPY (...) TO STDOUT"""
+    compiled = statement.compile(dialect=dialect, compile_kwargs={'render_postcompile': True})
+    query = cursor.mogrify(str(compiled), compiled.params).decode()
+    buffer = io.BytesIO()
+    cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv)", buffer)
+    return buffer.getvalue()
+
+
+def _tstamp(line: bytes) -> str:
+    return next(csv.reader([line.decode()]))[EXPORT_COLUMNS.index('tstamp')]
+
+
+def _split_last_instant(batch: bytes) -> Tuple[bytes, datetime]:
+    """(rows of a CSV batch before its last tstamp, that tstamp)"""
+    lines = batch.rstrip(b'\n').split(b'\n')
+    last = _tstamp(lines[-1])
+    cut = len(lines) - 1
+    while cut > 0 and _tstamp(lines[cut - 1]) == last:
+        cut -= 1
+    head = b'\n'.join(lines[:cut]) + b'\n' if cut else b''
+    return head, datetime.fromisoformat(last.replace('Z', '+00:00'))
+
+
+def copy_batches(session: Session, start: datetime, end: datetime, *filters,
+                 batch_rows: int = EXPORT_BATCH_ROWS) -> Iterator[bytes]:
+    """
+    The matching signals as headerless CSV (booleans as t/f), about batch_rows at a time.
+
+    Each batch is a COPY (... LIMIT batch_rows) TO STDOUT, so rows are produced at
+    COPY speed without building Python tuples, and memory holds one batch. A full
+    batch is cut before its last timestamp and the next one starts at it (keyset
+    on tstamp), so every batch is a plain index range scan however deep it is.
+    """
+    cursor = session.connection().connection.cursor()
+    dialect = session.get_bind().dialect
+    lower, past_lower = start, []
+    try:
+        while True:
+            data = _copy(cursor, export_select(lower, end, *past_lower, *filters).limit(batch_rows), dialect)
+            # Controller ids never contain newlines, so lines count rows
+            if data.count(b'\n') < batch_rows:
+                if data:
+                    yield data
+                return
+
+            head, last = _split_last_instant(data)
+            if head:
+                yield head
+                lower, past_lower = last, []
+            else:
+                # The whole batch shares one instant: take every row at it, then move past it
+                yield _copy(cursor, export_select(last, end, Signal.tstamp == last, *filters), dialect)
+                lower, past_lower = last, [Signal.tstamp > last]
+    finally:
+        cursor.close()
+
+
+def signals_csv(session: Session, start: datetime, end: datetime, *filters,
+                batch_rows: int = EXPORT_BATCH_ROWS) -> Iterator[bytes]:
+    """CSV export with a header row, one chunk per COPY batch"""
+    yield (','.join(EXPORT_COLUMNS) + '\n').encode()
+    yield from copy_batches(session, start, end, *filters, batch_rows=batch_rows)
+
+
+class _DrainingSink:
+    """Write-only file object whose contents are handed out (and dropped) as they are produced"""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def parquet_available() -> bool:
+    return pq is not None
+
+
+def signals_parquet(session: Session, start: datetime, end: datetime, *filters,
+                    batch_rows: int = EXPORT_BATCH_ROWS) -> Iterator[bytes]:
+    """
+    Parquet export streamed one row group per COPY batch, each parsed by
+    pyarrow's CSV reader (tstamp as timestamp[us, UTC]). Requires pyarrow
+    (see parquet_available).
+    """
+    if pq is None:
+        raise RuntimeError("Parquet export requires pyarrow")
+
+    schema = pa.schema([
+        ('id', pa.int64()),
+        ('controlador_id', pa.string()),
+        ('tstamp', pa.timestamp('us', tz='UTC')),
+        *[(sensor, pa.bool_()) for sensor in SENSOR_COLUMNS]
+    ])
+    read_options = pa_csv.ReadOptions(column_names=schema.names)
+    convert_options = pa_csv.ConvertOptions(column_types=schema, true_values=['t'], false_values=['f'])
+
+    sink = _DrainingSink()
+    writer = pq.ParquetWriter(pa.PythonFile(sink, mode='w'), schema)
+    try:
+        for batch in copy_batches(session, start, end, *filters, batch_rows=batch_rows):
+            table = pa_csv.read_csv(io.BytesIO(batch), read_options=read_options, convert_options=convert_options)
+            writer.write_table(table, row_group_size=table.num_rows)
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
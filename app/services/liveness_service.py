@@ -0,0 +1,132 @@
+from typing import Dict, Iterable, Optional
+from datetime import datetime, timezone
+from threading import Lock
+import logging
+from sqlalchemy.orm import Session
+from .signal_queries import latest_signals_by_controller, CONNECTION_TIMEOUT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class LivenessTracker:
+    """
+    Last-seen timestamp (epoch seconds, UTC) per controller, updated by ingest.
+
+    Kept in process memory; when REDIS_URL is configured the map is mirrored
+    to a redis hash so every worker sees the same liveness state.
+    """
+
+    REDIS_KEY = 'iot:liveness'
+    # HSET only if the timestamp is newer than the stored one, so a late or
+    # out-of-order reading cannot move a controller's liveness backwards
+    TOUCH_SCRIPT = """
+        local current = redis.call('HGET', KEYS[1], ARGV[1])
+        if current and tonumber(current) >= tonumber(ARGV[2]) then
+            return 0
+        end
+        return redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+    """
+
+    def __init__(self, app=None):
+        self._last_seen: Dict[str, float] = {}
+        self._lock = Lock()
+        self._redis = None
+        self._touch_script = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        redis_url = app.config.get('REDIS_URL')
+        if app.config.get('WEB_CONCURRENCY', 1) > 1 and not redis_url:
+            # Each worker would only know the controllers whose readings it ingested,
+            # and report the others as offline
+            raise RuntimeError("WEB_CONCURRENCY > 1 needs REDIS_URL "
+                               "to share controller liveness between workers")
+        if redis_url:
+            import redis
+            self._redis = redis.Redis.from_url(redis_url)
+            self._touch_script = self._redis.register_script(self.TOUCH_SCRIPT)
+            logger.info("Liveness tracker shared through redis")
+        app.extensions['liveness'] = self
+
+    def touch(self, controlador_id: str, tstamp: datetime) -> None:
+        """Record a reading for a controller"""
+        seen_at = tstamp.timestamp()
+        with self._lock:
+            if seen_at > self._last_seen.get(controlador_id, 0.0):
+                self._last_seen[controlador_id] = seen_at
+        if self._redis is not None:
+            try:
+                self._touch_script(keys=[self.REDIS_KEY], args=[controlador_id, seen_at])
+            except Exception as e:
+                logger.warning(f"Could not publish liveness for {controlador_id}: {str(e)}")
+
+    def last_seen(self, controlador_ids: Iterable[str]) -> Dict[str, float]:
+        """Known last-seen epochs; controllers with no entry are left out"""
+        controlador_ids = list(controlador_ids)
+        if self._redis is not None and controlador_ids:
+            try:
+                values = self._redis.hmget(self.REDIS_KEY, controlador_ids)
+                with self._lock:
+                    for controlador_id, value in zip(controlador_ids, values):
+                        if value is not None and float(value) > self._last_seen.get(controlador_id, 0.0):
+                            self._last_seen[controlador_id] = float(value)
+            except Exception as e:
+                logger.warning(f"Could not read liveness from redis: {str(e)}")
+
+        with self._lock:
+            return {
+                controlador_id: self._last_seen[controlador_id]
+                for controlador_id in controlador_ids
+                if controlador_id in self._last_seen
+            }
+
+    def seed(self, last_seen: Dict[str, float]) -> None:
+        """Fill in entries without overriding anything ingest already recorded"""
+        with self._lock:
+            for controlador_id, seen_at in last_seen.items():
+                if seen_at > self._last_seen.get(controlador_id, -1.0):
+                    self._last_seen[controlador_id] = seen_at
+        if self._redis is not None and last_seen:
+            try:
+                pipe = self._redis.pipeline()
+                for controlador_id, seen_at in last_seen.items():
+                    pipe.hsetnx(self.REDIS_KEY, controlador_id, seen_at)
+                pipe.execute()
+            except Exception as e:
+                logger.warning(f"Could not seed liveness in redis: {str(e)}")
+
+    def load_missing(self, session: Session, controlador_ids: Iterable[str]) -> Dict[str, float]:
+        """
+        Last-seen map for the given controllers, falling back to a single
+        latest-signal query for the ones not tracked yet (cold start).
+        Controllers that never reported are stored as 0.0.
+        """
+        controlador_ids = list(controlador_ids)
+        seen = self.last_seen(controlador_ids)
+        missing = [controlador_id for controlador_id in controlador_ids if controlador_id not in seen]
+        if missing:
+            latest = latest_signals_by_controller(session, missing)
+            loaded = {controlador_id: 0.0 for controlador_id in missing}
+            loaded.update({
+                controlador_id: signal.tstamp.timestamp()
+                for controlador_id, signal in latest.items() if signal.tstamp
+            })
+            self.seed(loaded)
+            seen.update(loaded)
+        return seen
+
+    def is_connected(self, seen_at: Optional[float], now: Optional[float] = None) -> bool:
+        if not seen_at:
+            return False
+        now = now if now is not None else datetime.now(timezone.utc).timestamp()
+        return seen_at > now - CONNECTION_TIMEOUT_SECONDS
+
+    def count_connected(self, session: Session, controlador_ids: Iterable[str]) -> int:
+        """Number of connected controllers among controlador_ids"""
+        seen = self.load_missing(session, controlador_ids)
+        now = datetime.now(timezone.utc).timestamp()
+        return sum(1 for seen_at in seen.values() if self.is_connected(seen_at, now))
+
+
+liveness_tracker = LivenessTracker()
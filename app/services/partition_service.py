@@ -0,0 +1,166 @@
+from typing import List, Optional, Tuple
+from datetime import datetime, timezone
+import logging
+import re
+from dateutil.relativedelta import relativedelta
+from sqlalchemy import select, text, func
+from sqlalchemy.orm import Session
+from ..utils.query_plans import explain_plan, plan_nodes
+
+logger = logging.getLogger(__name__)
+
+# Partitioned mode: signals has one partition per UTC month, named after it, and a
+# default partition for readings outside them (clock errors, history older than
+# the first month created)
+DEFAULT_PARTITION = 'signals_default'
+PARTITION_NAME = re.compile(r'^signals_y(\d{4})m(\d{2})$')
+# Transaction-level advisory lock serializing partition creation across workers
+PARTITION_LOCK_KEY = 7_350_004
+
+
+def month_floor(moment: datetime) -> datetime:
+    """Start of the UTC month containing moment"""
+    return moment.astimezone(timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def partition_name(month: datetime) -> str:
+    return f'signals_y{month.year:04d}m{month.month:02d}'
+
+
+def signal_partitions(session: Session) -> List[Tuple[str, datetime, datetime]]:
+    """(name, start, end) of the monthly partitions of signals, oldest first (the default partition excluded)"""
+    names = session.execute(text("""
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = 'signals'::regclass
+    """)).scalars()
+    partitions = []
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            start = datetime(int(match.group(1)), int(match.group(2)), 1, tzinfo=timezone.utc)
+            partitions.append((name, start, start + relativedelta(months=1)))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def create_partitions(session: Session, first: datetime, last: datetime) -> List[str]:
+    """
+    Create the missing monthly partitions for the months from first to last
+    (inclusive), and the default partition. Readings of a new partition's month
+    already in the default partition are moved into it. Returns the partitions
+    created; the caller commits.
+    """
+    session.execute(select(func.pg_advisory_xact_lock(PARTITION_LOCK_KEY)))
+    session.execute(text(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF signals DEFAULT"))
+    existing = {name for name, _, _ in signal_partitions(session)}
+
+    created = []
+    month = month_floor(first)
+    while month <= last:
+        following = month + relativedelta(months=1)
+        name = partition_name(month)
+        if name not in existing:
+            # Attaching a range the default partition has rows in fails, so they are set aside meanwhile
+            in_range = f"FROM {DEFAULT_PARTITION} WHERE tstamp >= :start AND tstamp < :end"
+            bounds = {'start': month, 'end': following}
+            strays = session.execute(text(f"SELECT count(*) {in_range}"), bounds).scalar()
+            if strays:
+                session.execute(text(f"CREATE TEMPORARY TABLE signals_strays AS SELECT * {in_range}"), bounds)
+                session.execute(text(f"DELETE {in_range}"), bounds)
+            session.execute(text(
+                f"CREATE TABLE {name} PARTITION OF signals "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{following.isoformat()}')"
+            ))
+            if strays:
+                session.execute(text("INSERT INTO signals SELECT * FROM signals_strays"))
+                session.execute(text("DROP TABLE signals_strays"))
+                logger.info(f"Moved {strays} signals from {DEFAULT_PARTITION} into {name}")
+            created.append(name)
+        month = following
+    return created
+
+
+def ensure_partitions(session: Session, months_ahead: int, now: Optional[datetime] = None) -> List[str]:
+    """Create the partitions of the current month and the next months_ahead months if missing, and commit"""
+    now = now or datetime.now(timezone.utc)
+    created = create_partitions(session, now, now + relativedelta(months=months_ahead))
+    session.commit()
+    if created:
+        logger.info(f"Created signal partitions {', '.join(created)}")
+    return created
+
+
+def drop_partitions_before(session: Session, cutoff: datetime, rolled_up_from: Optional[datetime] = None,
+                           detach_only: bool = False) -> List[str]:
+    """
+    Detach and drop (or only detach, with detach_only) the monthly partitions
+    that end at or before cutoff, oldest first, one committed transaction each.
+    Returns the partitions removed.
+
+    Signals an alert log points to are copied into the default partition first,
+    as row-level retention keeps them too. A partition holding readings before
+    rolled_up_from (not summarised in hourly rollups yet) stops the run.
+    """
+    removed = []
+    for name, start, end in signal_partitions(session):
+        if end > cutoff:
+            break
+        if rolled_up_from is not None and start < rolled_up_from and session.execute(
+            text(f"SELECT EXISTS (SELECT 1 FROM {name} WHERE tstamp < :rolled_up_from)"),
+            {'rolled_up_from': rolled_up_from}
+        ).scalar():
+            logger.warning(f"Partition {name} kept: it has signals not covered by hourly rollups")
+            break
+
+        session.execute(text(f"ALTER TABLE signals DETACH PARTITION {name}"))
+        # The detached month is covered by no partition now, so these land in the default one
+        session.execute(text(f"""
+            INSERT INTO signals
+            SELECT * FROM {name} detached
+            WHERE EXISTS (SELECT 1 FROM aviso_logs WHERE aviso_logs.signal_id = detached.id)
+        """))
+        if not detach_only:
+            session.execute(text(f"DROP TABLE {name}"))
+        session.commit()
+        removed.append(name)
+        logger.info(f"Signal partition {name} {'detached' if detach_only else 'dropped'}")
+    return removed
+
+
+def scanned_partitions(session: Session, statement) -> List[str]:
+    """
+    Partitions of signals (default included) the plan of statement reads, from
+    EXPLAIN without running it. With pruning, only those of the months in the
+    statement's time range.
+    """
+    relations = {node['Relation Name'] for node in plan_nodes(explain_plan(session, statement)) if 'Relation Name' in node}
+    partitions = {name for name, _, _ in signal_partitions(session)} | {DEFAULT_PARTITION}
+    return sorted(relations & partitions)
+
+
+def schedule_partition_maintenance(app, scheduler) -> None:
+    """
+    Run ensure_partitions every PARTITION_MAINTENANCE_SECONDS on the app's
+    scheduler, and once right away so a fresh deployment has its partitions.
+    """
+    def job():
+        with app.app_context():
+            session = app.db_factory()
+            try:
+                ensure_partitions(session, app.config['PARTITION_MONTHS_AHEAD'])
+            except Exception as e:
+                logger.error(f"Error creating signal partitions: {str(e)}")
+                session.rollback()
+            finally:
+                app.db_factory.remove()
+
+    scheduler.add_job(
+        job, 'interval',
+        seconds=app.config['PARTITION_MAINTENANCE_SECONDS'],
+        next_run_time=datetime.now(timezone.utc),
+        id='ensure_signal_partitions',
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True
+    )
@@ -0,0 +1,178 @@
+from typing import Dict, Optional
+from threading import Lock
+import logging
+import time
+from flask import g, has_request_context, request
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from ..extensions import cache
+from ..utils.database import engine_options, pool_monitor
+
+logger = logging.getLogger(__name__)
+
+# WAL position (bytes) the replica has replayed, and its replay lag in seconds. On a
+# server that is not a standby (DATABASE_READ_URL pointing at the primary) both
+# describe the server itself, with no lag.
+REPLICA_STATUS_SQL = text("""
+    SELECT pg_wal_lsn_diff(CASE WHEN pg_is_in_recovery() THEN pg_last_wal_replay_lsn()
+                                ELSE pg_current_wal_lsn() END, '0/0') AS replayed,
+           CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END AS lag_seconds
+""")
+PRIMARY_POSITION_SQL = text("SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), '0/0')")
+# A write mark only matters until the replica replays it, or lags past the threshold
+WRITTEN_MARK_SECONDS = 3600
+
+
+def _written_key(scope: str, scope_id: str) -> str:
+    return f"replica:written:{scope}:{scope_id}"
+
+
+class ReplicaRouter:
+    """
+    Optional read-only engine on a streaming replica (DATABASE_READ_URL) for
+    the dashboard's GET requests.
+
+    The replica's lag is sampled at most every READ_REPLICA_LAG_CHECK_SECONDS;
+    while it is unknown or above READ_REPLICA_MAX_LAG_SECONDS every read goes
+    to the primary. Writes that a client reads back right away (config,
+    alerts, controllers added or removed) are marked with the primary's WAL
+    position in the shared cache, and reads of that controller or company stay
+    on the primary until the replica has replayed it.
+    """
+
+    def __init__(self, app=None, primary: Optional[Engine] = None):
+        self.engine: Optional[Engine] = None
+        self.primary: Optional[Engine] = None
+        self.max_lag = 0.0
+        self.check_interval = 0.0
+        self._lock = Lock()
+        self._checked_at: Optional[float] = None
+        self._replayed: Optional[int] = None
+        self._lag: Optional[float] = None
+        if app is not None:
+            self.init_app(app, primary)
+
+    def init_app(self, app, primary: Engine):
+        self.primary = primary
+        self.engine = None
+        read_url = app.config.get('DATABASE_READ_URL')
+        if read_url and app.config.get('WEB_CONCURRENCY', 1) > 1 and not app.config.get('REDIS_URL'):
+            # Write marks live in the response cache: per process without Redis, so a
+            # read served by another worker would not see them and could go to the replica
+            raise RuntimeError("DATABASE_READ_URL with WEB_CONCURRENCY > 1 needs REDIS_URL "
+                               "to share read-your-writes marks between workers")
+        if read_url:
+            self.engine = create_engine(read_url, **engine_options(app.config, read_url, 'replica'))
+            pool_monitor.register('replica', self.engine)
+            logger.info("Dashboard reads routed to the read replica")
+        self.max_lag = app.config.get('READ_REPLICA_MAX_LAG_SECONDS', 10)
+        self.check_interval = app.config.get('READ_REPLICA_LAG_CHECK_SECONDS', 5)
+        self._checked_at = None
+        app.extensions['replica'] = self
+
+    def _refresh(self) -> None:
+        """Sample the replica's replayed position and lag if the last sample is too old"""
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.check_interval:
+            return
+        with self._lock:
+            if self._checked_at is not None and now - self._checked_at < self.check_interval:
+                return
+            was_usable = self._usable()
+            try:
+                with self.engine.connect() as connection:
+                    row = connection.execute(REPLICA_STATUS_SQL).one()
+                self._replayed = int(row.replayed) if row.replayed is not None else None
+                self._lag = float(row.lag_seconds) if row.lag_seconds is not None else None
+            except Exception as e:
+                logger.warning(f"Could not check the read replica: {str(e)}")
+                self._replayed, self._lag = None, None
+            self._checked_at = time.monotonic()
+            if was_usable != self._usable():
+                if self._usable():
+                    logger.info(f"Read replica back in use (lag {self._lag:.1f}s)")
+                elif self._lag is None:
+                    logger.warning("Read replica state unknown, reading from the primary")
+                else:
+                    logger.warning(f"Read replica lag {self._lag:.1f}s over {self.max_lag}s, reading from the primary")
+
+    def _usable(self) -> bool:
+        return self._lag is not None and self._replayed is not None and self._lag <= self.max_lag
+
+    def read_engine(self, controlador_id: Optional[str] = None, empresa_id: Optional[str] = None) -> Optional[Engine]:
+        """
+        The replica, if reads of this controller / company can go to it now;
+        None when they must go to the primary.
+        """
+        if self.engine is None:
+            return None
+        self._refresh()
+        if not self._usable():
+            return None
+        keys = [_written_key(scope, scope_id) for scope, scope_id in
+                (('controlador', controlador_id), ('empresa', empresa_id)) if scope_id]
+        if keys:
+            try:
+                written = [position for position in cache.get_many(*keys) if position is not None]
+            except Exception as e:
+                logger.warning(f"Could not read replica write marks: {str(e)}")
+                return None
+            if any(position > self._replayed for position in written):
+                return None
+        return self.engine
+
+    def mark_written(self, controlador_id: Optional[str] = None, empresa_id: Optional[str] = None) -> None:
+        """
+        Keep reads of a controller / company on the primary until the replica
+        has replayed everything committed so far. Call after the commit.
+        Failures are logged: the write itself has succeeded.
+        """
+        if self.engine is None:
+            return
+        try:
+            with self.primary.connect() as connection:
+                position = int(connection.execute(PRIMARY_POSITION_SQL).scalar())
+            updates = {_written_key(scope, scope_id): position for scope, scope_id in
+                       (('controlador', controlador_id), ('empresa', empresa_id)) if scope_id}
+            if updates:
+                cache.set_many(updates, timeout=WRITTEN_MARK_SECONDS)
+        except Exception as e:
+            logger.warning(f"Could not mark a write for read-your-writes: {str(e)}")
+
+    def status(self) -> Dict:
+        """Replica state for /db_stats"""
+        if self.engine is None:
+            return {'configured': False}
+        self._refresh()
+        return {'configured': True, 'in_use': self._usable(), 'lag_seconds': self._lag,
+                'max_lag_seconds': self.max_lag}
+
+
+replica_router = ReplicaRouter()
+
+
+def route_reads_to_replica():
+    """
+    before_request hook: the ORM sessions of a GET request read from the replica
+    when replica_router allows it for the request's controller / company.
+    """
+    if request.method == 'GET' and replica_router.engine is not None:
+        view_args = request.view_args or {}
+        g.read_engine = replica_router.read_engine(view_args.get('controlador_id'), view_args.get('empresa_id'))
+
+
+class RoutingSession(Session):
+    """
+    Session that sends the statements of a request routed to the replica
+    (route_reads_to_replica) there; flushes, requests not routed and work
+    outside requests (scheduler jobs, background tasks) use the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if not self._flushing and has_request_context():
+            read_engine = g.get('read_engine')
+            if read_engine is not None:
+                return read_engine
+        return super().get_bind(mapper=mapper, clause=clause, **kw)
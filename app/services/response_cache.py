@@ -0,0 +1,215 @@
+from typing import Dict, Optional
+from functools import wraps
+import hashlib
+import logging
+import time
+import uuid
+from flask import current_app, request, Response
+from ..extensions import cache
+
+logger = logging.getLogger(__name__)
+
+# Version keys per controller: 'signal' is the latest signal id, the others are
+# opaque tokens replaced whenever the config or the alerts change
+CONTROLLER_VERSION_PARTS = ('signal', 'config', 'alerts')
+# Single-flight: how long a computing request holds the lock, and how often waiters poll
+LOCK_TIMEOUT_SECONDS = 30
+LOCK_POLL_SECONDS = 0.05
+
+
+def init_response_cache(app) -> None:
+    """
+    Disable response caching and ETags when the version tokens cannot be shared:
+    with several workers and no REDIS_URL the cache is a SimpleCache per process,
+    and an invalidation reaches only the worker that handled the write. Another
+    worker would keep serving its cached body, and answering 304 to the ETag.
+    """
+    if app.config.get('WEB_CONCURRENCY', 1) > 1 and not app.config.get('REDIS_URL') \
+            and (app.config.get('DASHBOARD_CACHE_TIMEOUT') or app.config.get('DASHBOARD_ETAGS', True)):
+        logger.warning("Dashboard response cache and ETags disabled: WEB_CONCURRENCY > 1 needs REDIS_URL "
+                       "to share invalidations between workers")
+        app.config['DASHBOARD_CACHE_TIMEOUT'] = 0
+        app.config['DASHBOARD_ETAGS'] = False
+
+
+def _version_key(scope: str, scope_id: str, part: str) -> str:
+    return f"resp-cache:v:{scope}:{scope_id}:{part}"
+
+
+def _new_token() -> str:
+    return uuid.uuid4().hex
+
+
+def _versions(keys) -> Dict[str, str]:
+    """
+    Current value of each version key. Missing keys (first use, restart of an
+    in-process cache, eviction) get a fresh random token, so an entry cached under
+    a version that has since been lost can never be served again.
+    """
+    values = dict(zip(keys, cache.get_many(*keys)))
+    for key, value in values.items():
+        if value is None:
+            cache.add(key, _new_token(), timeout=0)
+            values[key] = cache.get(key)
+    return values
+
+
+def controller_versions(controlador_id: str) -> Dict[str, str]:
+    """{'signal': ..., 'config': ..., 'alerts': ...} for a controller"""
+    keys = [_version_key('controlador', controlador_id, part) for part in CONTROLLER_VERSION_PARTS]
+    values = _versions(keys)
+    return {part: str(values[key]) for part, key in zip(CONTROLLER_VERSION_PARTS, keys)}
+
+
+def empresa_version(empresa_id: str) -> str:
+    key = _version_key('empresa', empresa_id, 'any')
+    return str(_versions([key])[key])
+
+
+def invalidate_controller(controlador_id: str, empresa_id: Optional[str] = None, signal_id: Optional[int] = None,
+                          config: bool = False, alerts: bool = False) -> None:
+    """
+    Invalidate the cached responses of a controller (and of its company, when
+    empresa_id is given) after a new reading (signal_id), a config change or an
+    alert change. Failures are logged: a stale cache must not fail a write.
+    """
+    try:
+        updates = {}
+        if signal_id is not None:
+            updates[_version_key('controlador', controlador_id, 'signal')] = signal_id
+        if config:
+            updates[_version_key('controlador', controlador_id, 'config')] = _new_token()
+        if alerts:
+            updates[_version_key('controlador', controlador_id, 'alerts')] = _new_token()
+        if empresa_id is not None:
+            updates[_version_key('empresa', empresa_id, 'any')] = _new_token()
+        if updates:
+            cache.set_many(updates, timeout=0)
+    except Exception as e:
+        logger.warning(f"Could not invalidate cached responses for {controlador_id}: {str(e)}")
+
+
+def invalidate_empresa(empresa_id: str) -> None:
+    """Invalidate company-wide responses (controllers added or removed)"""
+    try:
+        cache.set(_version_key('empresa', empresa_id, 'any'), _new_token(), timeout=0)
+    except Exception as e:
+        logger.warning(f"Could not invalidate cached responses for empresa {empresa_id}: {str(e)}")
+
+
+def _response_key(scope: str, scope_id: str) -> str:
+    if scope == 'controlador':
+        versions = controller_versions(scope_id)
+        version = ':'.join(versions[part] for part in CONTROLLER_VERSION_PARTS)
+    else:
+        version = empresa_version(scope_id)
+    args = '&'.join(f"{name}={value}" for name, value in sorted(request.args.items(multi=True)))
+    digest = hashlib.sha1(f"{request.endpoint}?{args}".encode()).hexdigest()
+    return f"resp-cache:{scope}:{scope_id}:{version}:{digest}"
+
+
+def _etag(key: str, sliding_window: Optional[int]) -> Optional[str]:
+    """
+    Entity tag for a response key. Responses over a default window ending now
+    change as time passes even without new data, so unless end_date is given
+    their tag also rolls over every `sliding_window` seconds (None when 0).
+    """
+    if sliding_window is not None and 'end_date' not in request.args:
+        if not sliding_window:
+            return None
+        key = f"{key}:{int(time.time() // sliding_window)}"
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def _with_etag(result, etag: Optional[str]):
+    """Attach ETag (and Cache-Control: no-cache, so clients revalidate) to a 200 result"""
+    if etag is None:
+        return result
+    headers = {'ETag': f'"{etag}"', 'Cache-Control': 'no-cache'}
+    if isinstance(result, Response):
+        if result.status_code == 200 and not result.is_streamed:
+            result.headers.update(headers)
+        return result
+    if isinstance(result, tuple):
+        if result[1] != 200:
+            return result
+        return (result[0], 200, {**(result[2] if len(result) > 2 else {}), **headers})
+    return result, 200, headers
+
+
+def _compute_once(key: str, timeout: int, compute):
+    """
+    Cached result for key, or compute() and cache it. Concurrent misses compute
+    once: the first request takes a lock in the cache, the others wait for its result.
+    """
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    lock_key = f"{key}:lock"
+    locked = cache.add(lock_key, 1, timeout=LOCK_TIMEOUT_SECONDS)
+    if not locked:
+        deadline = time.monotonic() + LOCK_TIMEOUT_SECONDS
+        while time.monotonic() < deadline and cache.get(lock_key) is not None:
+            time.sleep(LOCK_POLL_SECONDS)
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+        # The other request failed or returned something uncacheable; compute here
+    try:
+        result = compute()
+        body, status = (result[0], result[1]) if isinstance(result, tuple) else (result, 200)
+        if status == 200 and isinstance(body, (dict, list)):
+            cache.set(key, body, timeout=timeout)
+        return result
+    finally:
+        if locked:
+            cache.delete(lock_key)
+
+
+def cached_response(scope: str, id_arg: Optional[str] = None, sliding_window: bool = False):
+    """
+    Cache a Resource GET result under the endpoint, query args and the current
+    version of the controller ('controlador') or company ('empresa') named by the
+    view argument `id_arg` (controlador_id / empresa_id by default).
+
+    Only successful dict/list results are stored; streamed Responses and errors
+    pass through. Concurrent misses for the same key compute once.
+
+    Successful responses carry an ETag derived from the same versions, so a poll
+    with a matching If-None-Match gets a 304 after one version lookup, without
+    running the view. Set sliding_window for views whose default window ends now.
+    """
+    id_arg = id_arg or f"{scope}_id"
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            timeout = current_app.config.get('DASHBOARD_CACHE_TIMEOUT') or 0
+            etags = current_app.config.get('DASHBOARD_ETAGS', True)
+            if not timeout and not etags:
+                return f(*args, **kwargs)
+            try:
+                key = _response_key(scope, kwargs[id_arg])
+            except Exception as e:
+                logger.warning(f"Response cache unavailable: {str(e)}")
+                return f(*args, **kwargs)
+
+            etag = _etag(key, timeout if sliding_window else None) if etags else None
+            if etag is not None:
+                # The gzip-encoded representation is tagged "<etag>-gzip" (utils.serialization)
+                for tag in (etag, f"{etag}-gzip"):
+                    if request.if_none_match.contains(tag):
+                        return Response(status=304, headers={'ETag': f'"{tag}"', 'Cache-Control': 'no-cache'})
+
+            if timeout:
+                result = _compute_once(key, timeout, lambda: f(*args, **kwargs))
+            else:
+                result = f(*args, **kwargs)
+            return _with_etag(result, etag)
+
+        return decorated_function
+    return decorator
@@ -0,0 +1,294 @@
+from typing import Dict, List, Optional, Tuple
+from datetime import datetime, timedelta, timezone
+import logging
+import time
+from dateutil.relativedelta import relativedelta
+from sqlalchemy import select, delete, exists, func, literal
+from sqlalchemy.orm import Session
+from ..models import Signal, Controlador, Empresa, AvisoLog, RetentionPolicy
+from ..config import SIGNALS_PARTITIONED
+from .rollup_service import rollup_coverage, floor_hour
+from .partition_service import drop_partitions_before
+from .signal_queries import sensor_mask, time_bucket, CONNECTION_TIMEOUT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Compaction works through old signals one hour (the rollup grain) at a time
+COMPACTION_SLICE = timedelta(hours=1)
+# Advisory lock so only one worker applies retention at a time
+RETENTION_LOCK_KEY = 7_350_003
+
+
+def effective_policy(policy: Optional[RetentionPolicy], defaults: Dict) -> Tuple[int, int]:
+    """(raw_days, event_months) of a company, falling back to the RETENTION_* defaults"""
+    raw_days = policy.raw_days if policy is not None and policy.raw_days is not None else defaults['RETENTION_RAW_DAYS']
+    event_months = policy.event_months if policy is not None and policy.event_months is not None \
+        else defaults['RETENTION_EVENT_MONTHS']
+    return raw_days, event_months
+
+
+def retention_cutoffs(raw_days: int, event_months: int, now: datetime) -> Tuple[Optional[datetime], Optional[datetime]]:
+    """
+    (compact before, delete before) for a policy, both on hour boundaries so
+    they line up with rollups. None where the policy keeps data forever.
+    """
+    if not raw_days:
+        return None, None
+    compact_before = floor_hour(now - timedelta(days=raw_days))
+    delete_before = floor_hour(compact_before - relativedelta(months=event_months)) if event_months else None
+    return compact_before, delete_before
+
+
+def compacted_until(session: Session, controlador_id: str) -> Optional[datetime]:
+    """Time before which the controller's signals have been compacted (None if never)"""
+    return session.execute(
+        select(RetentionPolicy.compacted_until).
+        join(Controlador, Controlador.empresa_id == RetentionPolicy.empresa_id).
+        where(Controlador.id == controlador_id)
+    ).scalar()
+
+
+def _not_referenced():
+    """Signals an alert log points to are kept, whatever their age"""
+    return ~exists().where(AvisoLog.signal_id == Signal.id)
+
+
+def redundant_signal_ids(session: Session, empresa_id: str, start: datetime, end: datetime) -> List[int]:
+    """
+    Ids of the company's signals in [start, end) that compaction removes: those
+    with the same sensor states as the previous reading, within
+    CONNECTION_TIMEOUT_SECONDS of both neighbours, and neither the first nor the
+    last reading of their CONNECTION_TIMEOUT_SECONDS time bucket. What remains
+    are the state changes, the first and last reading of every connected
+    stretch, and at most two readings per bucket in between.
+
+    The per-bucket readings keep every gap inside a connected stretch within
+    CONNECTION_TIMEOUT_SECONDS, so time-weighted durations (reading_durations)
+    and connection islands (connection_intervals) computed from what remains
+    match the original readings; only gaps between stretches exceed it.
+
+    Neighbours are looked up to CONNECTION_TIMEOUT_SECONDS outside the range (one
+    further away is a disconnection either way), so the readings just outside it
+    must not have been compacted yet for the result to match the original data.
+    """
+    max_gap = timedelta(seconds=CONNECTION_TIMEOUT_SECONDS)
+    window = {'partition_by': Signal.controlador_id, 'order_by': (Signal.tstamp, Signal.id)}
+    mask = sensor_mask(Signal.__table__.c)
+    bucket = time_bucket(max_gap, Signal.tstamp)
+    readings = select(
+        Signal.id,
+        Signal.tstamp,
+        mask.label('mask'),
+        bucket.label('bucket'),
+        func.lag(mask).over(**window).label('previous_mask'),
+        func.lag(bucket).over(**window).label('previous_bucket'),
+        func.lead(bucket).over(**window).label('next_bucket'),
+        func.lag(Signal.tstamp).over(**window).label('previous_tstamp'),
+        func.lead(Signal.tstamp).over(**window).label('next_tstamp')
+    ).where(
+        Signal.controlador_id.in_(select(Controlador.id).where(Controlador.empresa_id == empresa_id)),
+        Signal.tstamp >= start - max_gap,
+        Signal.tstamp < end + max_gap
+    ).subquery('readings')
+
+    return session.execute(
+        select(readings.c.id).where(
+            readings.c.tstamp >= start,
+            readings.c.tstamp < end,
+            readings.c.mask == readings.c.previous_mask,
+            readings.c.previous_tstamp >= readings.c.tstamp - literal(max_gap),
+            readings.c.next_tstamp <= readings.c.tstamp + literal(max_gap),
+            readings.c.previous_bucket == readings.c.bucket,
+            readings.c.next_bucket == readings.c.bucket,
+            ~exists().where(AvisoLog.signal_id == readings.c.id)
+        )
+    ).scalars().all()
+
+
+def _company_range(empresa_id: str, start: datetime, end: datetime) -> List:
+    """
+    Filters for the company's signals in [start, end). Deletes repeat them next
+    to their id list: in Timescale mode they limit the compressed batches
+    (segmented by controller, ordered by tstamp) that must be decompressed.
+    """
+    return [
+        Signal.controlador_id.in_(select(Controlador.id).where(Controlador.empresa_id == empresa_id)),
+        Signal.tstamp >= start,
+        Signal.tstamp < end
+    ]
+
+
+def delete_ids(session: Session, ids: List[int], batch_rows: int, *filters) -> int:
+    """Delete signals by id (and filters), one committed transaction per batch_rows"""
+    deleted = 0
+    for offset in range(0, len(ids), batch_rows):
+        deleted += session.execute(
+            delete(Signal).where(Signal.id.in_(ids[offset:offset + batch_rows]), *filters)
+        ).rowcount
+        session.commit()
+    return deleted
+
+
+def delete_before(session: Session, empresa_id: str, start: datetime, end: datetime, batch_rows: int) -> int:
+    """Delete the company's signals in [start, end), batch_rows per committed transaction"""
+    deleted = 0
+    in_range = _company_range(empresa_id, start, end)
+    while True:
+        batch = select(Signal.id).where(*in_range, _not_referenced()).limit(batch_rows)
+        count = session.execute(delete(Signal).where(Signal.id.in_(batch), *in_range)).rowcount
+        session.commit()
+        deleted += count
+        if count < batch_rows:
+            return deleted
+
+
+def apply_retention(session: Session, empresa_id: str, defaults: Dict, now: Optional[datetime] = None) -> Optional[Dict]:
+    """
+    Compact and delete one company's old signals according to its policy, in
+    short transactions of at most RETENTION_BATCH_ROWS deleted rows, and record
+    the run on its policy row. Returns the run report, or None when the policy
+    keeps everything.
+
+    Only hours already covered by hourly rollups are touched (see
+    rollup_service.rollup_coverage), so every reading is summarised before it
+    is compacted or deleted; older signals wait for rebuild_rollups.
+    """
+    now = now or datetime.now(timezone.utc)
+    policy = session.get(RetentionPolicy, empresa_id)
+    compact_before, delete_cutoff = retention_cutoffs(*effective_policy(policy, defaults), now)
+    if compact_before is None:
+        return None
+
+    coverage = rollup_coverage(session)
+    if coverage is None:
+        logger.warning(f"Retention for {empresa_id} skipped: no hourly rollups yet")
+        return None
+    covered_from, covered_until = coverage
+
+    if policy is None:
+        policy = RetentionPolicy(empresa_id=empresa_id)
+        session.add(policy)
+        session.commit()
+
+    batch_rows = defaults['RETENTION_BATCH_ROWS']
+    started = time.perf_counter()
+    compacted = deleted = 0
+
+    if delete_cutoff is not None and covered_from < min(delete_cutoff, covered_until):
+        deleted = delete_before(session, empresa_id, covered_from, min(delete_cutoff, covered_until), batch_rows)
+
+    # Runs compact whole UTC days, resuming where the last one stopped. Each slice
+    # is deleted only after the next one has been read, since that one's first
+    # readings are judged against their original neighbours at the end of it.
+    slice_start = max(covered_from, policy.compacted_until or covered_from, delete_cutoff or covered_from)
+    compact_until = min(compact_before, covered_until).replace(hour=0)
+    pending, pending_range, resumed_from = [], [], slice_start
+    while slice_start < compact_until:
+        slice_end = min(slice_start + COMPACTION_SLICE, compact_until)
+        redundant = redundant_signal_ids(session, empresa_id, slice_start, slice_end)
+        compacted += delete_ids(session, pending, batch_rows, *pending_range)
+        policy.compacted_until = slice_start
+        session.commit()
+        pending, pending_range = redundant, _company_range(empresa_id, slice_start, slice_end)
+        slice_start = slice_end
+    if compact_until > resumed_from:
+        compacted += delete_ids(session, pending, batch_rows, *pending_range)
+        policy.compacted_until = compact_until
+        session.commit()
+
+    elapsed = time.perf_counter() - started
+    policy.last_run_at = now
+    policy.last_run_seconds = elapsed
+    policy.last_rows_reclaimed = compacted + deleted
+    session.commit()
+
+    report = {
+        'empresa_id': empresa_id,
+        'compacted_rows': compacted,
+        'deleted_rows': deleted,
+        'compacted_until': policy.compacted_until,
+        'seconds': round(elapsed, 3)
+    }
+    logger.info(f"Retention for {empresa_id}: {compacted} rows compacted, {deleted} deleted in {elapsed:.1f}s")
+    return report
+
+
+def common_delete_cutoff(session: Session, defaults: Dict, now: datetime) -> Optional[datetime]:
+    """
+    Earliest delete cutoff over every company: signals before it are past all
+    policies. None when some company keeps its change events forever.
+    """
+    policies = {policy.empresa_id: policy for policy in session.query(RetentionPolicy)}
+    cutoffs = []
+    for empresa_id in session.execute(select(Empresa.id)).scalars():
+        _, delete_cutoff = retention_cutoffs(*effective_policy(policies.get(empresa_id), defaults), now)
+        if delete_cutoff is None:
+            return None
+        cutoffs.append(delete_cutoff)
+    return min(cutoffs, default=None)
+
+
+def drop_expired_partitions(session: Session, defaults: Dict, now: Optional[datetime] = None) -> List[str]:
+    """
+    Partitioned mode: drop (or detach, with RETENTION_DETACH_PARTITIONS) the
+    monthly signal partitions every company's policy has expired, within the
+    hours covered by rollups. Returns the partitions removed.
+    """
+    now = now or datetime.now(timezone.utc)
+    cutoff = common_delete_cutoff(session, defaults, now)
+    coverage = rollup_coverage(session)
+    if cutoff is None or coverage is None:
+        return []
+    covered_from, covered_until = coverage
+    return drop_partitions_before(session, min(cutoff, covered_until), rolled_up_from=covered_from,
+                                  detach_only=defaults['RETENTION_DETACH_PARTITIONS'])
+
+
+def apply_all_retention(session: Session, defaults: Dict, now: Optional[datetime] = None,
+                        empresa_ids: Optional[List[str]] = None) -> List[Dict]:
+    """
+    apply_retention for every company (or the given ones), holding an advisory
+    lock in a transaction left open on a dedicated connection; returns [] if
+    another worker holds it. In partitioned mode, whole expired months are
+    dropped first (all companies runs only).
+    """
+    with session.get_bind().connect() as lock_connection:
+        if not lock_connection.execute(select(func.pg_try_advisory_xact_lock(RETENTION_LOCK_KEY))).scalar():
+            logger.info("Retention already running elsewhere, skipping")
+            return []
+        try:
+            reports = []
+            if SIGNALS_PARTITIONED and empresa_ids is None:
+                drop_expired_partitions(session, defaults, now)
+            if empresa_ids is None:
+                empresa_ids = session.execute(select(Empresa.id).order_by(Empresa.id)).scalars().all()
+            for empresa_id in empresa_ids:
+                report = apply_retention(session, empresa_id, defaults, now)
+                if report is not None:
+                    reports.append(report)
+            return reports
+        finally:
+            lock_connection.rollback()
+
+
+def schedule_retention(app, scheduler) -> None:
+    """Run apply_all_retention every RETENTION_INTERVAL_SECONDS on the app's scheduler"""
+    def job():
+        with app.app_context():
+            session = app.db_factory()
+            try:
+                apply_all_retention(session, app.config)
+            except Exception as e:
+                logger.error(f"Error applying signal retention: {str(e)}")
+                session.rollback()
+            finally:
+                app.db_factory.remove()
+
+    scheduler.add_job(
+        job, 'interval',
+        seconds=app.config['RETENTION_INTERVAL_SECONDS'],
+        id='apply_signal_retention',
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True
+    )
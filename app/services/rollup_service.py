@@ -0,0 +1,264 @@
+from typing import Dict, Optional, Tuple
+from datetime import datetime, timedelta, timezone
+import logging
+from sqlalchemy import select, delete, and_, case, func, cast, String, literal
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from ..models import Signal, SignalRollupHourly
+from .signal_queries import (
+    reading_durations, hourly_pieces, sensor_mask, time_bucket, sensor_on_seconds, active_seconds_by_hour,
+    SENSOR_COLUMNS, CONNECTION_TIMEOUT_SECONDS
+)
+
+logger = logging.getLogger(__name__)
+
+ON_SECONDS_COLUMNS = [f'on_seconds_sensor{i}' for i in range(1, len(SENSOR_COLUMNS) + 1)]
+TRANSITION_COLUMNS = [f'transitions_sensor{i}' for i in range(1, len(SENSOR_COLUMNS) + 1)]
+# Transaction-level advisory lock so only one worker refreshes rollups at a time
+REFRESH_LOCK_KEY = 7_350_001
+
+
+def floor_hour(moment: datetime) -> datetime:
+    return moment.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def ceil_hour(moment: datetime) -> datetime:
+    hour = floor_hour(moment)
+    return hour if hour == moment else hour + timedelta(hours=1)
+
+
+def closed_until(now: Optional[datetime] = None) -> datetime:
+    """
+    End (exclusive) of the hours whose rollups can no longer change: every
+    reading that can reach into them is at least CONNECTION_TIMEOUT_SECONDS old.
+    """
+    now = now or datetime.now(timezone.utc)
+    return floor_hour(now - timedelta(seconds=CONNECTION_TIMEOUT_SECONDS))
+
+
+def rollup_coverage(session: Session) -> Optional[Tuple[datetime, datetime]]:
+    """
+    [first hour, last hour + 1h) covered by rollups, or None before the first
+    refresh. Refreshes always extend the covered range contiguously, so an hour
+    inside it without a row means the controller sent nothing that hour.
+    """
+    first, last = session.query(func.min(SignalRollupHourly.hour), func.max(SignalRollupHourly.hour)).one()
+    if first is None:
+        return None
+    return first, last + timedelta(hours=1)
+
+
+def refresh_hourly_rollups(session: Session, start_hour: datetime, end_hour: datetime) -> Optional[int]:
+    """
+    Recompute the rollups of every controller for the hours in [start_hour, end_hour)
+    from raw signals, replacing existing rows. Returns the number of rows written,
+    or None if another refresh holds the lock. The caller commits.
+    """
+    if not session.execute(select(func.pg_try_advisory_xact_lock(REFRESH_LOCK_KEY))).scalar():
+        return None
+
+    max_gap = timedelta(seconds=CONNECTION_TIMEOUT_SECONDS)
+    end_utc = end_hour.astimezone(timezone.utc).replace(tzinfo=None)
+
+    # Time-weighted seconds per (controller, hour, sensor state combination). Readings
+    # are taken up to max_gap past end_hour so the last ones in range get their real
+    # duration; pieces falling after end_hour are dropped.
+    durations = reading_durations(None, start_hour, end_hour + max_gap)
+    pieces = hourly_pieces(durations, durations.c.controlador_id, sensor_mask(durations.c).label('mask'))
+    by_state = select(
+        pieces.c.controlador_id,
+        pieces.c.hour,
+        pieces.c.mask,
+        func.sum(pieces.c.seconds).label('seconds')
+    ).where(pieces.c.hour < end_utc).group_by(pieces.c.controlador_id, pieces.c.hour, pieces.c.mask).subquery('by_state')
+    states = select(
+        by_state.c.controlador_id,
+        by_state.c.hour,
+        func.sum(by_state.c.seconds).label('connected_seconds'),
+        *[
+            func.coalesce(func.sum(by_state.c.seconds).filter(by_state.c.mask.op('&')(1 << bit) != 0), 0).label(column)
+            for bit, column in enumerate(ON_SECONDS_COLUMNS)
+        ],
+        func.jsonb_object_agg(cast(by_state.c.mask, String), by_state.c.seconds).label('state_seconds')
+    ).group_by(by_state.c.controlador_id, by_state.c.hour).subquery('states')
+
+    # Readings and state changes per (controller, hour); a change only counts when
+    # the previous reading is recent enough for the controller to have stayed connected
+    window = {'partition_by': Signal.controlador_id, 'order_by': Signal.tstamp}
+    readings = select(
+        Signal.controlador_id,
+        Signal.tstamp,
+        func.lag(Signal.tstamp).over(**window).label('previous_tstamp'),
+        *[getattr(Signal, sensor) for sensor in SENSOR_COLUMNS],
+        *[func.lag(getattr(Signal, sensor)).over(**window).label(f'previous_{sensor}') for sensor in SENSOR_COLUMNS]
+    ).where(Signal.tstamp >= start_hour - max_gap, Signal.tstamp < end_hour).subquery('readings')
+    connected = readings.c.previous_tstamp >= readings.c.tstamp - literal(max_gap)
+
+    def changed(sensor):
+        return case((and_(
+            connected,
+            func.coalesce(readings.c[sensor], False) != func.coalesce(readings.c[f'previous_{sensor}'], False)
+        ), 1), else_=0)
+
+    reading_hour = func.timezone('UTC', time_bucket(timedelta(hours=1), readings.c.tstamp))
+    counts = select(
+        readings.c.controlador_id,
+        reading_hour.label('hour'),
+        func.count().label('reading_count'),
+        *[func.sum(changed(sensor)).label(column) for sensor, column in zip(SENSOR_COLUMNS, TRANSITION_COLUMNS)]
+    ).where(readings.c.tstamp >= start_hour).group_by(readings.c.controlador_id, reading_hour).subquery('counts')
+
+    joined = states.join(
+        counts,
+        and_(states.c.controlador_id == counts.c.controlador_id, states.c.hour == counts.c.hour),
+        full=True
+    )
+    rows = select(
+        func.coalesce(states.c.controlador_id, counts.c.controlador_id),
+        func.timezone('UTC', func.coalesce(states.c.hour, counts.c.hour)),
+        func.coalesce(counts.c.reading_count, 0),
+        func.coalesce(states.c.connected_seconds, 0),
+        *[func.coalesce(states.c[column], 0) for column in ON_SECONDS_COLUMNS],
+        *[func.coalesce(counts.c[column], 0) for column in TRANSITION_COLUMNS],
+        func.coalesce(states.c.state_seconds, func.jsonb_build_object())
+    ).select_from(joined)
+
+    session.execute(delete(SignalRollupHourly).where(
+        SignalRollupHourly.hour >= start_hour,
+        SignalRollupHourly.hour < end_hour
+    ))
+    result = session.execute(insert(SignalRollupHourly).from_select(
+        ['controlador_id', 'hour', 'reading_count', 'connected_seconds',
+         *ON_SECONDS_COLUMNS, *TRANSITION_COLUMNS, 'state_seconds'],
+        rows
+    ))
+    return result.rowcount
+
+
+def refresh_closed_hours(session: Session, now: Optional[datetime] = None) -> int:
+    """
+    Micro-batch step: roll up every hour closed since the last refresh and commit.
+    The first run only rolls up the latest closed hour; older history is
+    backfilled with maintenance_scripts/rebuild_rollups.py.
+    """
+    end_hour = closed_until(now)
+    coverage = rollup_coverage(session)
+    start_hour = coverage[1] if coverage else end_hour - timedelta(hours=1)
+    if start_hour >= end_hour:
+        return 0
+
+    written = refresh_hourly_rollups(session, start_hour, end_hour)
+    session.commit()
+    if written is None:
+        logger.info("Rollup refresh already running elsewhere, skipping")
+        return 0
+    logger.info(f"Rolled up {written} controller-hours for {start_hour.isoformat()} - {end_hour.isoformat()}")
+    return written
+
+
+def schedule_rollup_refresh(app, scheduler) -> None:
+    """Run refresh_closed_hours every ROLLUP_REFRESH_SECONDS on the app's scheduler"""
+    def job():
+        with app.app_context():
+            session = app.db_factory()
+            try:
+                refresh_closed_hours(session)
+            except Exception as e:
+                logger.error(f"Error refreshing hourly rollups: {str(e)}")
+                session.rollback()
+            finally:
+                app.db_factory.remove()
+
+    scheduler.add_job(
+        job, 'interval',
+        seconds=app.config['ROLLUP_REFRESH_SECONDS'],
+        id='refresh_hourly_rollups',
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True
+    )
+
+
+def _rolled_up_hours(session: Session, start: datetime, end: datetime) -> Optional[Tuple[datetime, datetime]]:
+    """Whole hours of [start, end) that can be answered from rollups, or None"""
+    coverage = rollup_coverage(session)
+    if coverage is None:
+        return None
+    first = max(ceil_hour(start), coverage[0])
+    last = min(floor_hour(end), coverage[1])
+    return (first, last) if first < last else None
+
+
+def rollup_sensor_on_seconds(session: Session, controlador_id: str, start: datetime, end: datetime) -> Tuple[float, Dict[str, float]]:
+    """
+    Same result as signal_queries.sensor_on_seconds, reading closed hours from
+    rollups and only the partial hours at either end from raw signals.
+    """
+    hours = _rolled_up_hours(session, start, end)
+    if hours is None:
+        return sensor_on_seconds(session, controlador_id, start, end)
+
+    first, last = hours
+    row = session.query(
+        func.coalesce(func.sum(SignalRollupHourly.connected_seconds), 0),
+        *[func.coalesce(func.sum(getattr(SignalRollupHourly, column)), 0) for column in ON_SECONDS_COLUMNS]
+    ).filter(
+        SignalRollupHourly.controlador_id == controlador_id,
+        SignalRollupHourly.hour >= first,
+        SignalRollupHourly.hour < last
+    ).one()
+    connected_seconds = float(row[0])
+    on_seconds = {sensor: float(value) for sensor, value in zip(SENSOR_COLUMNS, row[1:])}
+
+    for raw_start, raw_end in ((start, first), (last, end)):
+        if raw_start < raw_end:
+            raw_connected, raw_on = sensor_on_seconds(session, controlador_id, raw_start, raw_end)
+            connected_seconds += raw_connected
+            for sensor in SENSOR_COLUMNS:
+                on_seconds[sensor] += raw_on[sensor]
+    return connected_seconds, on_seconds
+
+
+def active_masks(controlador_config: Dict) -> set:
+    """Sensor state masks (see signal_queries.sensor_mask) in which any sensor is active under a config"""
+    rules = [
+        (1 << SENSOR_COLUMNS.index(sensor_key), sensor_config.get('tipo'))
+        for sensor_key, sensor_config in (controlador_config or {}).items()
+        if sensor_key in SENSOR_COLUMNS
+    ]
+    return {
+        mask for mask in range(1 << len(SENSOR_COLUMNS))
+        if any((tipo == 'NA' and mask & bit) or (tipo == 'NC' and not mask & bit) for bit, tipo in rules)
+    }
+
+
+def rollup_active_seconds_by_hour(session: Session, controlador_id: str, controlador_config: Dict,
+                                  start: datetime, end: datetime) -> Dict[datetime, float]:
+    """
+    Same result as signal_queries.active_seconds_by_hour (naive UTC hour keys),
+    evaluating the config against the per-state seconds of closed-hour rollups
+    and reading only the partial hours at either end from raw signals.
+    """
+    hours = _rolled_up_hours(session, start, end)
+    if hours is None:
+        return active_seconds_by_hour(session, controlador_id, controlador_config, start, end)
+
+    first, last = hours
+    masks = active_masks(controlador_config)
+    rows = session.query(SignalRollupHourly.hour, SignalRollupHourly.state_seconds).filter(
+        SignalRollupHourly.controlador_id == controlador_id,
+        SignalRollupHourly.hour >= first,
+        SignalRollupHourly.hour < last
+    ).all()
+
+    active_seconds = {}
+    for hour, state_seconds in rows:
+        seconds = sum(value for mask, value in state_seconds.items() if int(mask) in masks)
+        if seconds > 0:
+            active_seconds[hour.astimezone(timezone.utc).replace(tzinfo=None)] = seconds
+
+    for raw_start, raw_end in ((start, first), (last, end)):
+        if raw_start < raw_end:
+            for hour, seconds in active_seconds_by_hour(session, controlador_id, controlador_config, raw_start, raw_end).items():
+                active_seconds[hour] = active_seconds.get(hour, 0.0) + seconds
+    return active_seconds
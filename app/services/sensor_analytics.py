@@ -0,0 +1,132 @@
+import numpy as np
+
+SECONDS_PER_DAY = 86400
+
+
+def sensor_agreement_matrix(states):
+    """Fraction of readings in which each pair of sensors has the same value"""
+    if len(states) == 0:
+        return np.zeros((states.shape[1], states.shape[1]))
+    on = states.astype(np.float64)
+    off = 1.0 - on
+    return (on.T @ on + off.T @ off) / len(states)
+
+
+def sensor_phi_matrix(states):
+    """Phi coefficient (Pearson on 0/1 values) for each pair of sensors; 0 where a sensor never changes"""
+    if len(states) == 0:
+        return np.zeros((states.shape[1], states.shape[1]))
+    centered = states.astype(np.float64) - states.mean(axis=0)
+    covariance = centered.T @ centered / len(states)
+    std = np.sqrt(np.diag(covariance))
+    denominator = np.outer(std, std)
+    return np.divide(covariance, denominator, out=np.zeros_like(covariance), where=denominator > 0)
+
+
+def change_point_indices(values):
+    """
+    Indices of the readings needed to redraw a boolean series as a step chart:
+    the first reading, every reading whose value differs from the previous one,
+    and the last reading.
+    """
+    if len(values) == 0:
+        return np.empty(0, dtype=np.intp)
+    indices = np.flatnonzero(values[1:] != values[:-1]) + 1
+    return np.unique(np.concatenate(([0], indices, [len(values) - 1])))
+
+
+def reading_durations(epochs, end, max_gap):
+    """Seconds each reading stays in effect: gap to the next one (or to `end`), capped at max_gap"""
+    if len(epochs) == 0:
+        return np.empty(0, dtype=np.float64)
+    next_epochs = np.append(epochs[1:], max(end, epochs[-1]))
+    return np.minimum(next_epochs - epochs, max_gap)
+
+
+def duty_cycle_buckets(epochs, states, start, end, bucket_seconds, max_gap):
+    """
+    Time-weighted share of connected time each sensor spent True, per fixed-size bucket.
+
+    Each reading's duration (see reading_durations) is credited to the bucket the
+    reading falls in. Returns (bucket start epochs, connected seconds per bucket,
+    on-seconds per bucket and sensor); buckets without readings are dropped.
+    """
+    n_buckets = max(1, int(np.ceil((end - start) / bucket_seconds)))
+    if len(epochs) == 0:
+        return np.empty(0), np.empty(0), np.empty((0, states.shape[1]))
+
+    durations = reading_durations(epochs, end, max_gap)
+    bucket = np.clip(((epochs - start) // bucket_seconds).astype(np.intp), 0, n_buckets - 1)
+    connected = np.bincount(bucket, weights=durations, minlength=n_buckets)
+    on = np.stack([
+        np.bincount(bucket, weights=durations * states[:, k], minlength=n_buckets)
+        for k in range(states.shape[1])
+    ], axis=1)
+
+    populated = np.flatnonzero(connected > 0)
+    return start + populated * bucket_seconds, connected[populated], on[populated]
+
+
+def connection_intervals(epochs, start, end, max_gap):
+    """
+    Partition [start, end] into alternating on/off intervals (gaps-and-islands).
+
+    Readings less than max_gap apart form one 'on' island, which lasts until
+    max_gap after its last reading (clipped to `end`); everything else is 'off'.
+    Returns (interval starts, interval ends, is_on) as arrays of epoch seconds.
+    """
+    if len(epochs) == 0:
+        return np.array([start], dtype=np.float64), np.array([end], dtype=np.float64), np.array([False])
+
+    breaks = np.flatnonzero(np.diff(epochs) > max_gap)
+    island_starts = epochs[np.concatenate(([0], breaks + 1))]
+    island_ends = np.minimum(epochs[np.concatenate((breaks, [len(epochs) - 1]))] + max_gap, end)
+
+    # Interleave off gaps and on islands: off, on, off, on, ..., off
+    edges = np.empty(2 * len(island_starts) + 2, dtype=np.float64)
+    edges[0] = start
+    edges[1:-1:2] = island_starts
+    edges[2:-1:2] = island_ends
+    edges[-1] = end
+    starts, ends = edges[:-1], edges[1:]
+    is_on = np.zeros(len(starts), dtype=bool)
+    is_on[1::2] = True
+
+    keep = ends > starts
+    return starts[keep], ends[keep], is_on[keep]
+
+
+def split_intervals_by_day(starts, ends, values):
+    """
+    Cut intervals at UTC midnights.
+    Returns (day number since epoch, piece start, piece end, value) per piece.
+    """
+    if len(starts) == 0:
+        empty = np.empty(0, dtype=np.float64)
+        return np.empty(0, dtype=np.int64), empty, empty, values[:0]
+
+    first_day = np.floor(starts / SECONDS_PER_DAY).astype(np.int64)
+    last_day = np.ceil(ends / SECONDS_PER_DAY).astype(np.int64) - 1
+    pieces = last_day - first_day + 1
+
+    source = np.repeat(np.arange(len(starts)), pieces)
+    offsets = np.arange(len(source)) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+    day = first_day[source] + offsets
+    piece_starts = np.maximum(starts[source], day * SECONDS_PER_DAY)
+    piece_ends = np.minimum(ends[source], (day + 1) * SECONDS_PER_DAY)
+    return day, piece_starts, piece_ends, values[source]
+
+
+def detect_cycles(epochs, values):
+    """
+    Fill cycles of a boolean sensor: each rising edge (False -> True) closes a
+    cycle that started at the previous edge of either kind.
+    Returns (cycle start epochs, cycle end epochs).
+    """
+    if len(values) < 2:
+        empty = np.empty(0, dtype=np.float64)
+        return empty, empty
+
+    edges = np.flatnonzero(np.diff(values.astype(np.int8))) + 1
+    rising = values[edges[1:]]
+    return epochs[edges[:-1]][rising], epochs[edges[1:]][rising]
@@ -0,0 +1,261 @@
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from threading import Lock
+import logging
+import time
+from sqlalchemy import select, update, values, column, func, case, extract, literal, true, String, Float
+from sqlalchemy.dialects.postgresql import insert, TIMESTAMP
+from sqlalchemy.orm import Session
+from ..models import Signal, Controlador, SensorMetrics, generate_uuid
+from ..utils.sensor_utils import is_sensor_connected, sensor_connected_predicate
+from .signal_queries import SENSOR_COLUMNS, CONNECTION_TIMEOUT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_COLUMNS = [f'time_{sensor}' for sensor in SENSOR_COLUMNS]
+METRIC_COLUMNS = ['connected_time_minutes', *ACTIVE_COLUMNS]
+# Transaction-level advisory lock serializing flushes and catch-ups across workers
+FLUSH_LOCK_KEY = 7_350_002
+
+
+class SensorMetricsAccumulator:
+    """
+    Connected and per-sensor active seconds per controller, accumulated in memory
+    at ingest and written to sensor_metrics in bulk by flush_sensor_metrics.
+
+    Each controller has one run of consecutive readings [base, last] whose gaps
+    have been counted here but not yet in the table. A flush only applies a run
+    whose base is the table's watermark (compare-and-set), so a run that does not
+    continue what the table has (restart, lost flush, readings taken by another
+    worker) is dropped and its gaps are recounted from signals (catch_up_deltas).
+    """
+
+    def __init__(self):
+        self._runs: Dict[str, Dict] = {}
+        self._lock = Lock()
+        self.last_full_catch_up: Optional[float] = None
+
+    def add(self, controlador, signal, previous_signal) -> None:
+        """
+        Count the gap between a controller's previous reading and a new one,
+        capped at CONNECTION_TIMEOUT_SECONDS. The previous reading's states are in
+        effect during the gap (as in signal_queries.reading_durations).
+        """
+        if previous_signal is None or previous_signal.tstamp is None:
+            return
+        seconds = min((signal.tstamp - previous_signal.tstamp).total_seconds(), CONNECTION_TIMEOUT_SECONDS)
+        if seconds < 0:
+            return
+        config = controlador.config or {}
+        active = [
+            bool(is_sensor_connected(config.get(sensor, {}).get('tipo', 'NA'), getattr(previous_signal, sensor)))
+            for sensor in SENSOR_COLUMNS
+        ]
+
+        with self._lock:
+            run = self._runs.get(controlador.id)
+            if run is None or run['last'] != previous_signal.tstamp:
+                run = self._runs[controlador.id] = {
+                    'base': previous_signal.tstamp, 'connected': 0.0, 'active': [0.0] * len(SENSOR_COLUMNS)
+                }
+            run['last'] = signal.tstamp
+            run['connected'] += seconds
+            for k, is_active in enumerate(active):
+                if is_active:
+                    run['active'][k] += seconds
+
+    def discard(self, controlador_id: str) -> None:
+        """Forget a controller's pending run (controller being deleted)"""
+        with self._lock:
+            self._runs.pop(controlador_id, None)
+
+    def drain(self) -> List[Dict]:
+        """Pending deltas (minutes) as rows for apply_deltas; each run then restarts at its last reading"""
+        deltas = []
+        with self._lock:
+            for controlador_id, run in self._runs.items():
+                if run['last'] == run['base']:
+                    continue
+                deltas.append({
+                    'controlador_id': controlador_id,
+                    'base': run['base'],
+                    'watermark': run['last'],
+                    'connected_time_minutes': run['connected'] / 60,
+                    **{name: seconds / 60 for name, seconds in zip(ACTIVE_COLUMNS, run['active'])}
+                })
+                run['base'] = run['last']
+                run['connected'] = 0.0
+                run['active'] = [0.0] * len(SENSOR_COLUMNS)
+        return deltas
+
+
+def apply_deltas(session: Session, deltas: List[Dict]) -> Set[str]:
+    """
+    Add metric deltas to sensor_metrics in one statement per kind: rows with a
+    base update the controller's row only if its watermark is still that base;
+    rows without one (no metrics yet) are inserted. Returns the controllers applied.
+    """
+    applied = set()
+    existing = [delta for delta in deltas if delta['base'] is not None]
+    if existing:
+        rows = values(
+            column('controlador_id', String),
+            column('base', TIMESTAMP(timezone=True)),
+            column('watermark', TIMESTAMP(timezone=True)),
+            *[column(name, Float) for name in METRIC_COLUMNS],
+            name='deltas'
+        ).data([
+            (delta['controlador_id'], delta['base'], delta['watermark'], *[delta[name] for name in METRIC_COLUMNS])
+            for delta in existing
+        ])
+        table = SensorMetrics.__table__
+        result = session.execute(
+            update(table).
+            where(table.c.controlador_id == rows.c.controlador_id, table.c.watermark == rows.c.base).
+            values(watermark=rows.c.watermark, **{name: table.c[name] + rows.c[name] for name in METRIC_COLUMNS}).
+            returning(table.c.controlador_id)
+        )
+        applied.update(result.scalars())
+
+    new = [delta for delta in deltas if delta['base'] is None]
+    if new:
+        result = session.execute(
+            insert(SensorMetrics.__table__).
+            values([
+                {'id': generate_uuid(), 'controlador_id': delta['controlador_id'], 'watermark': delta['watermark'],
+                 **{name: delta[name] for name in METRIC_COLUMNS}}
+                for delta in new
+            ]).
+            on_conflict_do_nothing(index_elements=['controlador_id']).
+            returning(SensorMetrics.controlador_id)
+        )
+        applied.update(result.scalars())
+    return applied
+
+
+def catch_up_deltas(session: Session, controlador_ids: Optional[Iterable[str]] = None) -> List[Dict]:
+    """
+    Deltas (minutes) for the readings of each controller after its watermark
+    (its whole history when it has no metrics yet), computed from signals in one
+    query: a LATERAL scan per controller starting at its watermark. Controllers
+    without new readings are left out. All controllers when controlador_ids is None.
+    """
+    controllers = select(
+        Controlador.id,
+        SensorMetrics.watermark,
+        *[func.coalesce(Controlador.config[sensor]['tipo'].astext, 'NA').label(f'tipo_{sensor}') for sensor in SENSOR_COLUMNS]
+    ).outerjoin(SensorMetrics, SensorMetrics.controlador_id == Controlador.id)
+    if controlador_ids is not None:
+        controllers = controllers.where(Controlador.id.in_(list(controlador_ids)))
+    controllers = controllers.subquery('controllers')
+
+    readings = select(
+        Signal.tstamp,
+        *[getattr(Signal, sensor) for sensor in SENSOR_COLUMNS],
+        func.lead(Signal.tstamp).over(order_by=Signal.tstamp).label('next_tstamp')
+    ).where(
+        Signal.controlador_id == controllers.c.id,
+        Signal.tstamp >= func.coalesce(controllers.c.watermark, literal('-infinity', TIMESTAMP(timezone=True)))
+    ).lateral('readings')
+
+    # LEAST ignores NULLs, so the latest reading (no next one yet) must be excluded explicitly
+    seconds = case(
+        (readings.c.next_tstamp.isnot(None),
+         func.least(extract('epoch', readings.c.next_tstamp - readings.c.tstamp), CONNECTION_TIMEOUT_SECONDS))
+    )
+    rows = session.execute(
+        select(
+            controllers.c.id,
+            controllers.c.watermark,
+            func.max(readings.c.tstamp),
+            func.coalesce(func.sum(seconds), 0) / 60,
+            *[
+                func.coalesce(func.sum(seconds).filter(
+                    sensor_connected_predicate(readings.c[sensor], controllers.c[f'tipo_{sensor}'])
+                ), 0) / 60
+                for sensor in SENSOR_COLUMNS
+            ]
+        ).
+        select_from(controllers.join(readings, true())).
+        group_by(controllers.c.id, controllers.c.watermark, *[controllers.c[f'tipo_{sensor}'] for sensor in SENSOR_COLUMNS]).
+        having(func.count(readings.c.next_tstamp) > 0)
+    ).all()
+
+    return [
+        {
+            'controlador_id': row[0],
+            'base': row[1],
+            'watermark': row[2],
+            **{name: float(value) for name, value in zip(METRIC_COLUMNS, row[3:])}
+        }
+        for row in rows
+    ]
+
+
+def flush_sensor_metrics(session: Session, accumulator: 'SensorMetricsAccumulator',
+                         full_catch_up: bool = False) -> Tuple[int, int]:
+    """
+    Write the accumulator's pending runs, then recount from signals the controllers
+    whose run was rejected (or every controller, with full_catch_up) and commit.
+    Returns (controllers flushed from memory, controllers caught up from signals).
+    """
+    session.execute(select(func.pg_advisory_xact_lock(FLUSH_LOCK_KEY)))
+    deltas = accumulator.drain()
+    flushed = apply_deltas(session, deltas)
+
+    stale = [delta['controlador_id'] for delta in deltas if delta['controlador_id'] not in flushed]
+    caught_up = set()
+    if full_catch_up or stale:
+        caught_up = apply_deltas(session, catch_up_deltas(session, None if full_catch_up else stale))
+    session.commit()
+
+    if deltas or caught_up:
+        logger.info(f"Sensor metrics: {len(flushed)} controllers flushed, {len(caught_up)} caught up from signals")
+    return len(flushed), len(caught_up)
+
+
+def schedule_sensor_metrics_flush(app, scheduler) -> None:
+    """
+    Run flush_sensor_metrics every SENSOR_METRICS_FLUSH_SECONDS on the app's
+    scheduler. The first run, and one every SENSOR_METRICS_CATCH_UP_SECONDS after
+    it, catches up every controller (readings received before a crash or by
+    workers that do not flush).
+    """
+    def job():
+        with app.app_context():
+            session = app.db_factory()
+            try:
+                last = sensor_metrics_accumulator.last_full_catch_up
+                full = last is None or time.monotonic() - last >= app.config['SENSOR_METRICS_CATCH_UP_SECONDS']
+                flush_sensor_metrics(session, sensor_metrics_accumulator, full_catch_up=full)
+                if full:
+                    sensor_metrics_accumulator.last_full_catch_up = time.monotonic()
+            except Exception as e:
+                logger.error(f"Error flushing sensor metrics: {str(e)}")
+                session.rollback()
+            finally:
+                app.db_factory.remove()
+
+    scheduler.add_job(
+        job, 'interval',
+        seconds=app.config['SENSOR_METRICS_FLUSH_SECONDS'],
+        id='flush_sensor_metrics',
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True
+    )
+
+
+def lifetime_metrics(session: Session, controlador_id: str) -> Dict:
+    """Lifetime connected and per-sensor active minutes of a controller (one row read)"""
+    metrics = session.query(SensorMetrics).filter_by(controlador_id=controlador_id).first()
+    return {
+        'connected_time_minutes': round(metrics.connected_time_minutes, 2) if metrics else 0,
+        'active_time_minutes': {
+            sensor: round(getattr(metrics, name), 2) if metrics else 0
+            for sensor, name in zip(SENSOR_COLUMNS, ACTIVE_COLUMNS)
+        },
+        'counted_until': metrics.watermark if metrics else None
+    }
+
+
+sensor_metrics_accumulator = SensorMetricsAccumulator()
@@ -1,48 +1,176 @@
-from datetime import datetime, timedelta
-from sqlalchemy import func, case, and_, extract
+from datetime import datetime, timedelta, timezone
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import deque
+import multiprocessing
+from .sensor_analytics import detect_cycles, connection_intervals, reading_durations, SECONDS_PER_DAY
+from .signal_queries import sensor_series, sensor_state_arrays_by_controller, SENSOR_COLUMNS, CONNECTION_TIMEOUT_SECONDS
 from ..models import Signal, Controlador
+from sqlalchemy import select
 import logging
 
 logger = logging.getLogger(__name__)
 
+# The 'Lleno' (full) sensor that marks the end of each fill cycle
+CYCLE_SENSOR = 'value_sensor1'
+# Cycles within this fraction of the average duration count as optimal
+EFFICIENCY_MARGIN = 0.1
+HOURS_PER_PERIOD = 4
+# Readings per process pool task: many small controllers share a task, so
+# per-task pickling and IPC do not outweigh the work
+POOL_TASK_ROWS = 50_000
+
+
+def summarize_cycles(starts, ends, today=None, include_series=True):
+    """
+    Cycle analytics payload from cycle start/end epochs (see detect_cycles),
+    computed with array operations. Days and hours are UTC. Returns None
+    when there are no cycles. include_series=False leaves out the per-cycle
+    'cycle_times' list.
+    """
+    if len(starts) == 0:
+        return None
+
+    durations = (ends - starts) / 60
+    avg_cycle_time = float(durations.mean())
+    efficiency_margin = avg_cycle_time * EFFICIENCY_MARGIN
+    deviation = durations - avg_cycle_time
+    optimal_cycles = int(np.count_nonzero(np.abs(deviation) <= efficiency_margin))
+    delayed_cycles = int(np.count_nonzero(deviation > efficiency_margin))
+    interrupted_cycles = int(np.count_nonzero(deviation < -efficiency_margin))
+
+    days = np.floor(starts / SECONDS_PER_DAY).astype(np.int64)
+    today = today or datetime.now(timezone.utc).date()
+    today_number = (today - datetime(1970, 1, 1).date()).days
+    hours = ((starts - days * SECONDS_PER_DAY) // 3600).astype(np.intp)
+    per_period = np.bincount(hours // HOURS_PER_PERIOD, minlength=24 // HOURS_PER_PERIOD)
+
+    target = round(avg_cycle_time, 2)
+
+    analytics = {
+        'summary': {
+            'avg_cycle_time': target,
+            'total_cycles': len(starts),
+            'efficiency_rate': round(optimal_cycles / len(starts) * 100, 2),
+            'cycles_today': int(np.count_nonzero(days == today_number)),
+        }
+    }
+    if include_series:
+        dates = days.astype('datetime64[D]')
+        months = dates.astype('datetime64[M]')
+        month_numbers = (months.astype(np.int64) % 12 + 1).tolist()
+        day_numbers = ((dates - months).astype(np.int64) + 1).tolist()
+        analytics['cycle_times'] = [
+            {'date': f"{month:02d}/{day:02d}", 'cycleTime': cycle_time, 'target': target}
+            for month, day, cycle_time in zip(month_numbers, day_numbers, np.round(durations, 2).tolist())
+        ]
+    analytics['hourly_distribution'] = [
+        {'hour': f"{period * HOURS_PER_PERIOD:02d}-{(period + 1) * HOURS_PER_PERIOD:02d}", 'cycles': int(count)}
+        for period, count in enumerate(per_period)
+    ]
+    analytics['efficiency_distribution'] = [
+        {'name': 'Optimal Cycles', 'value': optimal_cycles},
+        {'name': 'Delayed Cycles', 'value': delayed_cycles},
+        {'name': 'Interrupted Cycles', 'value': interrupted_cycles}
+    ]
+    return analytics
+
+
+def controller_metrics(epochs, states, start, end, today=None):
+    """
+    Cycle and uptime metrics of one controller from its readings in [start, end]
+    (epoch seconds; arrays as returned by sensor_state_arrays). Pure NumPy, so it
+    can run in a worker process.
+
+    'uptime' is the share of the window covered by connection islands (see
+    connection_intervals); 'sensor_uptime' the time-weighted share of connected
+    time each sensor was on, as in the controller sensor_uptime endpoint.
+    """
+    starts, ends = detect_cycles(epochs, states[:, SENSOR_COLUMNS.index(CYCLE_SENSOR)])
+    interval_starts, interval_ends, is_on = connection_intervals(epochs, start, end, CONNECTION_TIMEOUT_SECONDS)
+    durations = reading_durations(epochs, end, CONNECTION_TIMEOUT_SECONDS)
+    connected_seconds = float(durations.sum())
+    on_seconds = durations @ states
+
+    return {
+        'cycles': summarize_cycles(starts, ends, today, include_series=False),
+        'uptime_percentage': round(float((interval_ends - interval_starts)[is_on].sum()) / (end - start) * 100, 2),
+        'sensor_uptime': {
+            sensor: round(float(on_seconds[k]) / connected_seconds * 100, 2) if connected_seconds > 0 else 0
+            for k, sensor in enumerate(SENSOR_COLUMNS)
+        },
+        'last_reading': datetime.fromtimestamp(epochs[-1], timezone.utc) if len(epochs) else None
+    }
+
+
+def _chunk_metrics(chunk, start, end, today):
+    """controller_metrics for a list of (controlador_id, epochs, states), in a worker process"""
+    return {
+        controlador_id: controller_metrics(epochs, states, start, end, today)
+        for controlador_id, epochs, states in chunk
+    }
+
+
+def _chunk_controllers(readings, max_rows):
+    """Group consecutive controllers into lists of about max_rows readings (one pool task each)"""
+    chunk, rows = [], 0
+    for reading in readings:
+        chunk.append(reading)
+        rows += len(reading[1])
+        if rows >= max_rows:
+            yield chunk
+            chunk, rows = [], 0
+    if chunk:
+        yield chunk
+
+
+_process_pool = None
+
+
+def _get_process_pool(workers):
+    """
+    Lazily created pool shared by all requests of this process. Workers are
+    spawned rather than forked, so they inherit neither database connections
+    nor the server's green threads. Spawned workers re-run the parent's main
+    module as __mp_main__; main.py keeps the eventlet patching and the app
+    (engine, scheduler jobs) under its __main__ guard, so a worker only
+    imports what the tasks need.
+    """
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    return _process_pool
+
+
+def _discard_process_pool(pool):
+    global _process_pool
+    if _process_pool is pool:
+        _process_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
 class CycleAnalyticsService:
     def __init__(self, session):
         self.session = session
 
+    def get_cycle_arrays(self, controlador_id, start_date, end_date):
+        """Cycle start and end epochs from the 'Lleno' sensor, detected on NumPy arrays"""
+        epochs, values = sensor_series(self.session, controlador_id, CYCLE_SENSOR, start_date, end_date)
+        return detect_cycles(epochs, values)
+
     def get_cycle_times(self, controlador_id, start_date, end_date):
         """Calculate cycle times based on 'Lleno' sensor activations"""
         try:
-            # Get all signals where Lleno changed from False to True
-            signals = self.session.query(Signal).\
-                filter(
-                    Signal.controlador_id == controlador_id,
-                    Signal.tstamp.between(start_date, end_date)
-                ).\
-                order_by(Signal.tstamp).all()
-            
-            cycles = []
-            cycle_start = None
-            
-            for i in range(len(signals) - 1):
-                current = signals[i]
-                next_signal = signals[i + 1]
-                
-                # If Lleno transitions from False to True, it's the end of a cycle
-                if not current.value_sensor1 and next_signal.value_sensor1:
-                    if cycle_start:
-                        cycle_duration = next_signal.tstamp - cycle_start
-                        cycles.append({
-                            'start_time': cycle_start,
-                            'end_time': next_signal.tstamp,
-                            'duration_minutes': cycle_duration.total_seconds() / 60
-                        })
-                    cycle_start = next_signal.tstamp
-                
-                # If Lleno transitions from True to False, it's the start of a new cycle
-                elif current.value_sensor1 and not next_signal.value_sensor1:
-                    cycle_start = next_signal.tstamp
-
-            return cycles
+            starts, ends = self.get_cycle_arrays(controlador_id, start_date, end_date)
+            return [
+                {
+                    'start_time': datetime.fromtimestamp(start, timezone.utc),
+                    'end_time': datetime.fromtimestamp(end, timezone.utc),
+                    'duration_minutes': (end - start) / 60
+                }
+                for start, end in zip(starts.tolist(), ends.tolist())
+            ]
 
         except Exception as e:
             logger.error(f"Error getting cycle times: {str(e)}")
@@ -51,79 +179,56 @@ class CycleAnalyticsService:
     def get_cycle_analytics(self, controlador_id, days=7):
         """Get comprehensive cycle analytics"""
         try:
-            end_date = datetime.now()
+            end_date = datetime.now(timezone.utc)
             start_date = end_date - timedelta(days=days)
-            
-            cycles = self.get_cycle_times(controlador_id, start_date, end_date)
-            
-            if not cycles:
-                return None
-            
-            # Calculate metrics
-            cycle_durations = [cycle['duration_minutes'] for cycle in cycles]
-            avg_cycle_time = sum(cycle_durations) / len(cycle_durations)
-            
-            # Calculate daily distribution
-            daily_cycles = {}
-            for cycle in cycles:
-                date = cycle['start_time'].date()
-                daily_cycles[date] = daily_cycles.get(date, 0) + 1
-            
-            # Calculate efficiency (cycles within 10% of average time)
-            target_time = avg_cycle_time
-            efficiency_margin = target_time * 0.1
-            optimal_cycles = sum(
-                1 for duration in cycle_durations 
-                if abs(duration - target_time) <= efficiency_margin
-            )
-            efficiency_rate = (optimal_cycles / len(cycles)) * 100
-
-            # Calculate hourly distribution
-            hourly_distribution = {f"{i:02d}-{(i+4):02d}": 0 for i in range(0, 24, 4)}
-            for cycle in cycles:
-                hour = cycle['start_time'].hour
-                period = f"{(hour // 4 * 4):02d}-{(hour // 4 * 4 + 4):02d}"
-                hourly_distribution[period] += 1
-
-            return {
-                'summary': {
-                    'avg_cycle_time': round(avg_cycle_time, 2),
-                    'total_cycles': len(cycles),
-                    'efficiency_rate': round(efficiency_rate, 2),
-                    'cycles_today': daily_cycles.get(datetime.now().date(), 0),
-                },
-                'cycle_times': [
-                    {
-                        'date': cycle['start_time'].strftime('%m/%d'),
-                        'cycleTime': round(cycle['duration_minutes'], 2),
-                        'target': round(target_time, 2)
-                    }
-                    for cycle in cycles
-                ],
-                'hourly_distribution': [
-                    {'hour': hour, 'cycles': count}
-                    for hour, count in hourly_distribution.items()
-                ],
-                'efficiency_distribution': [
-                    {
-                        'name': 'Optimal Cycles',
-                        'value': optimal_cycles
-                    },
-                    {
-                        'name': 'Delayed Cycles',
-                        'value': sum(1 for d in cycle_durations if d > target_time + efficiency_margin)
-                    },
-                    {
-                        'name': 'Interrupted Cycles',
-                        'value': sum(1 for d in cycle_durations if d < target_time - efficiency_margin)
-                    }
-                ]
-            }
+            starts, ends = self.get_cycle_arrays(controlador_id, start_date, end_date)
+            return summarize_cycles(starts, ends, end_date.date())
 
         except Exception as e:
             logger.error(f"Error calculating cycle analytics: {str(e)}")
             return None
 
+    def get_empresa_analytics(self, empresa_id, days=7, workers=0):
+        """
+        controller_metrics for every controller of a company over the last `days`,
+        as {controlador_id: metrics}; controllers without readings are left out.
+
+        The readings of the whole fleet come from one scan ordered by controller
+        (sensor_state_arrays_by_controller). With workers > 0 each controller is
+        computed in a process pool while the scan continues, in tasks of about
+        POOL_TASK_ROWS readings; at most two tasks per worker are in flight,
+        bounding memory.
+        """
+        end_date = datetime.now(timezone.utc)
+        start_date = end_date - timedelta(days=days)
+        start, end = start_date.timestamp(), end_date.timestamp()
+        # Executed on the Core connection, so soft-deleted controllers are excluded here
+        controladores = select(Controlador.id).where(Controlador.empresa_id == empresa_id, Controlador.deleted_at.is_(None))
+        readings = sensor_state_arrays_by_controller(
+            self.session, start_date, end_date, Signal.controlador_id.in_(controladores)
+        )
+
+        if not workers:
+            return {
+                controlador_id: controller_metrics(epochs, states, start, end, end_date.date())
+                for controlador_id, epochs, states in readings
+            }
+
+        pool = _get_process_pool(workers)
+        results, in_flight = {}, deque()
+        try:
+            for chunk in _chunk_controllers(readings, POOL_TASK_ROWS):
+                in_flight.append(pool.submit(_chunk_metrics, chunk, start, end, end_date.date()))
+                if len(in_flight) > workers * 2:
+                    results.update(in_flight.popleft().result())
+            for future in in_flight:
+                results.update(future.result())
+        except BrokenProcessPool:
+            # A worker died; start a fresh pool on the next request
+            _discard_process_pool(pool)
+            raise
+        return results
+
     def export_cycle_report(self, controlador_id, start_date, end_date, format='csv'):
         """Export cycle data in various formats"""
         try:
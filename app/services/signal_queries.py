@@ -0,0 +1,358 @@
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from datetime import datetime, timedelta
+import logging
+import numpy as np
+from sqlalchemy import select, union_all, text, true, false, or_, not_, tuple_, func, extract, literal, cast, Float, Integer
+from sqlalchemy.orm import Session, aliased
+from ..models import Signal, Controlador
+from ..config import TIMESCALEDB
+
+logger = logging.getLogger(__name__)
+
+SENSOR_COLUMNS = ['value_sensor1', 'value_sensor2', 'value_sensor3', 'value_sensor4', 'value_sensor5', 'value_sensor6']
+# Signal fields in API responses (the dashboard Signal model)
+SIGNAL_ROW_FIELDS = ['id', 'tstamp', *SENSOR_COLUMNS]
+
+# A gap longer than this between readings means the controller was disconnected
+CONNECTION_TIMEOUT_SECONDS = 300
+
+
+def time_bucket(width: timedelta, column):
+    """
+    Start of the UTC-aligned bucket of `width` containing `column` (timestamptz).
+    TimescaleDB's time_bucket in Timescale mode, plain epoch arithmetic otherwise.
+    """
+    seconds = int(width.total_seconds())
+    if TIMESCALEDB:
+        return func.time_bucket(text(f"INTERVAL '{seconds} seconds'"), column)
+    return func.to_timestamp(func.floor(extract('epoch', column) / seconds) * seconds)
+
+
+def latest_signals_by_controller(session: Session, controlador_ids: Iterable[str]) -> Dict[str, Signal]:
+    """
+    Latest signal for each controller in a single query.
+
+    A LATERAL ... ORDER BY tstamp DESC LIMIT 1 per controller costs one backward
+    probe of the (controlador_id, tstamp) index each. SELECT DISTINCT ON
+    (controlador_id) reads every row of every controller before de-duplicating,
+    which is several times slower once controllers have a few hundred signals
+    (see maintenance_scripts/benchmark_queries.py).
+    Controllers without signals are not present in the result.
+    """
+    recent = recent_signals_by_controller(session, controlador_ids, limit=1)
+    return {controlador_id: signals[0] for controlador_id, signals in recent.items() if signals}
+
+
+def _recent_signals_lateral(limit: int, *columns):
+    """LATERAL subquery of a controller's last `limit` signals, correlated to Controlador.id"""
+    return select(*(columns or (Signal,))).\
+        where(Signal.controlador_id == Controlador.id).\
+        order_by(Signal.tstamp.desc()).\
+        limit(limit).\
+        lateral('recent_signals')
+
+
+def recent_signals_by_controller(session: Session, controlador_ids: Iterable[str], limit: int) -> Dict[str, List[Signal]]:
+    """
+    Last `limit` signals for each controller (newest first) in a single query,
+    using a LATERAL subquery so each controller only reads its own index range.
+    """
+    controlador_ids = list(controlador_ids)
+    if not controlador_ids:
+        return {}
+
+    recent = _recent_signals_lateral(limit)
+    recent_signal = aliased(Signal, recent)
+
+    signals = session.query(recent_signal).\
+        select_from(Controlador).\
+        join(recent, true()).\
+        filter(Controlador.id.in_(controlador_ids)).\
+        order_by(recent.c.controlador_id, recent.c.tstamp.desc()).\
+        all()
+
+    grouped = {controlador_id: [] for controlador_id in controlador_ids}
+    for signal in signals:
+        grouped[signal.controlador_id].append(signal)
+    return grouped
+
+
+def recent_signal_rows(session: Session, controlador_ids: Iterable[str], limit: int) -> Dict[str, List[Dict]]:
+    """
+    Same query as recent_signals_by_controller, returning plain dicts of
+    SIGNAL_ROW_FIELDS (tstamp as datetime) built from row tuples, without
+    loading ORM objects. For responses serialized straight to JSON.
+    """
+    controlador_ids = list(controlador_ids)
+    if not controlador_ids:
+        return {}
+
+    recent = _recent_signals_lateral(limit, Signal.controlador_id, *[getattr(Signal, name) for name in SIGNAL_ROW_FIELDS])
+    rows = session.execute(
+        select(recent).
+        select_from(Controlador).
+        join(recent, true()).
+        where(Controlador.id.in_(controlador_ids)).
+        order_by(recent.c.controlador_id, recent.c.tstamp.desc())
+    ).all()
+
+    grouped = {controlador_id: [] for controlador_id in controlador_ids}
+    for controlador_id, *values in rows:
+        grouped[controlador_id].append(dict(zip(SIGNAL_ROW_FIELDS, values)))
+    return grouped
+
+
+def signal_page(session: Session, controlador_id: str, limit: int,
+                before: Optional[Tuple[datetime, int]] = None,
+                start: Optional[datetime] = None, end: Optional[datetime] = None) -> Tuple[List[Dict], Optional[Tuple[datetime, int]]]:
+    """
+    One page of a controller's signals, newest first, as dicts of SIGNAL_ROW_FIELDS.
+    `before` is the (tstamp, id) key of the last row of the previous page; the
+    next key is returned alongside the rows (None on the last page).
+
+    Keyset pagination: the key becomes a bound on the (controlador_id, tstamp)
+    index scan, so a page costs the same at any depth, unlike OFFSET.
+    """
+    filters = [Signal.controlador_id == controlador_id]
+    if before is not None:
+        filters.append(tuple_(Signal.tstamp, Signal.id) < tuple_(*before))
+    if start is not None:
+        filters.append(Signal.tstamp >= start)
+    if end is not None:
+        filters.append(Signal.tstamp < end)
+
+    rows = session.execute(
+        select(*[getattr(Signal, name) for name in SIGNAL_ROW_FIELDS]).
+        where(*filters).
+        order_by(Signal.tstamp.desc(), Signal.id.desc()).
+        limit(limit + 1)
+    ).all()
+
+    page = [dict(zip(SIGNAL_ROW_FIELDS, row)) for row in rows[:limit]]
+    next_key = (page[-1]['tstamp'], page[-1]['id']) if len(rows) > limit else None
+    return page, next_key
+
+
+def reading_durations(controlador_id: Optional[str], start: datetime, end: datetime,
+                      max_gap: int = CONNECTION_TIMEOUT_SECONDS):
+    """
+    Subquery with one row per reading in effect during [start, end) and the
+    seconds it stays in effect inside the window: the gap to the next reading
+    (or to `end` for the last one), capped at `max_gap` so disconnections do not
+    count as time spent in the last state.
+
+    Readings up to `max_gap` before `start` contribute the part of their interval
+    that falls inside the window, with `tstamp` clipped to `start`, so adjacent
+    windows add up exactly. `in_window` is False for those carried-over rows.
+    Pass controlador_id=None to cover every controller.
+    """
+    next_tstamp = func.lead(Signal.tstamp).over(
+        partition_by=Signal.controlador_id,
+        order_by=Signal.tstamp
+    )
+    filters = [Signal.tstamp >= start - timedelta(seconds=max_gap), Signal.tstamp < end]
+    if controlador_id is not None:
+        filters.append(Signal.controlador_id == controlador_id)
+    readings = select(
+        Signal.controlador_id,
+        Signal.tstamp,
+        *[getattr(Signal, sensor) for sensor in SENSOR_COLUMNS],
+        next_tstamp.label('next_tstamp')
+    ).where(*filters).subquery('readings')
+
+    interval_start = func.greatest(readings.c.tstamp, literal(start))
+    interval_end = func.least(
+        func.coalesce(readings.c.next_tstamp, literal(end)),
+        readings.c.tstamp + literal(timedelta(seconds=max_gap))
+    )
+    clipped = select(
+        readings.c.controlador_id,
+        interval_start.label('tstamp'),
+        (readings.c.tstamp >= start).label('in_window'),
+        *[readings.c[sensor] for sensor in SENSOR_COLUMNS],
+        extract('epoch', interval_end - interval_start).label('duration')
+    ).subquery('clipped_readings')
+    return select(clipped).where(clipped.c.duration > 0).subquery('reading_durations')
+
+
+def hourly_pieces(durations, *columns):
+    """
+    Split each row of a reading_durations subquery at the top of the UTC hour.
+    Returns a subquery of (hour, seconds, *columns); durations are capped well
+    below an hour, so a reading spans at most two hours.
+    """
+    utc_tstamp = func.timezone('UTC', durations.c.tstamp)
+    hour = func.timezone('UTC', time_bucket(timedelta(hours=1), durations.c.tstamp))
+    next_hour = hour + text("INTERVAL '1 hour'")
+    in_hour = func.least(durations.c.duration, extract('epoch', next_hour - utc_tstamp))
+    return union_all(
+        select(hour.label('hour'), in_hour.label('seconds'), *columns),
+        select(next_hour.label('hour'), (durations.c.duration - in_hour).label('seconds'), *columns).
+        where(durations.c.duration > in_hour)
+    ).subquery('hourly_pieces')
+
+
+def sensor_mask(columns):
+    """The six sensor values packed into one integer, bit k for SENSOR_COLUMNS[k] (NULL counts as False)"""
+    return sum(
+        cast(func.coalesce(columns[sensor], False), Integer) * (1 << bit)
+        for bit, sensor in enumerate(SENSOR_COLUMNS)
+    )
+
+
+def active_predicate(columns, controlador_config: Dict) -> object:
+    """
+    SQL predicate for "any sensor is active" under a controller config:
+    NA sensors are active when True, NC sensors when False (NULL counts as False).
+    `columns` maps sensor keys to the columns to test.
+    """
+    clauses = []
+    for sensor_key, sensor_config in (controlador_config or {}).items():
+        if sensor_key not in SENSOR_COLUMNS:
+            continue
+        value = func.coalesce(columns[sensor_key], False)
+        if sensor_config.get('tipo') == 'NA':
+            clauses.append(value)
+        elif sensor_config.get('tipo') == 'NC':
+            clauses.append(not_(value))
+    return or_(*clauses) if clauses else false()
+
+
+def active_seconds_by_hour(session: Session, controlador_id: str, controlador_config: Dict,
+                           start: datetime, end: datetime) -> Dict[datetime, float]:
+    """
+    Seconds per UTC hour during which any sensor was active (see active_predicate),
+    time-weighted by reading gaps, from one grouped scan. A reading whose duration
+    runs past the top of the hour is split between both hours (see hourly_pieces).
+    Hours without active time are omitted.
+    """
+    durations = reading_durations(controlador_id, start, end)
+    pieces = hourly_pieces(durations.select().where(active_predicate(durations.c, controlador_config)).subquery())
+    rows = session.query(pieces.c.hour, func.sum(pieces.c.seconds)).group_by(pieces.c.hour).all()
+    return {row[0]: float(row[1]) for row in rows}
+
+
+def sensor_on_seconds(session: Session, controlador_id: str, start: datetime, end: datetime) -> Tuple[float, Dict[str, float]]:
+    """
+    Connected seconds and per-sensor seconds spent True in [start, end),
+    time-weighted by the gap between consecutive readings, in a single scan.
+    """
+    durations = reading_durations(controlador_id, start, end)
+    row = session.query(
+        func.coalesce(func.sum(durations.c.duration), 0),
+        *[
+            func.coalesce(func.sum(durations.c.duration).filter(durations.c[sensor].is_(True)), 0)
+            for sensor in SENSOR_COLUMNS
+        ]
+    ).one()
+    connected_seconds = float(row[0])
+    return connected_seconds, {sensor: float(value) for sensor, value in zip(SENSOR_COLUMNS, row[1:])}
+
+
+def reading_epochs(session: Session, controlador_id: str, start: datetime, end: datetime) -> np.ndarray:
+    """Timestamps of the readings in [start, end) as sorted epoch seconds (float64)"""
+    rows = session.execute(
+        select(cast(extract('epoch', Signal.tstamp), Float)).
+        where(
+            Signal.controlador_id == controlador_id,
+            Signal.tstamp >= start,
+            Signal.tstamp < end
+        ).
+        order_by(Signal.tstamp)
+    ).scalars().all()
+    return np.fromiter(rows, dtype=np.float64, count=len(rows))
+
+
+def sensor_series(session: Session, controlador_id: str, sensor: str, start: datetime, end: datetime) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    One sensor's readings in [start, end) as NumPy arrays ordered by time:
+    epoch seconds (float64) and values (bool, NULL counts as False).
+    """
+    rows = session.execute(
+        select(cast(extract('epoch', Signal.tstamp), Float), func.coalesce(getattr(Signal, sensor), False)).
+        where(
+            Signal.controlador_id == controlador_id,
+            Signal.tstamp >= start,
+            Signal.tstamp < end
+        ).
+        order_by(Signal.tstamp)
+    ).all()
+    epochs = np.fromiter((row[0] for row in rows), dtype=np.float64, count=len(rows))
+    values = np.fromiter((row[1] for row in rows), dtype=bool, count=len(rows))
+    return epochs, values
+
+
+def sensor_state_arrays(session: Session, controlador_id: str, start: datetime, end: datetime) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Readings in [start, end) as NumPy arrays, ordered by time:
+    epoch seconds (float64, shape (n,)) and sensor states (bool, shape (n, 6),
+    columns in SENSOR_COLUMNS order; NULL readings count as False).
+
+    Only two columns travel over the wire: the epoch and the six sensors packed
+    into one integer bit mask, unpacked here with a vectorised shift.
+    """
+    mask = sensor_mask(Signal.__table__.c)
+    rows = session.execute(
+        select(cast(extract('epoch', Signal.tstamp), Float), mask).
+        where(
+            Signal.controlador_id == controlador_id,
+            Signal.tstamp >= start,
+            Signal.tstamp < end
+        ).
+        order_by(Signal.tstamp)
+    ).all()
+
+    epochs = np.fromiter((row[0] for row in rows), dtype=np.float64, count=len(rows))
+    masks = np.fromiter((row[1] for row in rows), dtype=np.uint8, count=len(rows))
+    return epochs, unpack_sensor_masks(masks)
+
+
+def unpack_sensor_masks(masks: np.ndarray) -> np.ndarray:
+    """(n, 6) bool sensor states from sensor_mask values, columns in SENSOR_COLUMNS order"""
+    return ((masks[:, None] >> np.arange(len(SENSOR_COLUMNS), dtype=np.uint8)) & 1).astype(bool)
+
+
+def _assemble(pieces) -> Tuple[np.ndarray, np.ndarray]:
+    """(epochs, states) from consecutive (epochs, masks) pieces of one controller"""
+    epochs = np.concatenate([piece[0] for piece in pieces])
+    return epochs, unpack_sensor_masks(np.concatenate([piece[1] for piece in pieces]))
+
+
+def sensor_state_arrays_by_controller(session: Session, start: datetime, end: datetime, *filters,
+                                      batch_rows: int = 100_000) -> Iterator[Tuple[str, np.ndarray, np.ndarray]]:
+    """
+    (controlador_id, epochs, states) for every controller with readings in
+    [start, end) matching filters, arrays as in sensor_state_arrays.
+
+    One scan ordered by (controlador_id, tstamp), streamed through a server-side
+    cursor batch_rows at a time and split at controller boundaries, so memory
+    holds one batch plus the controller being assembled rather than the fleet.
+    Controllers are yielded in id order; those without readings are skipped.
+    """
+    mask = sensor_mask(Signal.__table__.c)
+    # Core execution: no ORM row processing on the (large) fleet result
+    result = session.connection().execute(
+        select(Signal.controlador_id, cast(extract('epoch', Signal.tstamp), Float), mask).
+        where(
+            Signal.tstamp >= start,
+            Signal.tstamp < end,
+            *filters
+        ).
+        order_by(Signal.controlador_id, Signal.tstamp),
+        execution_options={'stream_results': True, 'yield_per': batch_rows}
+    )
+
+    current, pending = None, []
+    for rows in result.partitions():
+        ids = np.array([row[0] for row in rows], dtype=object)
+        epochs = np.fromiter((row[1] for row in rows), dtype=np.float64, count=len(rows))
+        masks = np.fromiter((row[2] for row in rows), dtype=np.uint8, count=len(rows))
+        bounds = np.flatnonzero(ids[1:] != ids[:-1]) + 1
+        for lo, hi in zip(np.r_[0, bounds], np.r_[bounds, len(rows)]):
+            if ids[lo] != current and pending:
+                yield (current, *_assemble(pending))
+                pending = []
+            current = ids[lo]
+            pending.append((epochs[lo:hi], masks[lo:hi]))
+    if pending:
+        yield (current, *_assemble(pending))
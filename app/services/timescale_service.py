@@ -0,0 +1,135 @@
+from typing import Dict, List
+from datetime import datetime, timedelta, timezone
+import logging
+from sqlalchemy import select, text, table, column, func, literal
+from sqlalchemy.orm import Session
+from ..models import Signal
+from ..config import TIMESCALEDB
+from .signal_queries import time_bucket, SENSOR_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+# Continuous aggregates (Timescale mode) and the bucket width of each
+STATS_VIEWS = {
+    'hour': ('signal_stats_hourly', timedelta(hours=1)),
+    'day': ('signal_stats_daily', timedelta(days=1)),
+}
+ON_COUNT_COLUMNS = [f'on_count_sensor{i}' for i in range(1, len(SENSOR_COLUMNS) + 1)]
+# Continuous aggregates re-materialise this far back; compression must start later
+CAGG_REFRESH_START_OFFSET = timedelta(days=3)
+# First release that can UPDATE / DELETE rows in compressed chunks, which
+# retention and controller purges do
+TIMESCALEDB_MIN_VERSION = (2, 11)
+
+
+def sample_stats_select(width: timedelta):
+    """Per-controller sample statistics per time bucket, straight from signals"""
+    bucket = time_bucket(width, Signal.tstamp).label('bucket')
+    return select(
+        Signal.controlador_id,
+        bucket,
+        func.count().label('reading_count'),
+        *[func.count().filter(getattr(Signal, sensor).is_(True)).label(on_count)
+          for sensor, on_count in zip(SENSOR_COLUMNS, ON_COUNT_COLUMNS)],
+        func.min(Signal.tstamp).label('first_tstamp'),
+        func.max(Signal.tstamp).label('last_tstamp')
+    ).group_by(Signal.controlador_id, bucket)
+
+
+def setup_timescale(engine, compress_after_days: int = 7, backfill: bool = False) -> None:
+    """
+    Create the continuous aggregates, their refresh policies and the compression
+    policy on signals (Timescale mode). Idempotent. The signals hypertable itself
+    is created by models.Signal on the timescaledb dialect.
+    """
+    if timedelta(days=compress_after_days) <= CAGG_REFRESH_START_OFFSET:
+        raise ValueError(f"compress_after_days must be over {CAGG_REFRESH_START_OFFSET.days} "
+                         f"so continuous aggregate refreshes never touch compressed chunks")
+
+    with engine.connect() as conn:
+        version = conn.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'timescaledb'")).scalar()
+    if version is None or tuple(int(part) for part in version.split('-')[0].split('.')[:2]) < TIMESCALEDB_MIN_VERSION:
+        raise RuntimeError(f"TimescaleDB {'.'.join(map(str, TIMESCALEDB_MIN_VERSION))} or later is required "
+                           f"(found {version or 'none'}): older releases cannot delete from compressed chunks")
+
+    # CREATE MATERIALIZED VIEW ... WITH (timescaledb.continuous) and CALL cannot run in a transaction
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        for view_name, width in STATS_VIEWS.values():
+            definition = sample_stats_select(width).compile(engine, compile_kwargs={'literal_binds': True})
+            conn.execute(text(f"""
+                CREATE MATERIALIZED VIEW IF NOT EXISTS {view_name}
+                WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+                {definition}
+                WITH NO DATA
+            """))
+            conn.execute(text(f"""
+                SELECT add_continuous_aggregate_policy('{view_name}',
+                    start_offset => INTERVAL '{CAGG_REFRESH_START_OFFSET.days} days',
+                    end_offset => INTERVAL '1 hour',
+                    schedule_interval => INTERVAL '{'30 minutes' if width < timedelta(days=1) else '1 hour'}',
+                    if_not_exists => TRUE)
+            """))
+            if backfill:
+                conn.execute(text(f"CALL refresh_continuous_aggregate('{view_name}', NULL, NULL)"))
+
+        conn.execute(text("""
+            ALTER TABLE signals SET (
+                timescaledb.compress,
+                timescaledb.compress_segmentby = 'controlador_id',
+                timescaledb.compress_orderby = 'tstamp DESC'
+            )
+        """))
+        conn.execute(text(f"""
+            SELECT add_compression_policy('signals', INTERVAL '{compress_after_days} days', if_not_exists => TRUE)
+        """))
+    logger.info(f"Timescale continuous aggregates and compression after {compress_after_days} days configured")
+
+
+def sensor_sample_stats(session: Session, controlador_id: str, start: datetime, end: datetime,
+                        resolution: str = 'hour') -> List[Dict]:
+    """
+    Reading count and per-sensor share of readings that were True, for every
+    UTC hour or day bucket overlapping [start, end) (whole buckets).
+
+    Read from the continuous aggregates in Timescale mode (real-time, so the
+    open bucket is included); plain PostgreSQL groups the raw signals instead.
+    """
+    if resolution not in STATS_VIEWS:
+        raise ValueError(f"resolution must be one of {', '.join(STATS_VIEWS)}")
+    view_name, width = STATS_VIEWS[resolution]
+    step = width.total_seconds()
+    first_bucket = datetime.fromtimestamp(start.timestamp() // step * step, timezone.utc)
+
+    if TIMESCALEDB:
+        stats = table(view_name, *[column(name) for name in (
+            'controlador_id', 'bucket', 'reading_count', *ON_COUNT_COLUMNS, 'first_tstamp', 'last_tstamp'
+        )])
+    else:
+        last_bucket_end = datetime.fromtimestamp(-(-end.timestamp() // step) * step, timezone.utc)
+        stats = sample_stats_select(width).where(
+            Signal.controlador_id == controlador_id,
+            Signal.tstamp >= first_bucket,
+            Signal.tstamp < last_bucket_end
+        ).subquery('signal_stats')
+
+    rows = session.execute(
+        select(stats).where(
+            stats.c.controlador_id == controlador_id,
+            stats.c.bucket >= literal(first_bucket),
+            stats.c.bucket < literal(end)
+        ).order_by(stats.c.bucket)
+    ).mappings().all()
+
+    return [
+        {
+            'bucket': row['bucket'].isoformat(),
+            'reading_count': row['reading_count'],
+            **{
+                sensor: round(row[on_count] / row['reading_count'] * 100, 2)
+                for sensor, on_count in zip(SENSOR_COLUMNS, ON_COUNT_COLUMNS)
+            },
+            'first_tstamp': row['first_tstamp'].isoformat(),
+            'last_tstamp': row['last_tstamp'].isoformat()
+        }
+        for row in rows
+    ]
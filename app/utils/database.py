@@ -0,0 +1,194 @@
+from typing import Dict
+from collections import Counter
+from datetime import datetime, timezone
+import threading
+import heapq
+import time
+from flask import has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import NullPool, QueuePool
+
+# Upper bounds (ms) of the checkout wait histogram buckets; waits above the last go in a final unbounded one
+CHECKOUT_WAIT_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+# Slowest checkouts kept per engine
+SLOWEST_CHECKOUTS = 20
+# Retention and the controller purge (which can run at once) each hold an advisory
+# lock on a connection of their own while their session checks out another one
+MIN_CONNECTIONS_PER_WORKER = 3
+
+
+def _endpoint() -> str:
+    """Endpoint of the current request, for work outside requests the thread running it"""
+    if has_request_context():
+        return request.endpoint or request.path
+    return f"(no request: {threading.current_thread().name})"
+
+
+class PoolMonitor:
+    """
+    Live statistics of the app's connection pools, kept in process memory:
+    pool occupancy, checkout waits (histogram, slowest, timeouts per endpoint),
+    connections opened and invalidated. Gathered from pool events and the
+    monitored pool classes, so reading them never touches the database.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._engines: Dict[str, Engine] = {}
+        self._stats: Dict[str, Dict] = {}
+
+    @staticmethod
+    def _empty_stats() -> Dict:
+        return {
+            'since': datetime.now(timezone.utc).isoformat(),
+            'checkouts': 0,
+            'wait_seconds_total': 0.0,
+            'wait_histogram': [0] * (len(CHECKOUT_WAIT_BUCKETS_MS) + 1),
+            'slowest': [],  # min-heap of (wait seconds, at, endpoint)
+            'timeouts': Counter(),
+            'connections_opened': 0,
+            'connections_invalidated': 0,
+        }
+
+    def register(self, name: str, engine: Engine) -> None:
+        """Start collecting statistics for engine, whose pool must have logging name `name`"""
+        with self._lock:
+            self._engines[name] = engine
+            self._stats[name] = self._empty_stats()
+
+        # Listeners are carried over when the pool is recreated (engine.dispose())
+        @event.listens_for(engine, 'connect')
+        def _connected(dbapi_connection, connection_record):
+            self._count(name, 'connections_opened')
+
+        @event.listens_for(engine, 'invalidate')
+        def _invalidated(dbapi_connection, connection_record, exception):
+            self._count(name, 'connections_invalidated')
+
+    def _count(self, name: str, key: str) -> None:
+        with self._lock:
+            if name in self._stats:
+                self._stats[name][key] += 1
+
+    def record_checkout(self, name: str, wait: float, timed_out: bool = False) -> None:
+        """Record how long a checkout from the named pool waited, and whether it timed out"""
+        endpoint = _endpoint()
+        wait_ms = wait * 1000
+        bucket = next((i for i, bound in enumerate(CHECKOUT_WAIT_BUCKETS_MS) if wait_ms <= bound),
+                      len(CHECKOUT_WAIT_BUCKETS_MS))
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                return
+            if timed_out:
+                stats['timeouts'][endpoint] += 1
+            else:
+                stats['checkouts'] += 1
+            stats['wait_seconds_total'] += wait
+            stats['wait_histogram'][bucket] += 1
+            entry = (wait, datetime.now(timezone.utc).isoformat(), endpoint)
+            if len(stats['slowest']) < SLOWEST_CHECKOUTS:
+                heapq.heappush(stats['slowest'], entry)
+            elif wait > stats['slowest'][0][0]:
+                heapq.heapreplace(stats['slowest'], entry)
+
+    @staticmethod
+    def _occupancy(pool) -> Dict:
+        if isinstance(pool, QueuePool):
+            return {'pool_class': type(pool).__name__, 'size': pool.size(), 'checked_out': pool.checkedout(),
+                    'checked_in': pool.checkedin(), 'overflow': max(pool.overflow(), 0),
+                    'timeout_seconds': pool.timeout()}
+        return {'pool_class': type(pool).__name__}
+
+    def stats(self) -> Dict[str, Dict]:
+        """Statistics of every registered engine's pool, by name"""
+        with self._lock:
+            engines = dict(self._engines)
+            collected = {
+                name: {**stats, 'slowest': list(stats['slowest']), 'timeouts': dict(stats['timeouts']),
+                       'wait_histogram': list(stats['wait_histogram'])}
+                for name, stats in self._stats.items()
+            }
+        result = {}
+        for name, engine in engines.items():
+            stats = collected[name]
+            waited = stats['checkouts'] + sum(stats['timeouts'].values())
+            result[name] = {
+                **self._occupancy(engine.pool),
+                'since': stats['since'],
+                'checkouts': stats['checkouts'],
+                'connections_opened': stats['connections_opened'],
+                'connections_invalidated': stats['connections_invalidated'],
+                'wait_ms_mean': round(stats['wait_seconds_total'] * 1000 / waited, 3) if waited else None,
+                # Buckets in order, each counting the waits above the previous bound up to its own
+                'wait_histogram': [{'le_ms': bound, 'count': count} for bound, count in
+                                   zip(list(CHECKOUT_WAIT_BUCKETS_MS) + [None], stats['wait_histogram'])],
+                'slowest_checkouts': [
+                    {'wait_ms': round(wait * 1000, 3), 'at': at, 'endpoint': endpoint}
+                    for wait, at, endpoint in sorted(stats['slowest'], reverse=True)
+                ],
+                'timeouts': sum(stats['timeouts'].values()),
+                'timeouts_by_endpoint': stats['timeouts'],
+            }
+        return result
+
+
+pool_monitor = PoolMonitor()
+
+
+class _MonitoredPool:
+    """Times every checkout (a wait for a free connection or a new connection included) for pool_monitor"""
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except PoolTimeoutError:
+            pool_monitor.record_checkout(self._orig_logging_name, time.perf_counter() - started, timed_out=True)
+            raise
+        pool_monitor.record_checkout(self._orig_logging_name, time.perf_counter() - started)
+        return connection
+
+
+class MonitoredQueuePool(_MonitoredPool, QueuePool):
+    pass
+
+
+class MonitoredNullPool(_MonitoredPool, NullPool):
+    pass
+
+
+def engine_options(config, url, name: str = 'primary') -> Dict:
+    """
+    create_engine options for the app's engine on url: POOL_OPTIONS, with the
+    pool sized to this worker's share of DATABASE_MAX_CONNECTIONS when set, or
+    replaced by NullPool with DATABASE_NULL_POOL (a PgBouncer pools instead).
+    With DATABASE_PGBOUNCER, no server-side prepared statements are used. The
+    pool is monitored under `name` once the engine is registered with pool_monitor.
+    Raises RuntimeError if the budget leaves a worker fewer than
+    MIN_CONNECTIONS_PER_WORKER connections.
+    """
+    options = dict(config['POOL_OPTIONS'])
+    options['pool_logging_name'] = name
+    if config.get('DATABASE_NULL_POOL'):
+        for option in ('pool_size', 'max_overflow', 'pool_timeout'):
+            options.pop(option, None)
+        options['poolclass'] = MonitoredNullPool
+    else:
+        options['poolclass'] = MonitoredQueuePool
+        if config.get('DATABASE_MAX_CONNECTIONS'):
+            # Every worker process has its own pool; together they stay within the budget
+            workers = max(1, config.get('WEB_CONCURRENCY', 1))
+            per_worker = config['DATABASE_MAX_CONNECTIONS'] // workers
+            if per_worker < MIN_CONNECTIONS_PER_WORKER:
+                raise RuntimeError(f"DATABASE_MAX_CONNECTIONS={config['DATABASE_MAX_CONNECTIONS']} leaves {per_worker} "
+                                   f"connection(s) to each of {workers} worker(s), at least "
+                                   f"{MIN_CONNECTIONS_PER_WORKER} are needed")
+            options['max_overflow'] = per_worker // 3
+            options['pool_size'] = per_worker - options['max_overflow']
+    if config.get('DATABASE_PGBOUNCER') and make_url(url).get_driver_name() == 'psycopg':
+        # psycopg2 never prepares statements; psycopg 3 does after a few executions of one
+        options['connect_args'] = {**options.get('connect_args', {}), 'prepare_threshold': None}
+    return options
@@ -0,0 +1,44 @@
+from typing import Optional, Tuple, Union
+from datetime import datetime
+import base64
+import binascii
+import json
+
+# Page sizes for keyset-paginated listings
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(tstamp: datetime, row_id: Union[int, str]) -> str:
+    """Opaque token for the (timestamp, id) key of the last row of a page"""
+    payload = json.dumps([tstamp.isoformat(), row_id], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+
+def decode_cursor(token: Optional[str], id_type: type = int) -> Optional[Tuple[datetime, Union[int, str]]]:
+    """
+    (timestamp, id) from an encode_cursor token, None for no token. Raises
+    ValueError if malformed: the timestamp must be timezone-aware and the id of
+    id_type (int for signals, str for alert logs).
+    """
+    if not token:
+        return None
+    try:
+        payload = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        tstamp, row_id = json.loads(payload)
+        tstamp = datetime.fromisoformat(tstamp)
+    except (binascii.Error, ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+    # type() rather than isinstance(): JSON true / false would pass as an int
+    if tstamp.tzinfo is None or type(row_id) is not id_type:
+        raise ValueError("Invalid cursor")
+    return tstamp, row_id
+
+
+def page_size(value: Optional[int]) -> int:
+    """Validated page size from a limit query arg. Raises ValueError if out of range."""
+    if value is None:
+        return DEFAULT_PAGE_SIZE
+    if not 1 <= value <= MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+    return value
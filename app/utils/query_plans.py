@@ -0,0 +1,20 @@
+from typing import Dict, Iterator
+from sqlalchemy.orm import Session
+
+
+def explain_plan(session: Session, statement) -> Dict:
+    """Top plan node of statement from EXPLAIN (FORMAT JSON), without running it"""
+    compiled = statement.compile(dialect=session.get_bind().dialect, compile_kwargs={'render_postcompile': True})
+    cursor = session.connection().connection.cursor()
+    try:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params)
+        return cursor.fetchone()[0][0]['Plan']
+    finally:
+        cursor.close()
+
+
+def plan_nodes(plan: Dict) -> Iterator[Dict]:
+    """Every node of a plan tree, parents first"""
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from plan_nodes(child)
@@ -1,5 +1,6 @@
 from datetime import datetime, timedelta, timezone
-from ..models import Signal, SensorMetrics
+from sqlalchemy import and_, or_, not_, func
+from ..models import Signal
 
 def parse_sensor_states(data_string):
     """
@@ -46,35 +47,14 @@ def add_sensor_data(controlador, sensor_states):
     )
     return new_signal
 
-def update_sensor_metrics(session, controlador, new_signal, last_signal):
-    """Update metrics for each sensor"""
-    if not last_signal:
-        return
-        
-    metrics = controlador.metrics
-    if not metrics:
-        metrics = SensorMetrics(controlador_id=controlador.id)
-        session.add(metrics)
-    
-    current_time = new_signal.tstamp
-    time_diff = (current_time - last_signal.tstamp).total_seconds() / 60
-    
-    if time_diff > 5:  # More than 5 minutes between signals
-        return
-        
-    for i in range(1, 7):
-        sensor_key = f'value_sensor{i}'
-        new_value = getattr(new_signal, sensor_key)
-        sensor_config = controlador.config.get(sensor_key, {})
-        sensor_tipo = sensor_config.get('tipo', 'NA')
-        
-        if is_sensor_connected(sensor_tipo, new_value):
-            current_time = getattr(metrics, f'time_{sensor_key}', 0.0)
-            setattr(metrics, f'time_{sensor_key}', current_time + time_diff)
-
 def is_sensor_connected(tipo, sensor_reading):
     if tipo == "NA":
         return not sensor_reading
     if tipo == "NC":
         return sensor_reading
-    return False
\ No newline at end of file
+    return False
+
+def sensor_connected_predicate(sensor_reading, tipo):
+    """SQL form of is_sensor_connected for a sensor column and a tipo expression (NULL readings count as False)"""
+    value = func.coalesce(sensor_reading, False)
+    return or_(and_(tipo == 'NA', not_(value)), and_(tipo == 'NC', value))
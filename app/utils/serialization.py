@@ -0,0 +1,79 @@
+from datetime import date, datetime, time
+from decimal import Decimal
+import gzip
+import json
+import numpy as np
+from flask import current_app, request, make_response, Response
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+JSON_MIMETYPE = 'application/json'
+
+
+def _default(obj):
+    """Types neither serializer handles natively (orjson covers datetimes and NumPy arrays itself)"""
+    if isinstance(obj, (datetime, date, time)):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(data) -> bytes:
+    """
+    JSON bytes for data. Uses orjson when installed (datetimes are written in
+    isoformat, like marshal_with's fields.DateTime); stdlib json otherwise.
+    """
+    if orjson is not None:
+        return orjson.dumps(data, default=_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(data, default=_default, separators=(',', ':')).encode()
+
+
+def output_json(data, code, headers=None):
+    """flask-restx representation for application/json using dumps()"""
+    if isinstance(data, Response):
+        # Error paths return (jsonify(...), code)
+        data.status_code = code
+        return data
+    response = make_response(dumps(data), code)
+    response.headers.extend(headers or {})
+    response.mimetype = JSON_MIMETYPE
+    return response
+
+
+def compress_response(response):
+    """
+    after_request hook: gzip JSON bodies of at least GZIP_MIN_BYTES when the
+    client accepts it. Strong ETags get a -gzip suffix, since the encoded bytes
+    differ from the identity representation.
+    """
+    min_bytes = current_app.config.get('GZIP_MIN_BYTES')
+    if (not min_bytes
+            or response.status_code != 200
+            or response.direct_passthrough
+            or response.is_streamed
+            or response.mimetype != JSON_MIMETYPE
+            or 'Content-Encoding' in response.headers
+            or 'gzip' not in request.accept_encodings):
+        return response
+
+    body = response.get_data()
+    if len(body) < min_bytes:
+        return response
+
+    response.set_data(gzip.compress(body, compresslevel=current_app.config.get('GZIP_LEVEL', 6)))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(f"{etag}-gzip")
+    return response
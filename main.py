@@ -1,9 +1,11 @@
-import eventlet
-eventlet.monkey_patch()
+# Analytics pool workers (multiprocessing spawn) re-run this file as __mp_main__:
+# everything that patches, builds the app or starts the server is guarded, so they
+# import neither eventlet nor the app.
+if __name__ == '__main__':
+    import eventlet
+    eventlet.monkey_patch()
 
 import os
-from flask import Flask, request
-from app import create_app, socketio
 import logging
 import sys
 from logging.handlers import RotatingFileHandler
@@ -65,11 +67,13 @@ def setup_logging():
 
     return logging.getLogger(__name__)
 
-# Set up logging
-logger = setup_logging()
+logger = logging.getLogger(__name__)
 
 def create_and_configure_app(config_name):
     """Create and configure the Flask application"""
+    from flask import request
+    from app import create_app
+
     logger.info(f"Creating app with config: {config_name}")
     try:
         app = create_app(config_name)
@@ -102,29 +106,36 @@ def create_and_configure_app(config_name):
         logger.error(f"Error creating app: {str(e)}", exc_info=True)
         return None
 
-# Determine environment
-env_prefix = 'production' if os.getenv('FLASK_ENV') == 'production' else 'development'
-logger.info(f"Environment prefix: {env_prefix}")
+def add_routes(session_app):
+    @session_app.route('/test')
+    def test_route():
+        logger.info("Test route accessed")
+        return "Session app is running!"
 
-# Create session app
-session_app = create_and_configure_app(f'{env_prefix}_session')
+    @session_app.route('/')
+    def home():
+        logger.info("Home route accessed")
+        return "IoT Backend is running!"
 
-if session_app is None:
-    logger.error("Failed to create session app")
-    sys.exit(1)
+if __name__ == '__main__':
+    from app import socketio
 
-# Add routes
-@session_app.route('/test')
-def test_route():
-    logger.info("Test route accessed")
-    return "Session app is running!"
+    # Set up logging
+    logger = setup_logging()
 
-@session_app.route('/')
-def home():
-    logger.info("Home route accessed")
-    return "IoT Backend is running!"
+    # Determine environment
+    env_prefix = 'production' if os.getenv('FLASK_ENV') == 'production' else 'development'
+    logger.info(f"Environment prefix: {env_prefix}")
+
+    # Create session app
+    session_app = create_and_configure_app(f'{env_prefix}_session')
+
+    if session_app is None:
+        logger.error("Failed to create session app")
+        sys.exit(1)
+
+    add_routes(session_app)
 
-if __name__ == '__main__':
     port = int(os.getenv('PORT', 5000))
     
     if os.getenv('FLASK_ENV') == 'production':
@@ -147,4 +158,4 @@ if __name__ == '__main__':
         )
     except Exception as e:
         logger.error(f"Error starting server: {e}", exc_info=True)
-        sys.exit(1)
\ No newline at end of file
+        sys.exit(1)
@@ -0,0 +1,37 @@
+import os
+import sys
+import json
+import subprocess
+import unittest
+from app.services.service_analytics import _get_process_pool, _discard_process_pool
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Run in a worker through eval, a builtin, so the probe itself imports nothing. Every
+# spawned worker has an __mp_main__ module; it must not be a re-run of main.py.
+WORKER_MODULES = ("[name for name, module in __import__('sys').modules.items() if name in ('app', 'main') "
+                  "or getattr(module, '__file__', '') == __import__('os').path.join(REPO_ROOT, 'main.py')]")
+# What a spawned worker does with the server's main module (multiprocessing.spawn.prepare)
+MP_MAIN_PROBE = """
+import json, runpy, sys
+runpy.run_path('main.py', run_name='__mp_main__')
+print(json.dumps(sorted(name for name in sys.modules if name in ('app', 'eventlet', 'flask'))))
+"""
+
+
+class AnalyticsPoolTest(unittest.TestCase):
+    def test_worker_imports_neither_app_nor_main(self):
+        pool = _get_process_pool(1)
+        try:
+            modules = pool.submit(eval, WORKER_MODULES, {'REPO_ROOT': REPO_ROOT}).result(timeout=60)
+        finally:
+            _discard_process_pool(pool)
+        self.assertEqual(modules, [])
+
+    def test_main_module_rerun_by_workers_builds_nothing(self):
+        result = subprocess.run([sys.executable, '-c', MP_MAIN_PROBE], cwd=REPO_ROOT,
+                                capture_output=True, text=True, timeout=60, check=True)
+        self.assertEqual(json.loads(result.stdout.splitlines()[-1]), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
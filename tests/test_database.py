@@ -0,0 +1,33 @@
+import unittest
+from app.utils.database import engine_options, MIN_CONNECTIONS_PER_WORKER
+
+URL = 'postgresql+psycopg2://postgres@localhost/postgres'
+
+
+def pool_sizes(max_connections, workers):
+    options = engine_options({'DATABASE_MAX_CONNECTIONS': max_connections, 'WEB_CONCURRENCY': workers,
+                              'POOL_OPTIONS': {}}, URL)
+    return options['pool_size'], options['max_overflow']
+
+
+class ConnectionBudgetTest(unittest.TestCase):
+    def test_splits_budget_between_workers(self):
+        self.assertEqual(pool_sizes(40, 4), (7, 3))
+        self.assertEqual(pool_sizes(7, 2), (2, 1))
+
+    def test_smallest_budget(self):
+        for workers in (1, 2, 4):
+            with self.subTest(workers=workers):
+                pool_size, max_overflow = pool_sizes(MIN_CONNECTIONS_PER_WORKER * workers, workers)
+                self.assertGreaterEqual(pool_size, 1)
+                self.assertEqual(pool_size + max_overflow, MIN_CONNECTIONS_PER_WORKER)
+
+    def test_rejects_budget_below_minimum(self):
+        for max_connections, workers in ((MIN_CONNECTIONS_PER_WORKER * 2 - 1, 2), (2, 1), (4, 4)):
+            with self.subTest(max_connections=max_connections, workers=workers):
+                with self.assertRaisesRegex(RuntimeError, 'DATABASE_MAX_CONNECTIONS'):
+                    pool_sizes(max_connections, workers)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,27 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+from flask import Flask
+from app.services.liveness_service import LivenessTracker
+
+
+def app_with(**config):
+    app = Flask(__name__)
+    app.config.update({'WEB_CONCURRENCY': 1, 'REDIS_URL': None, **config})
+    return app
+
+
+class SharedLivenessGuardTest(unittest.TestCase):
+    def test_single_worker_in_process(self):
+        tracker = LivenessTracker(app_with())
+        tstamp = datetime(2024, 5, 1, 12, 30, tzinfo=timezone.utc)
+        tracker.touch('c1', tstamp)
+        tracker.touch('c1', tstamp - timedelta(minutes=5))
+        self.assertEqual(tracker.last_seen(['c1', 'c2']), {'c1': tstamp.timestamp()})
+
+    def test_workers_without_redis_refuse_to_start(self):
+        with self.assertRaisesRegex(RuntimeError, 'REDIS_URL'):
+            LivenessTracker(app_with(WEB_CONCURRENCY=4))
+
+
+if __name__ == '__main__':
+    unittest.main()
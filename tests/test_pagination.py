@@ -0,0 +1,41 @@
+import base64
+import json
+import unittest
+from datetime import datetime, timezone
+from app.utils.pagination import encode_cursor, decode_cursor
+
+
+def token(payload):
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+
+
+class DecodeCursorTest(unittest.TestCase):
+    tstamp = datetime(2024, 5, 1, 12, 30, tzinfo=timezone.utc)
+
+    def test_round_trip(self):
+        self.assertEqual(decode_cursor(encode_cursor(self.tstamp, 42), int), (self.tstamp, 42))
+        self.assertEqual(decode_cursor(encode_cursor(self.tstamp, 'log-1'), str), (self.tstamp, 'log-1'))
+
+    def test_no_token(self):
+        self.assertIsNone(decode_cursor(None))
+        self.assertIsNone(decode_cursor(''))
+
+    def test_rejects_naive_timestamp(self):
+        with self.assertRaises(ValueError):
+            decode_cursor(token(['2024-05-01T12:30:00', 42]), int)
+
+    def test_rejects_wrong_id_type(self):
+        for row_id, id_type in (('42', int), (True, int), (4.2, int), ([42], int), (42, str), (None, str)):
+            with self.subTest(row_id=row_id, id_type=id_type.__name__):
+                with self.assertRaises(ValueError):
+                    decode_cursor(token([self.tstamp.isoformat(), row_id]), id_type)
+
+    def test_rejects_malformed_token(self):
+        for bad in ('%%%', token({'tstamp': 1}), token(7), token([1, 2]), token(['yesterday', 42])):
+            with self.subTest(token=bad):
+                with self.assertRaises(ValueError):
+                    decode_cursor(bad, int)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,251 @@
+"""
+Query plan regression tests for the hot queries of ingest, the dashboard,
+alerts and retention.
+
+They need a scratch PostgreSQL database in TEST_DATABASE_URL and are skipped
+without one. The first run seeds a synthetic fleet (companies 'plan1'...),
+which is kept for the next runs. Each query is EXPLAINed (FORMAT JSON) and
+fails if its plan has a sequential scan, or a sort it is not expected to need.
+
+    TEST_DATABASE_URL=postgresql://... python -m pytest tests/test_query_plans.py
+"""
+import os
+import json
+import unittest
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import create_engine, select, text, true, tuple_
+from sqlalchemy.orm import sessionmaker
+from app.models import db, Controlador, Signal, Aviso, AvisoLog, SensorMetrics
+from app.services.signal_queries import reading_durations, _recent_signals_lateral, SIGNAL_ROW_FIELDS
+from app.services.export_service import export_select, EXPORT_BATCH_ROWS
+from app.services.retention_service import _not_referenced
+from app.utils.query_plans import explain_plan, plan_nodes
+
+TEST_DATABASE_URL = os.environ.get('TEST_DATABASE_URL')
+
+PLAN_EMPRESA_PREFIX = 'plan'
+PLAN_CONTROLADOR_PREFIX = 'q'
+COMPANIES = 50
+CONTROLLERS_PER_COMPANY = 20
+# About a week of readings per controller
+SIGNALS = 1_000_000
+STEP_SECONDS = 600
+ALERTS_PER_CONTROLLER = 3
+LOGS_PER_ALERT = 30
+SORTS = {'Sort', 'Incremental Sort'}
+
+
+def seed(engine):
+    """Create the plan-check fleet: COMPANIES companies of CONTROLLERS_PER_COMPANY controllers"""
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        exists = conn.execute(text("SELECT 1 FROM empresas WHERE id = :id"), {"id": f"{PLAN_EMPRESA_PREFIX}1"}).first()
+        if exists:
+            return
+
+        params = {"empresa": PLAN_EMPRESA_PREFIX, "controlador": PLAN_CONTROLADOR_PREFIX, "companies": COMPANIES,
+                  "controllers": COMPANIES * CONTROLLERS_PER_COMPANY, "per_company": CONTROLLERS_PER_COMPANY,
+                  "signals": SIGNALS, "step": STEP_SECONDS, "alerts": ALERTS_PER_CONTROLLER, "logs": LOGS_PER_ALERT}
+        conn.execute(text("""
+            INSERT INTO empresas (id, name)
+            SELECT :empresa || g, 'Plan check ' || g FROM generate_series(1, :companies) AS g
+        """), params)
+        conn.execute(text("""
+            INSERT INTO controladores (id, name, empresa_id, config)
+            SELECT :controlador || g, 'Plan check ' || g, :empresa || (1 + (g - 1) / :per_company), CAST(:config AS JSONB)
+            FROM generate_series(1, :controllers) AS g
+        """), {**params, "config": json.dumps({
+            f"value_sensor{i}": {"name": f"Sensor {i}", "email": False, "tipo": "NA"} for i in range(1, 7)
+        })})
+        conn.execute(text("""
+            INSERT INTO signals (controlador_id, tstamp, value_sensor1, value_sensor2, value_sensor3,
+                                 value_sensor4, value_sensor5, value_sensor6)
+            SELECT :controlador || (1 + g % :controllers),
+                   now() - make_interval(secs => (g / :controllers) * :step),
+                   random() < 0.5, random() < 0.5, random() < 0.5,
+                   random() < 0.5, random() < 0.5, random() < 0.5
+            FROM generate_series(0, :signals - 1) AS g
+        """), params)
+        # One alert in ten is inactive; only the latest log of one alert in five is unresolved
+        conn.execute(text("""
+            INSERT INTO avisos (id, controlador_id, name, is_active, config)
+            SELECT :controlador || c || '-' || a, :controlador || c, 'Alert ' || a, (c + a) % 10 <> 0,
+                   '{"sensor_name": "Sensor 1", "condition": "On"}'
+            FROM generate_series(1, :controllers) AS c, generate_series(1, :alerts) AS a
+        """), params)
+        conn.execute(text("""
+            INSERT INTO aviso_logs (id, aviso_id, triggered_at, sensor_name, old_value, new_value, signal_id,
+                                    resolved, resolved_at)
+            SELECT avisos.id || '-' || l, avisos.id, now() - make_interval(hours => l),
+                   'Sensor 1', false, true,
+                   CASE WHEN l % 10 = 0 THEN (SELECT max(id) FROM signals WHERE controlador_id = avisos.controlador_id) END,
+                   l > 1 OR right(avisos.id, 1) <> '1', now() - make_interval(hours => l) + interval '10 minutes'
+            FROM avisos, generate_series(1, :logs) AS l
+            WHERE avisos.controlador_id LIKE :controlador || '%'
+        """), params)
+        conn.execute(text("""
+            INSERT INTO sensor_metrics (id, controlador_id, watermark, connected_time_minutes,
+                                        time_value_sensor1, time_value_sensor2, time_value_sensor3,
+                                        time_value_sensor4, time_value_sensor5, time_value_sensor6)
+            SELECT 'plan-' || id, id, now(), 0, 0, 0, 0, 0, 0, 0
+            FROM controladores WHERE empresa_id LIKE :empresa || '%'
+        """), params)
+    with engine.connect() as conn:
+        conn.execution_options(isolation_level='AUTOCOMMIT').execute(text("VACUUM ANALYZE"))
+
+
+def hot_queries(empresa_id, controlador_id, controlador_ids, alert_id, alert_ids, now):
+    """
+    (name, statement, allowed sort node types) of each checked query, built the
+    way the code using it does (see each comment)
+    """
+    day_ago = now - timedelta(days=1)
+    recent = _recent_signals_lateral(1, Signal.controlador_id, *[getattr(Signal, name) for name in SIGNAL_ROW_FIELDS])
+    log_page = select(AvisoLog).where(
+        AvisoLog.aviso_id == Aviso.id,
+        AvisoLog.triggered_at.between(now - timedelta(days=7), now),
+        tuple_(AvisoLog.triggered_at, AvisoLog.id) < tuple_(now - timedelta(days=1), '')
+    ).order_by(AvisoLog.triggered_at.desc(), AvisoLog.id.desc()).limit(101).lateral('recent_logs')
+
+    return [
+        # api/arduino.py: previous signal of the controller at every ingest
+        ('ingest_previous_signal',
+         select(Signal).where(Signal.controlador_id == controlador_id).order_by(Signal.tstamp.desc()).offset(1).limit(1),
+         set()),
+        # signal_queries.recent_signal_rows: latest reading of each listed controller. The
+        # final ordering sorts the (one per controller) LATERAL results only.
+        ('latest_signal_per_controller',
+         select(recent).select_from(Controlador).join(recent, true()).
+         where(Controlador.id.in_(controlador_ids)).order_by(recent.c.controlador_id, recent.c.tstamp.desc()),
+         SORTS),
+        # signal_queries.signal_page: keyset page of a controller's signals
+        ('signal_page',
+         select(*[getattr(Signal, name) for name in SIGNAL_ROW_FIELDS]).
+         where(Signal.controlador_id == controlador_id, tuple_(Signal.tstamp, Signal.id) < tuple_(day_ago, 0)).
+         order_by(Signal.tstamp.desc(), Signal.id.desc()).limit(101),
+         set()),
+        # signal_queries.reading_durations: a controller's readings in a dashboard window.
+        # Readings of one controller are spread over the table, so the planner may fetch
+        # the (small) window by bitmap and sort it rather than walk the index.
+        ('controller_window', select(reading_durations(controlador_id, day_ago, now)), SORTS),
+        # export_service.copy_batches: one batch of a controller's export (same as above
+        # while the window holds fewer rows than a batch)
+        ('controller_export_batch',
+         export_select(now - timedelta(days=7), now, Signal.controlador_id == controlador_id).limit(EXPORT_BATCH_ROWS),
+         SORTS),
+        # Controllers of a company (dashboard listings, analytics, retention)
+        ('company_controllers', select(Controlador.id).where(Controlador.empresa_id == empresa_id), set()),
+        # services/alert_service.py and api/alerts.py: active alerts of a controller
+        ('active_alerts',
+         select(Aviso).where(Aviso.controlador_id == controlador_id, Aviso.is_active == True),  # noqa: E712
+         set()),
+        # services/alert_service.py: latest unresolved log of an alert, at every ingest
+        ('latest_unresolved_log',
+         select(AvisoLog).where(AvisoLog.aviso_id == alert_id, AvisoLog.resolved == False).  # noqa: E712
+         order_by(AvisoLog.triggered_at.desc()).limit(1),
+         set()),
+        # api/alerts.py: latest log of an alert (active alerts listing)
+        ('latest_log',
+         select(AvisoLog).where(AvisoLog.aviso_id == alert_id).order_by(AvisoLog.triggered_at.desc()).limit(1),
+         set()),
+        # api/alerts.py get_alert_logs: the per-alert LATERAL pages are merged with a
+        # bounded sort of at most (limit + 1) rows per alert
+        ('alert_log_page',
+         select(log_page).select_from(Aviso).join(log_page, true()).where(Aviso.controlador_id == controlador_id).
+         order_by(log_page.c.triggered_at.desc(), log_page.c.id.desc()).limit(101),
+         SORTS),
+        # api/dashboard.py: clearing a controller's alert logs
+        ('alert_logs_of_alerts', select(AvisoLog.id).where(AvisoLog.aviso_id.in_(alert_ids)), set()),
+        # retention_service.delete_before: unreferenced signals of a controller in an hour
+        ('unreferenced_signals',
+         select(Signal.id).where(Signal.controlador_id == controlador_id, Signal.tstamp >= day_ago,
+                                 Signal.tstamp < day_ago + timedelta(hours=1), _not_referenced()),
+         set()),
+        # sensor_metrics_service.lifetime_metrics
+        ('lifetime_metrics', select(SensorMetrics).where(SensorMetrics.controlador_id == controlador_id), set()),
+    ]
+
+
+def plan_problems(session, statement, allowed_sorts):
+    """(plan shape, offending nodes) of statement: sequential scans and sorts not in allowed_sorts"""
+    problems, shape = [], []
+    for node in plan_nodes(explain_plan(session, statement)):
+        relation = f" on {node['Relation Name']}" if 'Relation Name' in node else ''
+        relation += f" using {node['Index Name']}" if 'Index Name' in node else ''
+        shape.append(f"{node['Node Type']}{relation}")
+        if node['Node Type'] == 'Seq Scan' or (node['Node Type'] in SORTS and node['Node Type'] not in allowed_sorts):
+            problems.append(f"{node['Node Type']}{relation}")
+    return ' > '.join(shape), problems
+
+
+@unittest.skipUnless(TEST_DATABASE_URL, 'TEST_DATABASE_URL is not set')
+class QueryPlanTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.engine = create_engine(TEST_DATABASE_URL)
+        seed(cls.engine)
+        cls.session = sessionmaker(bind=cls.engine)()
+        empresa_id = f"{PLAN_EMPRESA_PREFIX}{COMPANIES // 2}"
+        controlador_ids = cls.session.execute(
+            select(Controlador.id).where(Controlador.empresa_id == empresa_id).order_by(Controlador.id)
+        ).scalars().all()
+        alert_ids = cls.session.execute(
+            select(Aviso.id).where(Aviso.controlador_id == controlador_ids[0]).order_by(Aviso.id)
+        ).scalars().all()
+        cls.queries = {
+            name: (statement, allowed_sorts) for name, statement, allowed_sorts in
+            hot_queries(empresa_id, controlador_ids[0], controlador_ids, alert_ids[0], alert_ids,
+                        datetime.now(timezone.utc))
+        }
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.session.close()
+        cls.engine.dispose()
+
+    def assertPlanUsesIndexes(self, name):
+        shape, problems = plan_problems(self.session, *self.queries[name])
+        self.assertEqual(problems, [], f"{name}: {shape}")
+
+    def test_ingest_previous_signal(self):
+        self.assertPlanUsesIndexes('ingest_previous_signal')
+
+    def test_latest_signal_per_controller(self):
+        self.assertPlanUsesIndexes('latest_signal_per_controller')
+
+    def test_signal_page(self):
+        self.assertPlanUsesIndexes('signal_page')
+
+    def test_controller_window(self):
+        self.assertPlanUsesIndexes('controller_window')
+
+    def test_controller_export_batch(self):
+        self.assertPlanUsesIndexes('controller_export_batch')
+
+    def test_company_controllers(self):
+        self.assertPlanUsesIndexes('company_controllers')
+
+    def test_active_alerts(self):
+        self.assertPlanUsesIndexes('active_alerts')
+
+    def test_latest_unresolved_log(self):
+        self.assertPlanUsesIndexes('latest_unresolved_log')
+
+    def test_latest_log(self):
+        self.assertPlanUsesIndexes('latest_log')
+
+    def test_alert_log_page(self):
+        self.assertPlanUsesIndexes('alert_log_page')
+
+    def test_alert_logs_of_alerts(self):
+        self.assertPlanUsesIndexes('alert_logs_of_alerts')
+
+    def test_unreferenced_signals(self):
+        self.assertPlanUsesIndexes('unreferenced_signals')
+
+    def test_lifetime_metrics(self):
+        self.assertPlanUsesIndexes('lifetime_metrics')
+
+
+if __name__ == '__main__':
+    unittest.main()
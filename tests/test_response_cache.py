@@ -0,0 +1,51 @@
+import unittest
+from flask import Flask
+from flask_restx import Api, Resource
+from app.extensions import cache
+from app.services.response_cache import init_response_cache, cached_response
+
+
+def app_with(**config):
+    app = Flask(__name__)
+    app.config.update({'WEB_CONCURRENCY': 1, 'REDIS_URL': None, 'CACHE_TYPE': 'SimpleCache',
+                       'DASHBOARD_CACHE_TIMEOUT': 60, 'DASHBOARD_ETAGS': True, **config})
+    cache.init_app(app)
+    init_response_cache(app)
+
+    api = Api(app)
+
+    @api.route('/controlador/<string:controlador_id>/reading')
+    class Reading(Resource):
+        @cached_response('controlador')
+        def get(self, controlador_id):
+            return {'controlador_id': controlador_id}
+
+    return app
+
+
+class SharedCacheGuardTest(unittest.TestCase):
+    def test_single_worker_keeps_cache(self):
+        self.assertEqual(app_with().config['DASHBOARD_CACHE_TIMEOUT'], 60)
+
+    def test_workers_with_redis_keep_cache(self):
+        app = app_with(WEB_CONCURRENCY=4, REDIS_URL='redis://localhost:6379/0')
+        self.assertEqual(app.config['DASHBOARD_CACHE_TIMEOUT'], 60)
+
+    def test_workers_without_redis_disable_cache(self):
+        with self.assertLogs('app.services.response_cache', 'WARNING'):
+            app = app_with(WEB_CONCURRENCY=4)
+        self.assertEqual(app.config['DASHBOARD_CACHE_TIMEOUT'], 0)
+
+    def test_single_worker_revalidates_etag(self):
+        client = app_with().test_client()
+        etag = client.get('/controlador/c1/reading').headers['ETag']
+        self.assertEqual(client.get('/controlador/c1/reading', headers={'If-None-Match': etag}).status_code, 304)
+
+    def test_workers_without_redis_send_no_etag(self):
+        with self.assertLogs('app.services.response_cache', 'WARNING'):
+            client = app_with(WEB_CONCURRENCY=4).test_client()
+        self.assertNotIn('ETag', client.get('/controlador/c1/reading').headers)
+
+
+if __name__ == '__main__':
+    unittest.main()